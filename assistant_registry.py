@@ -0,0 +1,455 @@
+"""
+Реестр AI-ассистентов пользователей с вытеснением
+
+Ассистент каждого пользователя хранит свою историю диалога. Чтобы память
+процесса не росла бесконечно, реестр вытесняет ассистентов:
+- давно не использованных (LRU) при превышении числа записей;
+- простаивающих дольше idle_ttl;
+- при превышении лимита памяти на историю.
+
+Вытесненный диалог можно сохранить в локальное хранилище (spill store)
+и восстановить при следующем сообщении пользователя.
+
+Ассистент, который сейчас генерирует ответ (взят через use()), не
+вытесняется: иначе сохраненный снимок диалога потерял бы этот ответ.
+Если такого ассистента нужно отдать другому процессу (evict_if),
+вытеснение откладывается до конца ответа.
+
+В боте реестр работает в event loop, поэтому aget() и use() читают и
+пишут хранилище в пуле потоков: медленный диск задерживает только
+пользователя, чей диалог загружается, а не все чаты. Синхронный get()
+делает то же прямо в вызывающем потоке.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def history_size_bytes(history):
+    """
+    Приблизительный объем истории диалога в памяти
+
+    Args:
+        history (list): Список сообщений
+
+    Returns:
+        int: Размер в байтах
+    """
+    return sum(sys.getsizeof(msg) + sys.getsizeof(msg['text']) for msg in history)
+
+
+class FileSpillStore:
+    """Хранилище вытесненных диалогов: один JSON-файл на пользователя"""
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): Каталог для файлов
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, f"{user_id}.json")
+
+    def save(self, user_id, state):
+        """
+        Сохранить состояние ассистента
+
+        Args:
+            user_id (int): ID пользователя
+            state (dict): Состояние из RussianAI.get_state()
+        """
+        tmp_path = self._path(user_id) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(user_id))
+
+    def load(self, user_id):
+        """
+        Забрать сохраненное состояние (файл удаляется)
+
+        Args:
+            user_id (int): ID пользователя
+
+        Returns:
+            dict: Состояние или None, если ничего не сохранено
+        """
+        path = self._path(user_id)
+        try:
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        os.remove(path)
+        return state
+
+
+class _Entry:
+    """Ассистент, время последнего обращения, учтенный размер истории и число пользователей"""
+
+    __slots__ = ('assistant', 'last_used', 'size', 'in_use', 'evicting', 'default_provider')
+
+    def __init__(self, assistant, default_provider):
+        self.assistant = assistant
+        self.last_used = time.monotonic()
+        self.size = 0
+        self.in_use = 0
+        # Вытеснить, как только ассистент освободится (отложенный evict_if)
+        self.evicting = False
+        # Провайдер нового ассистента: состояние с ним и без истории не сохраняется
+        self.default_provider = default_provider
+
+
+class AssistantRegistry:
+    """LRU-реестр ассистентов с TTL простоя и лимитом памяти"""
+
+    def __init__(self, factory, max_size=None, idle_ttl=None, max_memory_bytes=None,
+                 spill_store=None):
+        """
+        Args:
+            factory (callable): Создает нового ассистента: factory(user_id) -> RussianAI
+            max_size (int): Максимум ассистентов (ASSISTANT_CACHE_SIZE, 10000)
+            idle_ttl (float): Вытеснять после стольких секунд простоя
+                              (ASSISTANT_IDLE_TTL, 21600; 0 - не вытеснять)
+            max_memory_bytes (int): Лимит памяти на историю
+                                    (ASSISTANT_MEMORY_LIMIT_MB, 256 МБ)
+            spill_store: Хранилище вытесненных диалогов (save/load) или None
+        """
+        self.factory = factory
+        self.max_size = max_size or int(os.getenv('ASSISTANT_CACHE_SIZE', '10000'))
+        if idle_ttl is None:
+            idle_ttl = float(os.getenv('ASSISTANT_IDLE_TTL', '21600'))
+        self.idle_ttl = idle_ttl
+        if max_memory_bytes is None:
+            max_memory_bytes = int(float(os.getenv('ASSISTANT_MEMORY_LIMIT_MB', '256')) * 1024 * 1024)
+        self.max_memory_bytes = max_memory_bytes
+        self.spill_store = spill_store
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Загрузки и сохранения в пуле потоков, по user_id (только для aget)
+        self._loading = {}
+        self._saving = {}
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rehydrations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def get(self, user_id):
+        """
+        Получить ассистента пользователя (создать или восстановить при отсутствии)
+
+        Хранилище читается и пишется в вызывающем потоке; из event loop
+        используйте aget().
+
+        Args:
+            user_id (int): ID пользователя Telegram
+
+        Returns:
+            RussianAI: Ассистент пользователя
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                entry = self._add(user_id, self._create(user_id, self._load(user_id)))
+            else:
+                self.hits += 1
+            victims = self._touch(user_id, entry)
+        for victim in victims:
+            self._save(*victim)
+        return entry.assistant
+
+    async def aget(self, user_id):
+        """
+        Асинхронный get(): загрузка и сохранение диалогов в пуле потоков
+
+        Args:
+            user_id (int): ID пользователя Telegram
+
+        Returns:
+            RussianAI: Ассистент пользователя
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is not None:
+                    self.hits += 1
+                    victims = self._touch(user_id, entry)
+                    break
+                loading = self._loading.get(user_id)
+                if loading is None:
+                    loading = self._loading[user_id] = loop.create_future()
+                    entry = None
+                    break
+            # Диалог уже загружает другое обновление этого пользователя
+            await loading
+
+        if entry is None:
+            try:
+                saving = self._saving.get(user_id)
+                if saving is not None:
+                    # Сначала дописываем вытесненный раньше диалог, потом читаем
+                    await saving
+                state = await loop.run_in_executor(None, self._load, user_id)
+                with self._lock:
+                    entry = self._add(user_id, self._create(user_id, state))
+                    victims = self._touch(user_id, entry)
+            finally:
+                del self._loading[user_id]
+                loading.set_result(None)
+
+        self._save_async(loop, victims)
+        return entry.assistant
+
+    @asynccontextmanager
+    async def use(self, user_id):
+        """
+        Взять ассистента на время генерации ответа (его не вытеснят)
+
+        Args:
+            user_id (int): ID пользователя Telegram
+
+        Yields:
+            RussianAI: Ассистент пользователя
+        """
+        assistant = await self.aget(user_id)
+        with self._lock:
+            entry = self._entries[user_id]
+            entry.in_use += 1
+        try:
+            yield assistant
+        finally:
+            victims = []
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+                if self._entries.get(user_id) is entry:
+                    # История выросла на ответ - учитываем ее в лимите памяти
+                    self.memory_bytes -= entry.size
+                    entry.size = history_size_bytes(entry.assistant.dialog_history)
+                    self.memory_bytes += entry.size
+                    if entry.evicting and not entry.in_use:
+                        victims = self._pop(user_id)
+            self._save_async(asyncio.get_running_loop(), victims)
+
+    def _save_async(self, loop, victims):
+        """
+        Сохранить вытесненные диалоги в пуле потоков
+
+        Returns:
+            list: Futures сохранений
+        """
+        futures = []
+        for victim_id, state in victims:
+            future = loop.run_in_executor(None, self._save, victim_id, state)
+            self._saving[victim_id] = future
+            future.add_done_callback(lambda done, victim_id=victim_id: self._forget_save(victim_id, done))
+            futures.append(future)
+        return futures
+
+    def _forget_save(self, user_id, done):
+        if self._saving.get(user_id) is done:
+            del self._saving[user_id]
+
+    def _load(self, user_id):
+        """Прочитать вытесненный диалог из хранилища"""
+        return self.spill_store.load(user_id) if self.spill_store else None
+
+    def _create(self, user_id, state):
+        """Создать ассистента, восстановив вытесненный диалог, если он есть"""
+        assistant = self.factory(user_id)
+        default_provider = assistant.provider
+        if state is not None:
+            assistant.load_state(state)
+            self.rehydrations += 1
+            logger.info(f"♻️ Восстановлен диалог пользователя {user_id} ({len(state['history'])} сообщений)")
+        else:
+            logger.info(f"🆕 Создан новый ассистент для пользователя {user_id}")
+        return assistant, default_provider
+
+    def _add(self, user_id, created):
+        self.misses += 1
+        entry = self._entries[user_id] = _Entry(*created)
+        return entry
+
+    def _touch(self, user_id, entry):
+        """
+        Отметить обращение, пересчитать размер и применить лимиты
+
+        Returns:
+            list: Вытесненные (user_id, состояние для сохранения)
+        """
+        self._entries.move_to_end(user_id)
+        entry.last_used = time.monotonic()
+        # Пересчитываем размер: история могла вырасти с прошлого обращения
+        self.memory_bytes -= entry.size
+        entry.size = history_size_bytes(entry.assistant.dialog_history)
+        self.memory_bytes += entry.size
+        return self._expire_idle() + self._enforce_limits()
+
+    def _pop(self, user_id):
+        """
+        Удалить ассистента из реестра
+
+        Returns:
+            list: [(user_id, состояние)], если диалог нужно сохранить, иначе []
+        """
+        entry = self._entries.pop(user_id)
+        self.memory_bytes -= entry.size
+        if self.spill_store is None:
+            return []
+        assistant = entry.assistant
+        # Сохраняем все, что отличается от нового ассистента: и историю,
+        # и выбранного до первого сообщения провайдера
+        if not assistant.dialog_history and assistant.provider == entry.default_provider:
+            return []
+        state = assistant.get_state()
+        state['history'] = list(state['history'])
+        return [(user_id, state)]
+
+    def _save(self, user_id, state):
+        """Записать вытесненный диалог в spill store"""
+        try:
+            self.spill_store.save(user_id, state)
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить диалог пользователя {user_id}: {e}")
+
+    def _expire_idle(self):
+        """Вытеснить простаивающих ассистентов (они в начале LRU-порядка)"""
+        if not self.idle_ttl:
+            return []
+        deadline = time.monotonic() - self.idle_ttl
+        expired = []
+        for user_id, entry in self._entries.items():
+            if entry.last_used > deadline:
+                break
+            if not entry.in_use:
+                expired.append(user_id)
+        victims = []
+        for user_id in expired:
+            victims += self._pop(user_id)
+            self.expirations += 1
+        return victims
+
+    def _enforce_limits(self):
+        """Вытеснять самых давних, пока не уложимся в лимиты (последнего и занятых не трогаем)"""
+        victims = []
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_size or self.memory_bytes > self.max_memory_bytes
+        ):
+            newest = next(reversed(self._entries))
+            user_id = next((uid for uid, entry in self._entries.items() if not entry.in_use), newest)
+            if user_id == newest:
+                break
+            victims += self._pop(user_id)
+            self.evictions += 1
+        return victims
+
+    def _select(self, predicate, busy=False):
+        """
+        Вытеснить ассистентов выбранных пользователей; занятых - после ответа
+
+        Args:
+            predicate (callable): predicate(user_id) -> True, если вытеснить
+            busy (bool): Вытеснить и занятых сразу
+
+        Returns:
+            tuple: (вытесненные (user_id, состояние), вытеснено, отложено)
+        """
+        with self._lock:
+            user_ids = [user_id for user_id in self._entries if predicate(user_id)]
+            victims = []
+            deferred = 0
+            for user_id in user_ids:
+                entry = self._entries[user_id]
+                if entry.in_use and not busy:
+                    entry.evicting = True
+                    deferred += 1
+                else:
+                    victims += self._pop(user_id)
+        return victims, len(user_ids) - deferred, deferred
+
+    def evict_if(self, predicate):
+        """
+        Вытеснить ассистентов выбранных пользователей (с сохранением диалогов)
+
+        Занятый ассистент вытесняется, когда закончит ответ (use()).
+        Хранилище пишется в вызывающем потоке; из event loop используйте aevict_if().
+
+        Args:
+            predicate (callable): predicate(user_id) -> True, если вытеснить
+
+        Returns:
+            tuple: (вытеснено сразу, отложено до конца ответа)
+        """
+        victims, evicted, deferred = self._select(predicate)
+        for victim in victims:
+            self._save(*victim)
+        return evicted, deferred
+
+    async def aevict_if(self, predicate):
+        """
+        Асинхронный evict_if(): диалоги сохраняются в пуле потоков
+
+        Возвращается, когда записаны все вытесненные сразу диалоги (и начатые
+        раньше сохранения), поэтому их можно читать из другого процесса.
+
+        Args:
+            predicate (callable): predicate(user_id) -> True, если вытеснить
+
+        Returns:
+            tuple: (вытеснено сразу, отложено до конца ответа)
+        """
+        victims, evicted, deferred = self._select(predicate)
+        self._save_async(asyncio.get_running_loop(), victims)
+        if self._saving:
+            await asyncio.gather(*list(self._saving.values()))
+        return evicted, deferred
+
+    def evict_all(self):
+        """
+        Вытеснить всех ассистентов (при остановке бота диалоги уходят в spill store)
+
+        Процесс завершается, поэтому занятые ассистенты тоже сохраняются сразу.
+        """
+        victims, _, _ = self._select(lambda user_id: True, busy=True)
+        for victim in victims:
+            self._save(*victim)
+
+    def stats(self):
+        """
+        Статистика реестра
+
+        Returns:
+            dict: Размер, память и счетчики попаданий/вытеснений/восстановлений
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'in_use': sum(1 for entry in self._entries.values() if entry.in_use),
+                'memory_bytes': self.memory_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'rehydrations': self.rehydrations
+            }
@@ -0,0 +1,386 @@
+"""
+Пакетная обработка запросов к AI провайдерам из JSONL-файла
+
+Читает запросы построчно (файл не загружается в память целиком),
+отправляет их провайдеру с ограничением конкурентности и общего RPS и
+дописывает результаты в выходной JSONL по мере готовности.
+
+Входная строка:
+    {"id": "q1", "prompt": "Текст"}
+    {"id": "q2", "messages": [{"role": "user", "text": "..."}], "system": "..."}
+Необязательные поля: temperature, max_tokens. Без id используется номер строки.
+
+Выходная строка:
+    {"id": "q1", "ok": true, "response": "...", "provider": "yandex", "latency_ms": 812.4}
+    {"id": "q2", "ok": false, "error": "❌ ...", ...}
+
+Повторный запуск с тем же выходным файлом продолжает работу: запросы с
+успешным результатом пропускаются, а неудачные отправляются снова. С
+--yandex-async запросы идут через отложенную генерацию YandexGPT
+(completionAsync) с опросом операций; ID операций пишутся в файл
+<output>.checkpoint, и после перезапуска уже запущенные операции
+дочитываются, а не запускаются заново.
+
+Примеры:
+    python batch.py faq.jsonl answers.jsonl --provider sber --concurrency 20 --rps 5
+    python batch.py eval.jsonl eval_out.jsonl --yandex-async --concurrency 200
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+from providers import get_backend, is_error_response
+from rate_limiter import TokenBucket
+from http_pool import aclose_all
+
+logger = logging.getLogger(__name__)
+
+
+def iter_requests(path):
+    """
+    Читать запросы из JSONL по одному
+
+    Args:
+        path (str): Входной файл
+
+    Yields:
+        tuple: (id запроса, запрос dict или текст ошибки разбора)
+    """
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield str(line_number), f"❌ Строка {line_number} не JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield str(line_number), f"❌ Строка {line_number}: ожидается объект"
+                continue
+            yield str(record.get('id', line_number)), record
+
+
+def request_messages(record):
+    """
+    История сообщений для провайдера из входной записи
+
+    Args:
+        record (dict): Запись с полем prompt или messages
+
+    Returns:
+        list: [{'role': ..., 'text': ...}, ...]
+
+    Raises:
+        ValueError: В записи нет ни prompt, ни messages
+    """
+    if 'messages' in record:
+        messages = [
+            {'role': msg['role'], 'text': msg.get('text', msg.get('content', ''))}
+            for msg in record['messages']
+        ]
+    elif 'prompt' in record:
+        messages = [{'role': 'user', 'text': str(record['prompt'])}]
+    else:
+        raise ValueError("нет поля prompt или messages")
+    if record.get('system'):
+        messages.insert(0, {'role': 'system', 'text': record['system']})
+    return messages
+
+
+def load_completed(path):
+    """
+    ID запросов, уже успешно обработанных в прошлых запусках
+
+    Args:
+        path (str): Выходной файл
+
+    Returns:
+        set: ID запросов
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # Строка, недописанная при аварийной остановке
+                continue
+            if result.get('ok'):
+                completed.add(str(result['id']))
+    return completed
+
+
+def load_operations(path):
+    """
+    Операции отложенной генерации, запущенные в прошлых запусках
+
+    Args:
+        path (str): Файл контрольной точки
+
+    Returns:
+        dict: {id запроса: ID операции}
+    """
+    operations = {}
+    if not os.path.exists(path):
+        return operations
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            # Последняя запись побеждает; None - операция отброшена после ошибки
+            if entry['operation'] is None:
+                operations.pop(str(entry['id']), None)
+            else:
+                operations[str(entry['id'])] = entry['operation']
+    return operations
+
+
+class BatchRunner:
+    """Обработка потока запросов с ограничением конкурентности и RPS"""
+
+    def __init__(self, backend, output, checkpoint, concurrency=10, rps=None,
+                 yandex_async=False, poll_interval=2.0, operation_timeout=600.0, options=None):
+        """
+        Args:
+            backend (ProviderBackend): Клиент провайдера
+            output (str): Выходной JSONL (дописывается)
+            checkpoint (str): Файл ID операций отложенной генерации
+            concurrency (int): Запросов (операций) одновременно
+            rps (float): Общий лимит запросов в секунду (None - только лимит провайдера)
+            yandex_async (bool): Отложенная генерация YandexGPT с опросом
+            poll_interval (float): Интервал опроса операции, сек
+            operation_timeout (float): Сколько ждать операцию, сек
+            options (dict): temperature, max_tokens по умолчанию
+        """
+        self.backend = backend
+        self.output = output
+        self.checkpoint = checkpoint
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rps) if rps else None
+        self.yandex_async = yandex_async
+        self.poll_interval = poll_interval
+        self.operation_timeout = operation_timeout
+        self.options = options or {}
+        self.operations = {}
+        self.counters = {
+            'read': 0, 'skipped': 0, 'ok': 0, 'errors': 0, 'resumed_operations': 0, 'resubmitted_operations': 0
+        }
+        self._output_file = None
+        self._checkpoint_file = None
+
+    async def run(self, requests_iter, completed=()):
+        """
+        Обработать запросы
+
+        Следующая строка читается, только когда освобождается слот, поэтому
+        в памяти не больше concurrency запросов одновременно.
+
+        Args:
+            requests_iter: Итератор (id, запрос) из iter_requests()
+            completed (set): ID, которые нужно пропустить
+
+        Returns:
+            dict: Счетчики прогона
+        """
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        started = time.monotonic()
+
+        def release(task):
+            tasks.discard(task)
+            slots.release()
+
+        with open(self.output, 'a', encoding='utf-8') as self._output_file, \
+                open(self.checkpoint, 'a', encoding='utf-8') as self._checkpoint_file:
+            for request_id, record in requests_iter:
+                self.counters['read'] += 1
+                if request_id in completed:
+                    self.counters['skipped'] += 1
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(self._process(request_id, record))
+                task.add_done_callback(release)
+                tasks.add(task)
+            if tasks:
+                await asyncio.gather(*tasks)
+
+        self.counters['duration_s'] = round(time.monotonic() - started, 2)
+        return self.counters
+
+    async def _process(self, request_id, record):
+        """Выполнить один запрос и записать результат"""
+        started = time.monotonic()
+        if isinstance(record, str):
+            response = record
+        else:
+            try:
+                messages = request_messages(record)
+                options = dict(self.options)
+                options.update({name: record[name] for name in ('temperature', 'max_tokens') if name in record})
+                if self.yandex_async:
+                    response = await self._complete_operation(request_id, messages, options)
+                else:
+                    await self._throttle()
+                    response = await self.backend.arequest(messages, **options)
+            except Exception as e:
+                response = f"❌ Ошибка запроса {request_id}: {e}"
+
+        ok = not is_error_response(response)
+        self._write({
+            'id': request_id,
+            'ok': ok,
+            'response' if ok else 'error': response,
+            'provider': self.backend.name,
+            'latency_ms': round((time.monotonic() - started) * 1000, 1)
+        })
+        self.counters['ok' if ok else 'errors'] += 1
+        processed = self.counters['ok'] + self.counters['errors']
+        if processed % 100 == 0:
+            logger.info(f"📈 Обработано {processed} (ошибок {self.counters['errors']})")
+
+    async def _throttle(self):
+        if self.bucket is not None:
+            delay = self.bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _complete_operation(self, request_id, messages, options):
+        """
+        Отложенная генерация YandexGPT: запуск (или продолжение) и опрос
+
+        Операция из прошлого запуска, которая завершилась ошибкой или не
+        успела за operation_timeout, отбрасывается, и запрос запускается заново.
+
+        Returns:
+            str: Ответ или сообщение об ошибке
+        """
+        operation_id = self.operations.pop(request_id, None)
+        if operation_id is not None:
+            self.counters['resumed_operations'] += 1
+            response = await self._poll_operation(operation_id)
+            if not is_error_response(response):
+                return response
+            logger.warning(f"🔁 Операция {operation_id} запроса {request_id} не удалась, запускаю заново: {response}")
+            self.counters['resubmitted_operations'] += 1
+
+        await self._throttle()
+        operation_id = await self.backend.asubmit_operation(messages, **options)
+        self._checkpoint(request_id, operation_id)
+        response = await self._poll_operation(operation_id)
+        if is_error_response(response):
+            # Следующий запуск отправит запрос снова, а не будет опрашивать эту операцию
+            self._checkpoint(request_id, None)
+        return response
+
+    async def _poll_operation(self, operation_id):
+        """
+        Опрашивать операцию до результата или operation_timeout
+
+        Returns:
+            str: Ответ или сообщение об ошибке
+        """
+        deadline = time.monotonic() + self.operation_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            response = await self.backend.apoll_operation(operation_id)
+            if response is not None:
+                return response
+        return f"⏱ Операция {operation_id} не завершилась за {self.operation_timeout:.0f} с"
+
+    def _checkpoint(self, request_id, operation_id):
+        # Файл только дописывается: при загрузке последняя запись по id главная
+        self._checkpoint_file.write(json.dumps({'id': request_id, 'operation': operation_id}) + '\n')
+        self._checkpoint_file.flush()
+
+    def _write(self, result):
+        # Строка пишется целиком и сразу сбрасывается на диск: после сбоя
+        # повторный запуск увидит все завершенные запросы
+        self._output_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+        self._output_file.flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Пакетная обработка запросов к AI провайдерам')
+    parser.add_argument('input', help='Входной JSONL')
+    parser.add_argument('output', help='Выходной JSONL (дописывается, по нему продолжается работа)')
+    parser.add_argument('--provider', default=os.getenv('DEFAULT_PROVIDER', 'yandex'))
+    parser.add_argument('--concurrency', type=int, default=10, help='Запросов одновременно')
+    parser.add_argument('--rps', type=float, help='Общий лимит запросов в секунду')
+    parser.add_argument('--temperature', type=float, help='Температура по умолчанию')
+    parser.add_argument('--max-tokens', type=int, help='Лимит длины ответа по умолчанию')
+    parser.add_argument('--yandex-async', action='store_true',
+                        help='Отложенная генерация YandexGPT (completionAsync) с опросом операций')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='Интервал опроса операции, сек')
+    parser.add_argument('--operation-timeout', type=float, default=600.0, help='Ожидание операции, сек')
+    parser.add_argument('--checkpoint', help='Файл ID операций (по умолчанию <output>.checkpoint)')
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    backend = get_backend(args.provider)
+    if not backend.configured:
+        raise SystemExit(backend.missing_message())
+    if args.yandex_async and not hasattr(backend, 'asubmit_operation'):
+        raise SystemExit(f"❌ Отложенная генерация не поддерживается провайдером {backend.name}")
+
+    checkpoint = args.checkpoint or args.output + '.checkpoint'
+    completed = load_completed(args.output)
+    options = {}
+    if args.temperature is not None:
+        options['temperature'] = args.temperature
+    if args.max_tokens is not None:
+        options['max_tokens'] = args.max_tokens
+
+    runner = BatchRunner(
+        backend, args.output, checkpoint,
+        concurrency=args.concurrency,
+        rps=args.rps,
+        yandex_async=args.yandex_async,
+        poll_interval=args.poll_interval,
+        operation_timeout=args.operation_timeout,
+        options=options
+    )
+    if args.yandex_async:
+        runner.operations = {
+            request_id: operation_id for request_id, operation_id in load_operations(checkpoint).items()
+            if request_id not in completed
+        }
+    if completed:
+        logger.info(f"⏭ Уже обработано в прошлых запусках: {len(completed)}")
+
+    try:
+        return await runner.run(iter_requests(args.input), completed)
+    finally:
+        await aclose_all()
+
+
+def main(argv=None):
+    load_dotenv()
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    # Строка на каждый запрос к провайдеру в пакетном режиме - лишний шум
+    logging.getLogger('providers').setLevel(logging.WARNING)
+
+    args = parse_args(argv)
+    counters = asyncio.run(run(args))
+    logger.info(f"✅ Пакет обработан: {counters}")
+    return 1 if counters['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+Нагрузочный тест клиентов провайдеров и бота на локальных заглушках
+
+Поднимает mock_providers.MockProviderServer, направляет на него клиентов
+через переменные окружения и гоняет диалоги с заданной конкурентностью:
+- sync  - RussianAI в пуле потоков;
+- async - AsyncRussianAI в event loop;
+- bot   - обработчик сообщений бота (очереди, склейка, реестр ассистентов)
+          на синтетических обновлениях Telegram.
+
+В конце печатает пропускную способность, p50/p95/p99 и память процесса.
+С --max-p95-ms / --max-error-rate завершается с кодом 1 при превышении,
+поэтому годится для проверки перед деплоем.
+
+Примеры:
+    python benchmark.py --target async --users 200 --messages 5 --concurrency 100
+    python benchmark.py --target bot --users 500 --stream --latency-ms 1500
+    python benchmark.py --target sync --provider sber --error-rate 0.05 --max-p95-ms 2500
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tracemalloc
+import logging
+from types import SimpleNamespace
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_providers import MockBehavior, MockProviderServer
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values, p):
+    """
+    Перцентиль отсортированного списка
+
+    Args:
+        sorted_values (list): Значения по возрастанию
+        p (float): Перцентиль, 0-100
+
+    Returns:
+        float: Значение или 0.0 для пустого списка
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def prepare_env(server, args):
+    """Направить клиентов на заглушку и снять ограничения, мешающие замеру"""
+    os.environ.update(server.env_for())
+    os.environ['DEFAULT_PROVIDER'] = args.provider
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:benchmark')
+    os.environ['BOT_STREAMING'] = '1' if args.stream else '0'
+    if not args.cache:
+        os.environ['RESPONSE_CACHE_SIZE'] = '0'
+    if not args.trace:
+        os.environ.pop('TRACE_FILE', None)
+    os.environ.pop('CONVERSATION_DB', None)
+    for prefix in ('YANDEX', 'GIGACHAT'):
+        os.environ.setdefault(f'{prefix}_RPS', str(args.rps))
+        os.environ.setdefault(f'{prefix}_MAX_CONCURRENT', str(args.concurrency))
+    os.environ.setdefault('HTTP_POOL_SIZE', str(args.concurrency))
+
+
+# ========== ЦЕЛИ НАГРУЗКИ ==========
+
+def run_sync(args):
+    """Диалоги через синхронный RussianAI в пуле потоков"""
+    from russian_ai import RussianAI
+    from providers import is_error_response
+
+    def dialog(user_id):
+        assistant = RussianAI(provider=args.provider, user_id=user_id)
+        latencies, errors = [], 0
+        for turn in range(args.messages):
+            started = time.perf_counter()
+            response = assistant.generate_response(f"Вопрос {turn} от пользователя {user_id}", stream=args.stream)
+            if args.stream:
+                for response in response:
+                    pass
+            latencies.append(time.perf_counter() - started)
+            errors += is_error_response(response)
+        return latencies, errors
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(dialog, range(args.users)))
+    return [latency for latencies, _ in results for latency in latencies], sum(e for _, e in results)
+
+
+async def run_async(args):
+    """Диалоги через AsyncRussianAI с ограничением конкурентности"""
+    from russian_ai import AsyncRussianAI
+    from providers import is_error_response
+    from http_pool import aclose_all
+
+    latencies, errors = [], 0
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def dialog(user_id):
+        nonlocal errors
+        assistant = AsyncRussianAI(provider=args.provider, user_id=user_id)
+        for turn in range(args.messages):
+            async with slots:
+                started = time.perf_counter()
+                response = await assistant.generate_response(
+                    f"Вопрос {turn} от пользователя {user_id}", stream=args.stream
+                )
+                if args.stream:
+                    async for response in response:
+                        pass
+                latencies.append(time.perf_counter() - started)
+            errors += is_error_response(response)
+
+    await asyncio.gather(*(dialog(user_id) for user_id in range(args.users)))
+    await aclose_all()
+    return latencies, errors
+
+
+class _FakeMessage:
+    """Сообщение Telegram: ответы бота запоминаются вместо отправки"""
+
+    def __init__(self, text=None, chat_id=0):
+        self.text = text
+        self.chat_id = chat_id
+        self.date = datetime.now(timezone.utc)
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return _FakeMessage(text, self.chat_id)
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+        return self
+
+
+def _fake_update(update_id, user_id, text):
+    message = _FakeMessage(text, chat_id=user_id)
+    user = SimpleNamespace(id=user_id)
+    return SimpleNamespace(
+        update_id=update_id,
+        message=message,
+        effective_message=message,
+        effective_user=user,
+        effective_chat=SimpleNamespace(id=user_id),
+        callback_query=None
+    )
+
+
+async def run_bot(args):
+    """Синтетические обновления через обработчик сообщений бота"""
+    import bot
+    from providers import is_error_response
+
+    async def send_chat_action(**kwargs):
+        pass
+
+    context = SimpleNamespace(bot=SimpleNamespace(send_chat_action=send_chat_action))
+    handler = bot.instrument('message', bot.handle_message)
+    latencies, errors = [], 0
+    slots = asyncio.Semaphore(args.concurrency)
+    update_ids = iter(range(1, sys.maxsize))
+
+    async def dialog(user_id):
+        nonlocal errors
+        for turn in range(args.messages):
+            update = _fake_update(next(update_ids), user_id, f"Вопрос {turn} от пользователя {user_id}")
+            async with slots:
+                started = time.perf_counter()
+                # Обработчик только ставит сообщение в очередь пользователя - ждем ответ
+                await (await handler(update, context))
+                latencies.append(time.perf_counter() - started)
+            replies = update.message.replies
+            errors += not replies or is_error_response(replies[-1])
+
+    await asyncio.gather(*(dialog(user_id) for user_id in range(args.users)))
+    logger.info(f"👥 Реестр ассистентов: {bot.user_assistants.stats()}")
+    await bot.aclose_all()
+    return latencies, errors
+
+
+# ========== ОТЧЕТ ==========
+
+def report(args, latencies, errors, duration, server, traced_peak):
+    """
+    Собрать результаты прогона
+
+    Returns:
+        dict: Метрики прогона
+    """
+    latencies.sort()
+    total = len(latencies)
+    return {
+        'target': args.target,
+        'provider': args.provider,
+        'stream': args.stream,
+        'users': args.users,
+        'messages': total,
+        'concurrency': args.concurrency,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(total / duration, 2) if duration else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        # ru_maxrss в Linux - в килобайтах
+        'rss_peak_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'traced_peak_mb': round(traced_peak / 1024 / 1024, 1) if traced_peak is not None else None,
+        'mock': dict(server.counters),
+        'mock_latency_ms': args.latency_ms
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест на заглушках провайдеров')
+    parser.add_argument('--target', choices=('sync', 'async', 'bot'), default='async')
+    parser.add_argument('--provider', choices=('yandex', 'sber'), default='yandex')
+    parser.add_argument('--users', type=int, default=100, help='Пользователей (диалогов)')
+    parser.add_argument('--messages', type=int, default=3, help='Сообщений на пользователя')
+    parser.add_argument('--concurrency', type=int, default=50, help='Одновременных запросов')
+    parser.add_argument('--stream', action='store_true', help='Потоковые ответы')
+    parser.add_argument('--cache', action='store_true', help='Не выключать кэш ответов')
+    parser.add_argument('--trace', action='store_true', help='Не выключать трассировку (TRACE_FILE)')
+    parser.add_argument('--rps', type=float, default=10000, help='Лимит RPS провайдера')
+    parser.add_argument('--latency-ms', type=float, default=500, help='Медиана задержки заглушки')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='Разброс задержки (логнормальный)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Доля ответов 429')
+    parser.add_argument('--tracemalloc', action='store_true', help='Замерить пик памяти Python (медленнее)')
+    parser.add_argument('--output', help='Дописать результат JSON-строкой в файл')
+    parser.add_argument('--max-p95-ms', type=float, help='Порог p95 для кода возврата 1')
+    parser.add_argument('--max-error-rate', type=float, help='Порог доли ошибок для кода возврата 1')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.WARNING
+    )
+
+    server = MockProviderServer(MockBehavior(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate
+    )).start()
+    prepare_env(server, args)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        if args.target == 'sync':
+            latencies, errors = run_sync(args)
+        elif args.target == 'async':
+            latencies, errors = asyncio.run(run_async(args))
+        else:
+            latencies, errors = asyncio.run(run_bot(args))
+    finally:
+        duration = time.perf_counter() - started
+        server.stop()
+
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    result = report(args, latencies, errors, duration, server, traced_peak)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    failed = []
+    if args.max_p95_ms is not None and result['p95_ms'] > args.max_p95_ms:
+        failed.append(f"p95 {result['p95_ms']} мс > {args.max_p95_ms} мс")
+    if args.max_error_rate is not None and result['error_rate'] > args.max_error_rate:
+        failed.append(f"доля ошибок {result['error_rate']} > {args.max_error_rate}")
+    if failed:
+        print("❌ Порог превышен: " + '; '.join(failed), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,39 +5,113 @@ Telegram-бот AI-ассистент на базе российских ней
 """
 
 import os
+import time
+import signal
+import functools
+import asyncio
 import logging
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
-    Updater,
+    Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
-    Filters,
-    CallbackContext
+    ContextTypes,
+    filters
 )
-from russian_ai import RussianAI
+from russian_ai import AsyncRussianAI
+from providers import get_backend, available_backends, load_backends
+from http_pool import get_pool_stats, aclose_all
+from telegram_delivery import StreamingReply, send_long_reply
+from assistant_registry import AssistantRegistry, FileSpillStore
+from conversation_store import ConversationStore
+from response_cache import get_response_cache
+from scheduler import UserScheduler
+from coalescer import MessageCoalescer
+from rate_limiter import get_limiter_stats
+from circuit_breaker import get_breaker_stats
+from hedging import get_hedge_stats
+from update_lanes import LaneUpdateProcessor
+from webhook_server import run_webhook, webhook_queue_size
+from metrics import register_collector, start_metrics_server, track_handler
+from tracing import span, bind, trace_handler
+from log_pipeline import setup_logging, get_log_stats
+from supervisor import Supervisor, HashRing, receive
 
 # Загрузка переменных окружения
 load_dotenv()
 
 # Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger(__name__)
+# Категория записей о каждом сообщении (выборка - LOG_SAMPLE)
+_LOG_MESSAGE = {'category': 'message'}
 
 # Получение токена бота из переменных окружения
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 if not TELEGRAM_TOKEN:
     raise ValueError("❌ Не указан TELEGRAM_BOT_TOKEN в .env файле!")
 
-# Глобальный словарь для хранения AI-ассистентов каждого пользователя
-user_assistants = {}
+# Обновления Telegram обрабатываются в двух полосах: команды и кнопки не
+# ждут слотов, занятых сообщениями (BOT_CONCURRENT_UPDATES / BOT_CONTROL_CONCURRENCY)
+update_processor = LaneUpdateProcessor()
+
+# Ограничение на число одновременных запросов к нейросетям
+LLM_MAX_INFLIGHT = int(os.getenv('LLM_MAX_INFLIGHT', '100'))
+llm_semaphore = asyncio.Semaphore(LLM_MAX_INFLIGHT)
+
+# Сообщения одного пользователя обрабатываются по очереди, разных - параллельно
+# (не больше BOT_WORKERS одновременно)
+scheduler = UserScheduler()
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+
+# Процессов-воркеров: больше одного - режим супервизора (supervisor.py)
+BOT_PROCESSES = int(os.getenv('BOT_PROCESSES', '0'))
+
+# Потоковая отправка ответа: сообщение появляется с первым фрагментом и дописывается
+BOT_STREAMING = os.getenv('BOT_STREAMING', '0').lower() in ('1', 'true', 'yes', 'on')
+
+
+# Долговременное хранилище диалогов (SQLite), если задан CONVERSATION_DB
+_conversation_db = os.getenv('CONVERSATION_DB')
+conversation_store = ConversationStore(_conversation_db) if _conversation_db else None
+
+
+def create_assistant(user_id):
+    """
+    Создать AI-ассистента с провайдером по умолчанию
+
+    Args:
+        user_id (int): ID пользователя Telegram
+
+    Returns:
+        AsyncRussianAI: Новый ассистент
+    """
+    return AsyncRussianAI(
+        provider=os.getenv('DEFAULT_PROVIDER', 'yandex'),
+        user_id=user_id,
+        store=conversation_store
+    )
+
+
+# Реестр AI-ассистентов пользователей: LRU + TTL простоя + лимит памяти.
+# Диалог, которого нет в памяти, подгружается из хранилища при первом
+# сообщении: из SQLite (CONVERSATION_DB) или из файлов вытесненных
+# диалогов (ASSISTANT_SPILL_DIR).
+_spill_dir = os.getenv('ASSISTANT_SPILL_DIR')
+if conversation_store is not None:
+    _spill_store = conversation_store
+elif _spill_dir:
+    _spill_store = FileSpillStore(_spill_dir)
+else:
+    _spill_store = None
+user_assistants = AssistantRegistry(create_assistant, spill_store=_spill_store)
 
 
-def get_user_assistant(user_id):
+async def get_user_assistant(user_id):
     """
     Получить или создать AI-ассистента для конкретного пользователя
 
@@ -45,13 +119,44 @@ def get_user_assistant(user_id):
         user_id (int): ID пользователя Telegram
 
     Returns:
-        RussianAI: Экземпляр AI-ассистента
+        AsyncRussianAI: Экземпляр AI-ассистента
     """
-    if user_id not in user_assistants:
-        default_provider = os.getenv('DEFAULT_PROVIDER', 'yandex')
-        user_assistants[user_id] = RussianAI(provider=default_provider)
-        logger.info(f"🆕 Создан новый ассистент для пользователя {user_id}")
-    return user_assistants[user_id]
+    return await user_assistants.aget(user_id)
+
+
+def in_mailbox(handler):
+    """
+    Выполнять обработчик в очереди пользователя, по порядку с его сообщениями
+
+    Команды, которые меняют историю диалога или провайдера, не должны
+    выполняться посреди генерации ответа: иначе ответ на прежний вопрос
+    допишется в уже очищенную историю. Как и handle_message, обработчик
+    не ждет очереди и сразу освобождает слот полосы.
+
+    Args:
+        handler (callable): Корутина handler(update, context)
+
+    Returns:
+        callable: Обработчик, возвращающий asyncio.Future с результатом
+    """
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        user_id = update.effective_user.id
+        # Сообщения, отправленные до команды, отвечаются до нее
+        coalescer.flush(user_id)
+        job = scheduler.submit(user_id, bind(lambda: handler(update, context)))
+        job.add_done_callback(lambda future: _log_job_error(update, future))
+        return job
+
+    return wrapper
+
+
+def _log_job_error(update, future):
+    """Ошибка задачи из очереди пользователя (обработчик Telegram к этому времени уже вернулся)"""
+    if future.cancelled() or future.exception() is None:
+        return
+    error = future.exception()
+    logger.error(f"⚠️ Update {update} вызвал ошибку: {error}", exc_info=(type(error), error, error.__traceback__))
 
 
 def create_keyboard():
@@ -62,9 +167,10 @@ def create_keyboard():
         InlineKeyboardMarkup: Клавиатура с кнопками управления
     """
     keyboard = [
+        # Кнопки провайдеров - из реестра (providers.py)
         [
-            InlineKeyboardButton("🟢 Yandex", callback_data='provider_yandex'),
-            InlineKeyboardButton("🔵 Sber", callback_data='provider_sber')
+            InlineKeyboardButton(backend.label, callback_data=f'provider_{backend.name}')
+            for backend in available_backends(configured_only=False)
         ],
         [
             InlineKeyboardButton("🗑 Очистить историю", callback_data='clear_history')
@@ -76,13 +182,13 @@ def create_keyboard():
     return InlineKeyboardMarkup(keyboard)
 
 
-def start(update: Update, context: CallbackContext):
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user = update.effective_user
     user_id = user.id
 
     # Инициализируем ассистента для пользователя
-    assistant = get_user_assistant(user_id)
+    assistant = await get_user_assistant(user_id)
 
     welcome_message = (
         f"👋 Привет, {user.first_name}!\n\n"
@@ -98,7 +204,7 @@ def start(update: Update, context: CallbackContext):
         f"Просто напиши мне что-нибудь, и я отвечу! 💬"
     )
 
-    update.message.reply_text(
+    await update.message.reply_text(
         welcome_message,
         parse_mode='Markdown',
         reply_markup=create_keyboard()
@@ -106,14 +212,15 @@ def start(update: Update, context: CallbackContext):
     logger.info(f"👤 Пользователь {user_id} ({user.first_name}) запустил бота")
 
 
-def yandex_command(update: Update, context: CallbackContext):
+@in_mailbox
+async def yandex_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /yandex - переключение на YandexGPT"""
     user_id = update.effective_user.id
-    assistant = get_user_assistant(user_id)
+    assistant = await get_user_assistant(user_id)
 
     try:
         assistant.set_provider('yandex')
-        update.message.reply_text(
+        await update.message.reply_text(
             "✅ Провайдер переключен на *YandexGPT*\n"
             "История диалога очищена.",
             parse_mode='Markdown',
@@ -121,21 +228,22 @@ def yandex_command(update: Update, context: CallbackContext):
         )
         logger.info(f"🔄 Пользователь {user_id} переключился на Yandex")
     except Exception as e:
-        update.message.reply_text(
+        await update.message.reply_text(
             f"❌ Ошибка переключения: {str(e)}",
             reply_markup=create_keyboard()
         )
         logger.error(f"❌ Ошибка переключения на Yandex: {e}")
 
 
-def sber_command(update: Update, context: CallbackContext):
+@in_mailbox
+async def sber_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /sber - переключение на GigaChat"""
     user_id = update.effective_user.id
-    assistant = get_user_assistant(user_id)
+    assistant = await get_user_assistant(user_id)
 
     try:
         assistant.set_provider('sber')
-        update.message.reply_text(
+        await update.message.reply_text(
             "✅ Провайдер переключен на *GigaChat (SberAI)*\n"
             "История диалога очищена.",
             parse_mode='Markdown',
@@ -143,22 +251,23 @@ def sber_command(update: Update, context: CallbackContext):
         )
         logger.info(f"🔄 Пользователь {user_id} переключился на Sber")
     except Exception as e:
-        update.message.reply_text(
+        await update.message.reply_text(
             f"❌ Ошибка переключения: {str(e)}",
             reply_markup=create_keyboard()
         )
         logger.error(f"❌ Ошибка переключения на Sber: {e}")
 
 
-def clear_command(update: Update, context: CallbackContext):
+@in_mailbox
+async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /clear - очистка истории диалога"""
     user_id = update.effective_user.id
-    assistant = get_user_assistant(user_id)
+    assistant = await get_user_assistant(user_id)
 
     messages_before = assistant.get_history_length()
     assistant.clear_history()
 
-    update.message.reply_text(
+    await update.message.reply_text(
         f"🗑 История диалога очищена!\n"
         f"Удалено сообщений: {messages_before}\n\n"
         f"Можешь начать новый разговор.",
@@ -167,10 +276,10 @@ def clear_command(update: Update, context: CallbackContext):
     logger.info(f"🗑 Пользователь {user_id} очистил историю ({messages_before} сообщений)")
 
 
-def info_command(update: Update, context: CallbackContext):
+async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /info - информация о боте"""
     user_id = update.effective_user.id
-    assistant = get_user_assistant(user_id)
+    assistant = await get_user_assistant(user_id)
 
     info_message = (
         "ℹ️ *Информация о боте*\n\n"
@@ -188,39 +297,95 @@ def info_command(update: Update, context: CallbackContext):
         "*Версия:* 1.0"
     )
 
-    update.message.reply_text(
+    await update.message.reply_text(
         info_message,
         parse_mode='Markdown',
         reply_markup=create_keyboard()
     )
 
 
-def handle_message(update: Update, context: CallbackContext):
-    """Обработчик текстовых сообщений от пользователя"""
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Обработчик текстовых сообщений от пользователя
+
+    Ответ не ждем: сообщение ставится в очередь пользователя, и слот полосы
+    сообщений сразу освобождается, поэтому пользователь с длинной очередью
+    не занимает слоты остальных.
+
+    Returns:
+        asyncio.Future: Завершится, когда ответ будет отправлен
+    """
     user_id = update.effective_user.id
     user_message = update.message.text
 
-    # Получаем ассистента пользователя
-    assistant = get_user_assistant(user_id)
+    logger.info("💬 Получено сообщение от %s: %.50s...", user_id, user_message, extra=_LOG_MESSAGE)
 
-    logger.info(f"💬 Получено сообщение от {user_id}: {user_message[:50]}...")
+    if coalescer.enabled:
+        # Серия быстрых сообщений склеивается в одну реплику (MESSAGE_COALESCE_MS)
+        job = coalescer.add(user_id, update, context, user_message)
+    else:
+        # Предыдущий ответ этому пользователю должен быть готов раньше, чем начнется следующий
+        job = scheduler.submit(user_id, bind(lambda: process_message(update, context, user_message)))
+    job.add_done_callback(lambda future: _log_job_error(update, future))
+    # Webhook считает сообщение необработанным, пока ответ не отправлен
+    update_processor.defer(update, job)
+    return job
 
-    # Отправляем индикатор "печатает..."
-    context.bot.send_chat_action(
-        chat_id=update.effective_chat.id,
-        action='typing'
-    )
 
-    try:
-        # Генерируем ответ через AI
-        response = assistant.generate_response(user_message)
 
-        # Отправляем ответ пользователю
-        update.message.reply_text(
-            response,
-            reply_markup=create_keyboard()
+async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE, user_message):
+    """
+    Генерация и отправка ответа на сообщение (выполняется из очереди пользователя)
+
+    Args:
+        update (Update): Обновление Telegram с сообщением пользователя
+        context: Контекст обработчика
+        user_message (str): Текст сообщения
+    """
+    user_id = update.effective_user.id
+
+    # Ассистент занят до отправки ответа: реестр не вытеснит его посреди генерации
+    async with user_assistants.use(user_id) as assistant:
+        await answer_message(update, context, assistant, user_message)
+
+
+async def answer_message(update: Update, context: ContextTypes.DEFAULT_TYPE, assistant, user_message):
+    """
+    Сгенерировать ответ ассистента и отправить его пользователю
+
+    Args:
+        update (Update): Обновление Telegram с сообщением пользователя
+        context: Контекст обработчика
+        assistant (AsyncRussianAI): Ассистент пользователя
+        user_message (str): Текст сообщения
+    """
+    user_id = update.effective_user.id
+
+    # Отправляем индикатор "печатает..."
+    with span('telegram_send', method='send_chat_action'):
+        await context.bot.send_chat_action(
+            chat_id=update.effective_chat.id,
+            action='typing'
         )
-        logger.info(f"✅ Отправлен ответ пользователю {user_id}")
+
+    try:
+        if BOT_STREAMING:
+            await stream_response(update, assistant, user_message)
+        else:
+            # Генерируем ответ через AI (не больше LLM_MAX_INFLIGHT запросов одновременно)
+            with span('generate', provider=assistant.provider):
+                async with llm_semaphore:
+                    response = await assistant.generate_response(user_message)
+
+            # Отправляем ответ пользователю (длинный - частями по лимиту Telegram)
+            with span('telegram_send', method='reply_text', chars=len(response)) as stage:
+                sent = await send_long_reply(
+                    update.message,
+                    response,
+                    reply_markup=create_keyboard()
+                )
+                stage.set(chunks=len(sent))
+        logger.info("✅ Отправлен ответ пользователю %s", user_id, extra=_LOG_MESSAGE)
 
     except Exception as e:
         error_message = (
@@ -231,7 +396,7 @@ def handle_message(update: Update, context: CallbackContext):
             "• Очистить историю командой /clear\n"
             "• Переключить провайдера (/yandex или /sber)"
         )
-        update.message.reply_text(
+        await update.message.reply_text(
             error_message,
             parse_mode='Markdown',
             reply_markup=create_keyboard()
@@ -239,49 +404,91 @@ def handle_message(update: Update, context: CallbackContext):
         logger.error(f"❌ Ошибка генерации ответа для {user_id}: {e}")
 
 
-def button_callback(update: Update, context: CallbackContext):
+async def stream_response(update: Update, assistant, user_message):
+    """
+    Потоковая генерация и отправка ответа
+
+    Первое сообщение уходит вместе с первым фрагментом ответа, дальше оно
+    редактируется с ограничением частоты (STREAM_EDIT_INTERVAL). Ответ
+    длиннее лимита Telegram продолжается в следующих сообщениях.
+
+    Args:
+        update (Update): Обновление Telegram с сообщением пользователя
+        assistant (AsyncRussianAI): Ассистент пользователя
+        user_message (str): Текст сообщения
+    """
+    reply = StreamingReply(update.message, reply_markup=create_keyboard())
+    response = None
+
+    with span('generate', provider=assistant.provider, stream=True):
+        async with llm_semaphore:
+            async for response in await assistant.generate_response(user_message, stream=True):
+                await reply.update(response)
+
+    with span('telegram_send', method='finish'):
+        await reply.finish(response or "❌ Не удалось получить ответ от AI")
+
+
+# Склейка сообщений, пришедших подряд (или пока реплика ждет в очереди)
+coalescer = MessageCoalescer(scheduler, process_message)
+
+
+async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий на inline-кнопки"""
     query = update.callback_query
     user_id = query.from_user.id
     callback_data = query.data
 
     # Подтверждаем получение callback
-    query.answer()
+    await query.answer()
 
-    assistant = get_user_assistant(user_id)
+    # Переключение провайдера и очистка меняют историю - в очереди пользователя
+    if callback_data.startswith('provider_') or callback_data == 'clear_history':
+        return await change_dialog_callback(update, context)
+
+    # Обработка кнопки информации
+    if callback_data == 'info':
+        assistant = await get_user_assistant(user_id)
+        info_message = (
+            "ℹ️ *Информация о боте*\n\n"
+            f"🤖 *Текущий провайдер:* {assistant.provider.upper()}\n"
+            f"💬 *Сообщений в истории:* {assistant.get_history_length()}\n\n"
+            "*Поддерживаемые провайдеры:*\n"
+            "• YandexGPT (Yandex Cloud)\n"
+            "• GigaChat (SberAI)\n\n"
+            "*Разработчик:* ZeroCode University"
+        )
+        await query.edit_message_text(
+            info_message,
+            parse_mode='Markdown',
+            reply_markup=create_keyboard()
+        )
 
-    # Обработка кнопки переключения на Yandex
-    if callback_data == 'provider_yandex':
-        try:
-            assistant.set_provider('yandex')
-            query.edit_message_text(
-                "✅ Провайдер переключен на *YandexGPT*\n"
-                "История диалога очищена.\n\n"
-                "Напиши мне что-нибудь!",
-                parse_mode='Markdown',
-                reply_markup=create_keyboard()
-            )
-            logger.info(f"🔄 Пользователь {user_id} переключился на Yandex (кнопка)")
-        except Exception as e:
-            query.edit_message_text(
-                f"❌ Ошибка переключения: {str(e)}",
-                reply_markup=create_keyboard()
-            )
 
-    # Обработка кнопки переключения на Sber
-    elif callback_data == 'provider_sber':
+@in_mailbox
+async def change_dialog_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопки переключения провайдера и очистки истории (выполняются в очереди пользователя)"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    callback_data = query.data
+
+    assistant = await get_user_assistant(user_id)
+
+    # Обработка кнопок переключения провайдера
+    if callback_data.startswith('provider_'):
         try:
-            assistant.set_provider('sber')
-            query.edit_message_text(
-                "✅ Провайдер переключен на *GigaChat (SberAI)*\n"
+            backend = get_backend(callback_data[len('provider_'):])
+            assistant.set_provider(backend.name)
+            await query.edit_message_text(
+                f"✅ Провайдер переключен на *{backend.title}*\n"
                 "История диалога очищена.\n\n"
                 "Напиши мне что-нибудь!",
                 parse_mode='Markdown',
                 reply_markup=create_keyboard()
             )
-            logger.info(f"🔄 Пользователь {user_id} переключился на Sber (кнопка)")
+            logger.info(f"🔄 Пользователь {user_id} переключился на {backend.name} (кнопка)")
         except Exception as e:
-            query.edit_message_text(
+            await query.edit_message_text(
                 f"❌ Ошибка переключения: {str(e)}",
                 reply_markup=create_keyboard()
             )
@@ -290,7 +497,7 @@ def button_callback(update: Update, context: CallbackContext):
     elif callback_data == 'clear_history':
         messages_before = assistant.get_history_length()
         assistant.clear_history()
-        query.edit_message_text(
+        await query.edit_message_text(
             f"🗑 История диалога очищена!\n"
             f"Удалено сообщений: {messages_before}\n\n"
             f"*Текущий провайдер:* {assistant.provider.upper()}\n\n"
@@ -300,63 +507,228 @@ def button_callback(update: Update, context: CallbackContext):
         )
         logger.info(f"🗑 Пользователь {user_id} очистил историю (кнопка)")
 
-    # Обработка кнопки информации
-    elif callback_data == 'info':
-        info_message = (
-            "ℹ️ *Информация о боте*\n\n"
-            f"🤖 *Текущий провайдер:* {assistant.provider.upper()}\n"
-            f"💬 *Сообщений в истории:* {assistant.get_history_length()}\n\n"
-            "*Поддерживаемые провайдеры:*\n"
-            "• YandexGPT (Yandex Cloud)\n"
-            "• GigaChat (SberAI)\n\n"
-            "*Разработчик:* ZeroCode University"
-        )
-        query.edit_message_text(
-            info_message,
-            parse_mode='Markdown',
-            reply_markup=create_keyboard()
-        )
-
 
-def error_handler(update: Update, context: CallbackContext):
+async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"⚠️ Update {update} вызвал ошибку: {context.error}")
 
 
-def main():
-    """Основная функция запуска бота"""
-    logger.info("🚀 Запуск AI-ассистента...")
+@register_collector
+def collect_bot_metrics():
+    """Значения для /metrics, которые уже считают реестр, очереди и лимитеры"""
+    registry = user_assistants.stats()
+    queues = scheduler.stats(top=0)
+    lanes = update_processor.stats()
+    limiters = get_limiter_stats()
+    breakers = get_breaker_stats()
+    hedges = get_hedge_stats()
+    return [
+        ('bot_assistants', 'gauge', 'AI-ассистентов в памяти', [({}, registry['size'])]),
+        ('bot_assistants_memory_bytes', 'gauge', 'Оценка памяти историй диалогов',
+         [({}, registry['memory_bytes'])]),
+        ('bot_queue_depth', 'gauge', 'Сообщений в очередях пользователей', [({}, queues['queued'])]),
+        ('bot_queue_max_depth', 'gauge', 'Максимальная глубина очереди пользователя',
+         [({}, queues['max_depth'])]),
+        ('bot_workers_busy', 'gauge', 'Занятых воркеров', [({}, queues['running'])]),
+        ('bot_lane_running', 'gauge', 'Обновлений в обработке по полосам',
+         [({'lane': lane}, stats['running']) for lane, stats in lanes.items()]),
+        ('ai_provider_requests_total', 'counter', 'HTTP-запросов к провайдерам (включая повторы)',
+         [({'limiter': name}, stats['requests']) for name, stats in limiters.items()]),
+        ('ai_provider_retries_total', 'counter', 'Повторов запросов к провайдерам',
+         [({'limiter': name}, stats['retries']) for name, stats in limiters.items()]),
+        ('ai_provider_throttled_total', 'counter', 'Ответов 429 от провайдеров',
+         [({'limiter': name}, stats['throttled']) for name, stats in limiters.items()]),
+        ('ai_breaker_open', 'gauge', 'Выключатель провайдера разомкнут',
+         [({'provider': name}, stats['state'] != 'closed') for name, stats in breakers.items()]),
+        ('ai_hedges_total', 'counter', 'Отправлено дублей запросов', [({}, hedges['hedges'])]),
+        ('ai_hedge_wins_total', 'counter', 'Дубль ответил первым', [({}, hedges['wins'])]),
+    ]
 
-    try:
-        # Создаем Updater и передаем токен бота
-        updater = Updater(token=TELEGRAM_TOKEN, use_context=True)
 
-        # Получаем диспетчер для регистрации обработчиков
-        dispatcher = updater.dispatcher
+async def on_shutdown(application: Application):
+    """Закрытие пулов соединений и сохранение диалогов при остановке бота"""
+    for provider, stats in get_pool_stats().items():
+        logger.info(f"🔌 Пул {provider}: {stats}")
+    await aclose_all()
+    logger.info(f"🚦 Лимиты запросов: {get_limiter_stats()}")
+    logger.info(f"⚡ Выключатели провайдеров: {get_breaker_stats()}")
+    logger.info(f"🪞 Дублирование запросов: {get_hedge_stats()}")
 
-        # Регистрируем обработчики команд
-        dispatcher.add_handler(CommandHandler('start', start))
-        dispatcher.add_handler(CommandHandler('yandex', yandex_command))
-        dispatcher.add_handler(CommandHandler('sber', sber_command))
-        dispatcher.add_handler(CommandHandler('clear', clear_command))
-        dispatcher.add_handler(CommandHandler('info', info_command))
+    logger.info(f"👥 Реестр ассистентов: {user_assistants.stats()}")
+    logger.info(f"📬 Очереди сообщений: {scheduler.stats()}")
+    logger.info(f"🛣 Полосы обновлений: {update_processor.stats()}")
+    logger.info(f"🧩 Склейка сообщений: {coalescer.stats()}")
+    logger.info(f"🪵 Логирование: {get_log_stats()}")
+    user_assistants.evict_all()
+    if conversation_store is not None:
+        conversation_store.close()
 
-        # Регистрируем обработчик callback-кнопок
-        dispatcher.add_handler(CallbackQueryHandler(button_callback))
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        logger.info(f"📦 Кэш ответов: {response_cache.stats()}")
+        response_cache.save()
 
-        # Регистрируем обработчик текстовых сообщений
-        dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_message))
 
-        # Регистрируем обработчик ошибок
-        dispatcher.add_error_handler(error_handler)
+def instrument(name, handler):
+    """Обработчик с метриками и трассировкой обновления"""
+    return track_handler(name, trace_handler(name, handler))
 
-        # Запускаем бота
-        logger.info("✅ Бот запущен и готов к работе!")
-        logger.info("Нажмите Ctrl+C для остановки бота")
-        updater.start_polling()
 
-        # Останавливаем бота при нажатии Ctrl+C
-        updater.idle()
+def build_application():
+    """
+    Собрать приложение бота со всеми обработчиками
+
+    Returns:
+        Application: Приложение (еще не запущенное)
+    """
+    # Создаем приложение: обновления обрабатываются конкурентно в event loop
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(update_processor)
+        .post_shutdown(on_shutdown)
+    )
+    if BOT_MODE == 'webhook':
+        # Необработанные обновления ограничены (update_processor.admit): сверх лимита webhook отвечает 503
+        builder = builder.update_queue(asyncio.Queue(maxsize=webhook_queue_size()))
+    application = builder.build()
+
+    # Регистрируем обработчики команд
+    application.add_handler(CommandHandler('start', instrument('start', start)))
+    application.add_handler(CommandHandler('yandex', instrument('yandex', yandex_command)))
+    application.add_handler(CommandHandler('sber', instrument('sber', sber_command)))
+    application.add_handler(CommandHandler('clear', instrument('clear', clear_command)))
+    application.add_handler(CommandHandler('info', instrument('info', info_command)))
+
+    # Регистрируем обработчик callback-кнопок
+    application.add_handler(CallbackQueryHandler(instrument('button', button_callback)))
+
+    # Регистрируем обработчик текстовых сообщений
+    application.add_handler(
+        MessageHandler(filters.TEXT & ~filters.COMMAND, instrument('message', handle_message))
+    )
+
+    # Регистрируем обработчик ошибок
+    application.add_error_handler(error_handler)
+    return application
+
+
+# ========== РЕЖИМ СУПЕРВИЗОРА (BOT_PROCESSES > 1) ==========
+
+async def wait_idle(application, timeout):
+    """
+    Дождаться, пока обработаны все принятые обновления
+
+    Args:
+        application (Application): Приложение воркера
+        timeout (float): Максимальное ожидание, сек
+
+    Returns:
+        bool: True, если воркер простаивает
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        queues = scheduler.stats()
+        if (
+            application.update_queue.empty()
+            and update_processor.current_concurrent_updates == 0
+            and not coalescer.stats()['pending_users']
+            and not queues['queued'] and not queues['running']
+        ):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def serve_worker(name, inbox, outbox):
+    """
+    Обрабатывать обновления, которые супервизор направил этому воркеру
+
+    Args:
+        name (str): Имя воркера в кольце хешей
+        inbox: Очередь от супервизора: ('update', dict), ('ring', [имена]), ('stop', None)
+        outbox: Очередь супервизору: ('rebalanced', имя, вытеснено), ('stopped', имя)
+    """
+    application = build_application()
+    loop = asyncio.get_running_loop()
+    timeout = float(os.getenv('BOT_REBALANCE_TIMEOUT', '60'))
+
+    async with application:
+        await application.start()
+        start_metrics_server()
+        logger.info(f"👷 Воркер {name} готов (pid {os.getpid()})")
+        try:
+            while True:
+                kind, payload = await loop.run_in_executor(None, receive, inbox)
+                if kind == 'update':
+                    await application.update_queue.put(Update.de_json(payload, application.bot))
+                elif kind == 'ring':
+                    # Сначала дорабатываем начатое, потом отдаем чужие теперь диалоги
+                    if not await wait_idle(application, timeout):
+                        logger.warning(
+                            f"⚠️ Воркер {name}: обработка не закончилась за {timeout:.0f} с, "
+                            "занятые диалоги переедут после ответа"
+                        )
+                    ring = HashRing(payload)
+                    moved, deferred = await user_assistants.aevict_if(
+                        lambda user_id: ring.node_for(user_id) != name
+                    )
+                    if deferred:
+                        logger.warning(f"⚠️ Воркер {name}: диалогов отдаст после ответа: {deferred}")
+                    if conversation_store is not None:
+                        # Запись в SQLite идет в фоне: новый владелец не должен
+                        # прочитать историю раньше, чем допишутся последние реплики
+                        await loop.run_in_executor(None, conversation_store.flush)
+                    logger.info(f"⚖️ Воркер {name}: диалогов передано другим воркерам: {moved}")
+                    outbox.put(('rebalanced', name, moved + deferred))
+                elif kind == 'stop':
+                    break
+        finally:
+            await wait_idle(application, timeout)
+            await application.stop()
+            await on_shutdown(application)
+    outbox.put(('stopped', name))
+
+
+def run_worker(name, index, inbox, outbox):
+    """Точка входа процесса-воркера (запускается супервизором)"""
+    # Ctrl+C получает вся группа процессов, а воркер останавливает супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    metrics_port = int(os.getenv('METRICS_PORT', '0'))
+    if metrics_port:
+        # Каждому воркеру свой порт метрик: METRICS_PORT + номер воркера
+        os.environ['METRICS_PORT'] = str(metrics_port + index)
+    load_backends()
+    asyncio.run(serve_worker(name, inbox, outbox))
+
+
+def main():
+    """Основная функция запуска бота"""
+    logger.info("🚀 Запуск AI-ассистента...")
+
+    if BOT_PROCESSES > 1:
+        # Обновления принимает супервизор, ответы генерируют процессы-воркеры
+        Supervisor(run_worker, BOT_PROCESSES, TELEGRAM_TOKEN, mode=BOT_MODE).run()
+        return
+
+    # Параметры провайдеров читаются один раз и общие для всех ассистентов
+    load_backends()
+
+    try:
+        application = build_application()
+
+        # Запускаем бота (Ctrl+C останавливает его)
+        logger.info(
+            f"✅ Бот запущен и готов к работе! "
+            f"(обновлений одновременно: {update_processor.messages.limit} + "
+            f"{update_processor.control.limit} для команд, запросов к AI: {LLM_MAX_INFLIGHT})"
+        )
+        start_metrics_server()
+        logger.info("Нажмите Ctrl+C для остановки бота")
+        if BOT_MODE == 'webhook':
+            asyncio.run(run_webhook(application, on_shutdown=on_shutdown))
+        else:
+            application.run_polling()
 
     except Exception as e:
         logger.error(f"❌ Критическая ошибка при запуске бота: {e}")
@@ -367,4 +739,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,387 @@
+"""
+Запись и воспроизведение HTTP-трафика провайдеров (кассеты)
+
+В режиме записи каждый запрос к провайдеру уходит в сеть как обычно, а
+пара запрос/ответ сохраняется в файл вместе с моментами прихода
+заголовков и каждого фрагмента тела. В режиме воспроизведения сеть не
+используется: ответы отдаются из файла с теми же задержками, поэтому
+профиль задержек продакшена повторяется офлайн и детерминированно.
+
+Кассета подключается в http_pool и действует на все клиенты, которые
+берут сессии оттуда (russian_ai.py, main.py, yandex_gpt.py, gigachat_auth.py).
+
+Секреты не записываются: из запроса сохраняется только хэш тела (для
+поиска ответа), заголовки запроса не сохраняются вовсе, из ответа -
+только Content-Type и Retry-After, а токены в теле ответа заменяются.
+
+Настройки (переменные окружения):
+    HTTP_CASSETTE        - файл кассеты (JSON Lines, .gz - со сжатием)
+    HTTP_CASSETTE_MODE   - record или replay (по умолчанию replay)
+    HTTP_CASSETTE_SPEED  - множитель задержек при воспроизведении (1.0; 0 - без задержек)
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import base64
+import hashlib
+import asyncio
+import threading
+import http.client
+import logging
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+logger = logging.getLogger(__name__)
+
+# Заголовки ответа, которые сохраняются в кассете
+KEPT_HEADERS = ('content-type', 'retry-after')
+
+_SECRET_RE = re.compile(
+    r'("(?:access_token|refresh_token|id_token|api_key|apiKey|token|secret|password)"\s*:\s*")[^"]*(")'
+)
+_EXPIRES_RE = re.compile(r'("expires_at"\s*:\s*)\d+')
+
+
+def scrub(text):
+    """
+    Заменить значения секретных полей JSON
+
+    Args:
+        text (str): Тело ответа
+
+    Returns:
+        str: Тело без токенов
+    """
+    return _SECRET_RE.sub(r'\1REDACTED\2', text)
+
+
+def request_key(method, url, body):
+    """
+    Ключ запроса: метод, адрес без параметров и хэш тела
+
+    Args:
+        method (str): HTTP-метод
+        url (str): Адрес запроса
+        body (bytes | str): Тело запроса или None
+
+    Returns:
+        str: SHA-256 ключ
+    """
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    digest = hashlib.sha256()
+    digest.update(f'{method.upper()} {_route(url)}\n'.encode('utf-8'))
+    digest.update(body or b'')
+    return digest.hexdigest()
+
+
+def _route(url):
+    parts = urlsplit(str(url))
+    return f'{parts.scheme}://{parts.netloc}{parts.path}'
+
+
+def _kept_headers(headers):
+    return {name: value for name, value in headers.items() if name.lower() in KEPT_HEADERS}
+
+
+def _encode_chunk(data):
+    """Фрагмент тела для JSON: текст, если это UTF-8, иначе base64"""
+    try:
+        return {'text': scrub(data.decode('utf-8'))}
+    except UnicodeDecodeError:
+        return {'b64': base64.b64encode(data).decode('ascii')}
+
+
+def _decode_chunk(chunk):
+    if 'text' in chunk:
+        # Токены из кассеты не истекают: иначе клиент запрашивал бы новый на каждом ходе
+        expires_at = int((time.time() + 1800) * 1000)
+        return _EXPIRES_RE.sub(lambda m: f'{m.group(1)}{expires_at}', chunk['text']).encode('utf-8')
+    return base64.b64decode(chunk['b64'])
+
+
+class Cassette:
+    """Файл записанных ответов и поиск ответа для запроса"""
+
+    def __init__(self, path, mode='replay', speed=None):
+        """
+        Args:
+            path (str): Файл кассеты
+            mode (str): 'record' или 'replay'
+            speed (float): Множитель задержек при воспроизведении
+        """
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"❌ Неизвестный режим кассеты: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = float(speed if speed is not None else os.getenv('HTTP_CASSETTE_SPEED', '1'))
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._by_route = {}
+        self._cursors = {}
+        self.recorded = 0
+        self.replayed = 0
+        self.missed = 0
+        if mode == 'replay':
+            self._load()
+
+    def _open(self, file_mode):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, file_mode + 't', encoding='utf-8')
+        return open(self.path, file_mode, encoding='utf-8')
+
+    def _load(self):
+        with self._open('r') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._by_key.setdefault(entry['key'], []).append(entry)
+                    route = (entry['method'], urlsplit(entry['url']).path)
+                    self._by_route.setdefault(route, []).append(entry)
+        logger.info(f"📼 Кассета {self.path}: загружено {sum(map(len, self._by_key.values()))} ответов")
+
+    def record(self, method, url, body, status, headers, ttfb, chunks):
+        """
+        Сохранить ответ
+
+        Args:
+            method (str): HTTP-метод
+            url (str): Адрес запроса
+            body (bytes): Тело запроса (сохраняется только его хэш)
+            status (int): Код ответа
+            headers: Заголовки ответа
+            ttfb (float): Время до заголовков ответа, сек
+            chunks (list): [(смещение от начала запроса, bytes), ...]
+        """
+        entry = {
+            'key': request_key(method, url, body),
+            'method': method.upper(),
+            'url': _route(url),
+            'status': status,
+            'headers': _kept_headers(headers),
+            'ttfb': round(ttfb, 4),
+            'chunks': [dict(_encode_chunk(data), at=round(at, 4)) for at, data in chunks if data]
+        }
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            with self._open('a') as f:
+                f.write(line + '\n')
+            self.recorded += 1
+
+    def find(self, method, url, body):
+        """
+        Найти ответ для запроса
+
+        Сначала ищется точно такой же запрос, затем любой запрос с тем же
+        путем на любом хосте (важны задержки, а не текст; так кассету можно
+        проиграть и с адресами заглушек). Записи выдаются по кругу.
+
+        Returns:
+            dict: Запись кассеты или None
+        """
+        key = request_key(method, url, body)
+        route = (method.upper(), urlsplit(str(url)).path)
+        with self._lock:
+            for index, entries in ((key, self._by_key.get(key)), (route, self._by_route.get(route))):
+                if entries:
+                    cursor = self._cursors.get(index, 0)
+                    self._cursors[index] = cursor + 1
+                    self.replayed += 1
+                    return entries[cursor % len(entries)]
+            self.missed += 1
+        logger.warning(f"📼 В кассете нет ответа для {method} {_route(url)}")
+        return None
+
+    def delay(self, seconds):
+        """Задержка воспроизведения с учетом HTTP_CASSETTE_SPEED"""
+        return max(seconds * self.speed, 0.0)
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'recorded': self.recorded,
+            'replayed': self.replayed,
+            'missed': self.missed
+        }
+
+
+# ========== СИНХРОННЫЙ КЛИЕНТ (requests) ==========
+
+class _ReplayRaw:
+    """Тело ответа из кассеты: фрагменты отдаются в записанные моменты"""
+
+    def __init__(self, cassette, chunks, started):
+        self._cassette = cassette
+        self._chunks = list(chunks)
+        self._started = started
+        self._buffer = b''
+
+    def read(self, amt=None, **kwargs):
+        while not self._buffer and self._chunks:
+            chunk = self._chunks.pop(0)
+            wait = self._started + self._cassette.delay(chunk['at']) - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._buffer = _decode_chunk(chunk)
+        if amt is None:
+            data, self._buffer = self._buffer + b''.join(map(_decode_chunk, self._chunks)), b''
+            self._chunks = []
+            return data
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        self._chunks = []
+        self._buffer = b''
+
+
+class CassetteAdapter(HTTPAdapter):
+    """Адаптер requests: пишет ответы внутреннего адаптера или отдает их из кассеты"""
+
+    def __init__(self, inner, cassette):
+        """
+        Args:
+            inner (HTTPAdapter): Адаптер, который ходит в сеть (режим record)
+            cassette (Cassette): Кассета
+        """
+        super().__init__()
+        self.inner = inner
+        self.cassette = cassette
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.cassette.mode == 'replay':
+            return self._replay(request)
+
+        started = time.monotonic()
+        response = self.inner.send(request, stream=True, timeout=timeout, verify=verify,
+                                   cert=cert, proxies=proxies)
+        ttfb = time.monotonic() - started
+        chunks = [(time.monotonic() - started, data)
+                  for data in response.raw.stream(4096, decode_content=True)]
+        response._content = b''.join(data for _, data in chunks)
+        response._content_consumed = True
+        self.cassette.record(request.method, request.url, request.body, response.status_code,
+                             response.headers, ttfb, chunks)
+        return response
+
+    def _replay(self, request):
+        started = time.monotonic()
+        entry = self.cassette.find(request.method, request.url, request.body)
+        if entry is None:
+            raise requests.exceptions.ConnectionError('В кассете нет ответа на запрос', request=request)
+        time.sleep(self.cassette.delay(entry['ttfb']))
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = http.client.responses.get(entry['status'], '')
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = _ReplayRaw(self.cassette, entry['chunks'], started)
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=entry['ttfb'])
+        response.connection = self
+        return response
+
+    def close(self):
+        self.inner.close()
+
+
+# ========== АСИНХРОННЫЙ КЛИЕНТ (httpx) ==========
+
+class _ReplayAsyncStream(httpx.AsyncByteStream):
+    def __init__(self, cassette, chunks, started):
+        self._cassette = cassette
+        self._chunks = chunks
+        self._started = started
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            wait = self._started + self._cassette.delay(chunk['at']) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield _decode_chunk(chunk)
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """Транспорт httpx: пишет ответы внутреннего транспорта или отдает их из кассеты"""
+
+    def __init__(self, inner, cassette):
+        """
+        Args:
+            inner (httpx.AsyncBaseTransport): Транспорт, который ходит в сеть
+            cassette (Cassette): Кассета
+        """
+        self.inner = inner
+        self.cassette = cassette
+
+    async def handle_async_request(self, request):
+        body = await request.aread()
+        started = time.monotonic()
+
+        if self.cassette.mode == 'replay':
+            entry = self.cassette.find(request.method, request.url, body)
+            if entry is None:
+                raise httpx.ConnectError('В кассете нет ответа на запрос', request=request)
+            await asyncio.sleep(self.cassette.delay(entry['ttfb']))
+            return httpx.Response(
+                entry['status'],
+                headers=entry['headers'],
+                stream=_ReplayAsyncStream(self.cassette, entry['chunks'], started),
+                request=request
+            )
+
+        response = await self.inner.handle_async_request(request)
+        ttfb = time.monotonic() - started
+        chunks = []
+        try:
+            async for data in response.aiter_bytes():
+                chunks.append((time.monotonic() - started, data))
+        finally:
+            await response.aclose()
+        self.cassette.record(request.method, request.url, body, response.status_code,
+                             response.headers, ttfb, chunks)
+        # Тело уже прочитано и распаковано
+        headers = [(name, value) for name, value in response.headers.items()
+                   if name.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')]
+        return httpx.Response(
+            response.status_code,
+            headers=headers,
+            content=b''.join(data for _, data in chunks),
+            request=request,
+            extensions=response.extensions
+        )
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette():
+    """
+    Кассета процесса, если она включена (HTTP_CASSETTE)
+
+    Returns:
+        Cassette: Кассета или None
+    """
+    global _cassette
+    path = os.getenv('HTTP_CASSETTE')
+    if not path:
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(path, os.getenv('HTTP_CASSETTE_MODE', 'replay'))
+            logger.info(f"📼 Кассета HTTP: {path} (режим {_cassette.mode})")
+        return _cassette
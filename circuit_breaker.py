@@ -0,0 +1,172 @@
+"""
+Автоматический выключатель (circuit breaker) для провайдеров AI
+
+Если провайдер начал отвечать ошибками или слишком медленно, ждать
+полный таймаут на каждом сообщении бессмысленно. Выключатель:
+- CLOSED    - запросы идут как обычно, считаем ошибки подряд;
+- OPEN      - после failure_threshold ошибок (или медленных ответов)
+              запросы к провайдеру не отправляются reset_timeout секунд;
+- HALF_OPEN - по истечении паузы пропускаем пробный запрос: успех
+              закрывает выключатель, ошибка снова открывает.
+
+Настройки (переменные окружения):
+    BREAKER_FAILURE_THRESHOLD  - ошибок подряд до размыкания (5)
+    BREAKER_SLOW_CALL_SECONDS  - ответ медленнее считается ошибкой (15)
+    BREAKER_RESET_TIMEOUT      - пауза перед пробным запросом, сек (30)
+"""
+
+import os
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Выключатель одного провайдера"""
+
+    def __init__(self, name, failure_threshold=None, slow_call_seconds=None, reset_timeout=None):
+        """
+        Args:
+            name (str): Имя провайдера
+            failure_threshold (int): Ошибок подряд до размыкания
+            slow_call_seconds (float): Порог медленного ответа, сек
+            reset_timeout (float): Пауза до пробного запроса, сек
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+        self.slow_call_seconds = slow_call_seconds or float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '15'))
+        self.reset_timeout = reset_timeout or float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+        self.open_count = 0
+        self.rejected = 0
+
+    def allow_request(self):
+        """
+        Можно ли отправить запрос к провайдеру
+
+        Если ответ True, результат запроса нужно обязательно передать в
+        record_success() или record_failure().
+
+        Returns:
+            bool: True - отправлять, False - провайдер считается недоступным
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                logger.info(f"🟡 {self.name}: пробный запрос после паузы")
+
+            if self.state == CLOSED:
+                return True
+            # Пробный запрос один; если его результат так и не пришел
+            # (запрос отменен), через reset_timeout пускаем следующий
+            if self.state == HALF_OPEN and (
+                self._probe_started is None
+                or time.monotonic() - self._probe_started >= self.reset_timeout
+            ):
+                self._probe_started = time.monotonic()
+                return True
+
+            self.rejected += 1
+            return False
+
+    def is_closed(self):
+        """
+        Работает ли провайдер штатно (проверка не тратит пробный запрос)
+
+        Returns:
+            bool: True, если выключатель замкнут
+        """
+        with self._lock:
+            return self.state == CLOSED
+
+    def record_success(self, latency):
+        """
+        Учесть успешный ответ
+
+        Args:
+            latency (float): Время ответа, сек (медленный ответ считается ошибкой)
+        """
+        if latency > self.slow_call_seconds:
+            logger.warning(f"🐢 {self.name}: медленный ответ ({latency:.1f} с)")
+            self.record_failure()
+            return
+
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"🟢 {self.name}: провайдер снова доступен")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        """Учесть ошибку или таймаут"""
+        with self._lock:
+            self.failures += 1
+            self._probe_started = None
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.failures >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.open_count += 1
+                logger.warning(
+                    f"🔴 {self.name}: выключатель разомкнут на {self.reset_timeout:.0f} с "
+                    f"(ошибок подряд: {self.failures})"
+                )
+
+    def stats(self):
+        """
+        Состояние выключателя
+
+        Returns:
+            dict: Состояние, ошибки подряд, число размыканий и отклоненных запросов
+        """
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'open_count': self.open_count,
+                'rejected': self.rejected
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider):
+    """
+    Общий для процесса выключатель провайдера
+
+    Args:
+        provider (str): 'yandex' или 'sber'
+
+    Returns:
+        CircuitBreaker: Выключатель
+    """
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
+
+
+def get_breaker_stats():
+    """
+    Состояние всех выключателей
+
+    Returns:
+        dict: {провайдер: stats()}
+    """
+    with _breakers_lock:
+        return {name: breaker.stats() for name, breaker in _breakers.items()}
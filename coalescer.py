@@ -0,0 +1,146 @@
+"""
+Склейка серии быстрых сообщений пользователя в один запрос к AI
+
+Пользователи часто разбивают одну мысль на несколько сообщений подряд.
+Коалесцер ждет window_ms после последнего сообщения (но не дольше
+max_wait_ms с первого) и отправляет все накопленные сообщения одной
+репликой. Сообщения, пришедшие, пока склеенная реплика еще стоит в
+очереди пользователя и не начала обрабатываться, добавляются в нее же.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from tracing import bind
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    """Накопленные сообщения одного пользователя"""
+
+    def __init__(self, loop):
+        self.items = []
+        self.first_at = time.monotonic()
+        self.timer = None
+        self.submitted = False
+        self.done = loop.create_future()
+
+
+class MessageCoalescer:
+    """Дебаунс сообщений по пользователю перед постановкой в UserScheduler"""
+
+    def __init__(self, scheduler, process, window_ms=None, max_wait_ms=None):
+        """
+        Args:
+            scheduler (UserScheduler): Очереди пользователей
+            process (callable): Корутина process(update, context, text) для
+                                склеенной реплики; отвечаем на последнее сообщение
+            window_ms (float): Окно ожидания следующего сообщения
+                               (MESSAGE_COALESCE_MS, 0 - склейка выключена)
+            max_wait_ms (float): Максимальная задержка первого сообщения
+                                 (MESSAGE_COALESCE_MAX_MS, 2000)
+        """
+        self.scheduler = scheduler
+        self.process = process
+        if window_ms is None:
+            window_ms = float(os.getenv('MESSAGE_COALESCE_MS', '0'))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv('MESSAGE_COALESCE_MAX_MS', '2000'))
+        self.window = window_ms / 1000
+        self.max_wait = max(max_wait_ms, window_ms) / 1000
+
+        self._open = {}
+        self.batches = 0
+        self.merged = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def add(self, user_id, update, context, text):
+        """
+        Добавить сообщение пользователя
+
+        Args:
+            user_id (int): ID пользователя
+            update (Update): Обновление Telegram
+            context: Контекст обработчика
+            text (str): Текст сообщения
+
+        Returns:
+            asyncio.Future: Завершится, когда склеенная реплика будет обработана
+        """
+        loop = asyncio.get_running_loop()
+        batch = self._open.get(user_id)
+        if batch is None:
+            batch = self._open[user_id] = _Batch(loop)
+        else:
+            self.merged += 1
+        batch.items.append((update, context, text))
+
+        if not batch.submitted:
+            if batch.timer is not None:
+                batch.timer.cancel()
+            delay = min(self.window, batch.first_at + self.max_wait - time.monotonic())
+            batch.timer = loop.call_later(max(delay, 0), self._submit, user_id, batch)
+        return batch.done
+
+    def flush(self, user_id):
+        """
+        Закрыть накопленную реплику пользователя
+
+        Реплика сразу встает в очередь пользователя, а следующие сообщения
+        пойдут в новую - так команда, поставленная в очередь после этого,
+        не окажется между сообщениями одной реплики.
+
+        Args:
+            user_id (int): ID пользователя
+        """
+        batch = self._open.pop(user_id, None)
+        if batch is not None and not batch.submitted:
+            batch.timer.cancel()
+            self._submit(user_id, batch)
+
+    def _submit(self, user_id, batch):
+        """Окно истекло - ставим реплику в очередь пользователя"""
+        batch.submitted = True
+        self.batches += 1
+        # Трасса последнего сообщения продолжается в склеенной реплике
+        future = self.scheduler.submit(user_id, bind(lambda: self._run(user_id, batch)))
+        future.add_done_callback(lambda f: self._resolve(batch, f))
+
+    async def _run(self, user_id, batch):
+        """Обработка начинается - дальнейшие сообщения пойдут в новую реплику"""
+        if self._open.get(user_id) is batch:
+            del self._open[user_id]
+
+        update, context, _ = batch.items[-1]
+        text = '\n'.join(item[2] for item in batch.items)
+        if len(batch.items) > 1:
+            logger.info(f"🧩 Склеено {len(batch.items)} сообщений пользователя {user_id}")
+        return await self.process(update, context, text)
+
+    @staticmethod
+    def _resolve(batch, future):
+        if batch.done.done():
+            return
+        if future.exception() is not None:
+            batch.done.set_exception(future.exception())
+        else:
+            batch.done.set_result(future.result())
+
+    def stats(self):
+        """
+        Статистика склейки
+
+        Returns:
+            dict: Сколько реплик отправлено и сколько сообщений в них вклеено
+        """
+        return {
+            'window_ms': self.window * 1000,
+            'pending_users': len(self._open),
+            'batches': self.batches,
+            'merged_messages': self.merged
+        }
@@ -0,0 +1,158 @@
+"""
+Ограничение истории диалога по бюджету токенов
+
+История, которая отправляется провайдеру, не должна расти бесконечно:
+каждый ход пересылает ее целиком, поэтому стоимость и задержка запроса
+растут вместе с длиной диалога. ContextWindow оставляет в истории только
+самые свежие сообщения (и системный промпт), укладывающиеся в бюджет.
+
+Токены считаются локально приближенно (estimate_tokens); посчитанное
+значение хранится в самом сообщении и больше не пересчитывается.
+
+Настройки (переменные окружения):
+    CONTEXT_MAX_TOKENS    - бюджет токенов на историю (6000)
+    TOKEN_CHARS_CYRILLIC  - букв кириллицы на токен (3.5)
+    TOKEN_CHARS_LATIN     - латинских букв на токен (4)
+"""
+
+import os
+import re
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Служебные токены на каждое сообщение (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Поле сообщения, в котором запоминается его оценка
+TOKENS_FIELD = 'tokens'
+
+CYRILLIC_CHARS_PER_TOKEN = float(os.getenv('TOKEN_CHARS_CYRILLIC', '3.5'))
+LATIN_CHARS_PER_TOKEN = float(os.getenv('TOKEN_CHARS_LATIN', '4'))
+
+# Текст режется на слова так же, как это делает пре-токенайзер BPE:
+# пробел перед словом входит в его токен, перевод строки - отдельный токен
+_PIECES = re.compile(
+    r'(?P<cyr>[А-Яа-яЁё]+)|(?P<lat>[A-Za-z]+)|(?P<num>\d+)|(?P<nl>\n)'
+    r'|(?P<space>[ \t\r\f\v]+)|(?P<punct>[^\w\s])|(?P<other>\w)'
+)
+
+
+def _word_tokens(length, chars_per_token):
+    # Частые короткие слова - один токен, длинные округляются до ближайшего
+    return max(1, int(length / chars_per_token + 0.5))
+
+
+def estimate_tokens(text):
+    """
+    Приближенная оценка числа токенов в тексте
+
+    Токенайзеры YandexGPT и GigaChat обучены на русском тексте: короткое
+    слово - один токен, длинное делится на части примерно по 3-4 буквы
+    (английское - по 4). Числа делятся по три цифры, знак препинания,
+    перевод строки и символ другого алфавита - отдельный токен.
+
+    Args:
+        text (str): Текст сообщения
+
+    Returns:
+        int: Оценка числа токенов
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for match in _PIECES.finditer(text):
+        kind = match.lastgroup
+        if kind == 'cyr':
+            tokens += _word_tokens(len(match.group()), CYRILLIC_CHARS_PER_TOKEN)
+        elif kind == 'lat':
+            tokens += _word_tokens(len(match.group()), LATIN_CHARS_PER_TOKEN)
+        elif kind == 'num':
+            tokens += math.ceil(len(match.group()) / 3)
+        elif kind != 'space':
+            tokens += 1
+    return tokens
+
+
+def count_message_tokens(message):
+    """
+    Число токенов сообщения с учетом служебных
+
+    Оценка считается один раз и запоминается в сообщении (поле tokens),
+    поэтому повторные проходы по истории ничего не пересчитывают.
+
+    Args:
+        message (dict): Сообщение {'role': ..., 'text': ...}
+
+    Returns:
+        int: Число токенов
+    """
+    tokens = message.get(TOKENS_FIELD)
+    if tokens is None:
+        tokens = message[TOKENS_FIELD] = estimate_tokens(message['text']) + MESSAGE_OVERHEAD_TOKENS
+    return tokens
+
+
+class ContextWindow:
+    """Обрезка истории диалога под бюджет токенов"""
+
+    def __init__(self, max_tokens=None):
+        """
+        Args:
+            max_tokens (int): Бюджет токенов на историю
+                              (по умолчанию CONTEXT_MAX_TOKENS или 6000)
+        """
+        if max_tokens is None:
+            max_tokens = int(os.getenv('CONTEXT_MAX_TOKENS', '6000'))
+        self.max_tokens = max_tokens
+
+    def count_tokens(self, history):
+        """
+        Число токенов во всей истории
+
+        Args:
+            history (list): Список сообщений
+
+        Returns:
+            int: Число токенов
+        """
+        return sum(count_message_tokens(msg) for msg in history)
+
+    def fit(self, history):
+        """
+        Оставить в истории самые свежие сообщения, укладывающиеся в бюджет
+
+        Системные сообщения сохраняются всегда, последнее сообщение -
+        тоже, даже если оно одно превышает бюджет.
+
+        Args:
+            history (list): Список сообщений
+
+        Returns:
+            list: Та же история, если она укладывается в бюджет, иначе новый список
+        """
+        if self.count_tokens(history) <= self.max_tokens:
+            return history
+
+        system = [msg for msg in history if msg['role'] == 'system']
+        budget = self.max_tokens - self.count_tokens(system)
+
+        kept = []
+        used = 0
+        for msg in reversed(history):
+            if msg['role'] == 'system':
+                continue
+            tokens = count_message_tokens(msg)
+            if kept and used + tokens > budget:
+                break
+            kept.append(msg)
+            used += tokens
+
+        kept.reverse()
+        trimmed = system + kept
+        logger.info(
+            f"✂️ История обрезана под бюджет {self.max_tokens} токенов: "
+            f"{len(history)} → {len(trimmed)} сообщений"
+        )
+        return trimmed
@@ -0,0 +1,235 @@
+"""
+Долговременное хранилище диалогов на SQLite
+
+История диалогов переживает перезапуск бота. Запись идет в режиме WAL
+фоновым потоком: add_message только ставит операцию в очередь, а поток
+записывает накопившиеся операции пачкой в одной транзакции, поэтому
+обработка сообщения никогда не ждет fsync.
+
+Если пачку записать не удалось (например, "database is locked", когда
+базу делят воркеры супервизора), она повторяется с паузой, а затем
+операции пишутся по одной: ошибка одной операции не теряет остальные.
+"""
+
+import os
+import time
+import queue
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_user_id ON messages (user_id, id);
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    provider TEXT NOT NULL
+);
+"""
+
+# Маркер остановки фонового потока
+_STOP = object()
+
+
+def _connect(path):
+    """Открыть соединение с базой в режиме WAL"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    # В режиме WAL synchronous=NORMAL не теряет целостность при сбое
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class ConversationStore:
+    """SQLite-хранилище истории диалогов с отложенной пакетной записью"""
+
+    def __init__(self, path, batch_size=None, load_limit=None, write_retries=None):
+        """
+        Args:
+            path (str): Путь к файлу базы
+            batch_size (int): Максимум операций в одной транзакции
+                              (CONVERSATION_BATCH_SIZE, 200)
+            load_limit (int): Сколько последних сообщений загружать при
+                              восстановлении диалога (CONVERSATION_LOAD_LIMIT, 200)
+            write_retries (int): Повторов пачки после ошибки записи
+                                 (CONVERSATION_WRITE_RETRIES, 3)
+        """
+        self.path = path
+        self.batch_size = batch_size or int(os.getenv('CONVERSATION_BATCH_SIZE', '200'))
+        self.load_limit = load_limit or int(os.getenv('CONVERSATION_LOAD_LIMIT', '200'))
+        if write_retries is None:
+            write_retries = int(os.getenv('CONVERSATION_WRITE_RETRIES', '3'))
+        self.write_retries = write_retries
+        self.retries = 0
+        self.failed_writes = 0
+
+        self._queue = queue.Queue()
+        # Сколько незаписанных операций у каждого пользователя
+        self._pending = {}
+        self._pending_cond = threading.Condition()
+
+        writer_conn = _connect(path)
+        writer_conn.executescript(SCHEMA)
+        writer_conn.commit()
+        self._read_conn = _connect(path)
+        self._read_lock = threading.Lock()
+
+        self._writer = threading.Thread(
+            target=self._write_loop,
+            args=(writer_conn,),
+            name='conversation-store-writer',
+            daemon=True
+        )
+        self._writer.start()
+        logger.info(f"💾 Хранилище диалогов: {path}")
+
+    # ========== ОПЕРАЦИИ ЗАПИСИ (НЕ БЛОКИРУЮТ) ==========
+
+    def _enqueue(self, user_id, sql, params):
+        with self._pending_cond:
+            self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        self._queue.put((user_id, sql, params))
+
+    def append(self, user_id, role, text):
+        """Добавить сообщение в историю пользователя"""
+        self._enqueue(
+            user_id,
+            'INSERT INTO messages (user_id, role, text, created_at) VALUES (?, ?, ?, ?)',
+            (user_id, role, text, time.time())
+        )
+
+    def clear(self, user_id):
+        """Удалить историю пользователя"""
+        self._enqueue(user_id, 'DELETE FROM messages WHERE user_id = ?', (user_id,))
+
+    def set_provider(self, user_id, provider):
+        """Запомнить выбранного пользователем провайдера"""
+        self._enqueue(
+            user_id,
+            'INSERT OR REPLACE INTO users (user_id, provider) VALUES (?, ?)',
+            (user_id, provider)
+        )
+
+    def _write_loop(self, conn):
+        """Фоновый поток: записывает операции из очереди пачками"""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(item is _STOP for item in batch)
+            batch = [item for item in batch if item is not _STOP]
+
+            self._write_batch(conn, batch)
+
+            with self._pending_cond:
+                for user_id, _, _ in batch:
+                    self._pending[user_id] -= 1
+                    if not self._pending[user_id]:
+                        del self._pending[user_id]
+                self._pending_cond.notify_all()
+
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+
+            if stop:
+                conn.close()
+                return
+
+    def _write_batch(self, conn, batch):
+        """Записать пачку одной транзакцией, при ошибке - с повторами, затем по одной"""
+        for attempt in range(self.write_retries + 1):
+            try:
+                with conn:
+                    for _, sql, params in batch:
+                        conn.execute(sql, params)
+                return
+            except sqlite3.OperationalError as e:
+                # База занята другим процессом или диск временно недоступен
+                if attempt >= self.write_retries:
+                    logger.error(f"❌ Ошибка записи диалогов в SQLite: {e}, записываю по одной операции")
+                    break
+                delay = min(0.1 * 2 ** attempt, 2.0)
+                self.retries += 1
+                logger.warning(f"🔁 Запись диалогов в SQLite: {e}, повтор через {delay:.1f} с")
+                time.sleep(delay)
+            except sqlite3.Error as e:
+                # Ошибку вызвала одна из операций - повтор пачки не поможет
+                logger.error(f"❌ Ошибка записи диалогов в SQLite: {e}, записываю по одной операции")
+                break
+
+        for user_id, sql, params in batch:
+            try:
+                with conn:
+                    conn.execute(sql, params)
+            except sqlite3.Error as e:
+                self.failed_writes += 1
+                logger.error(f"❌ Не записана операция диалога пользователя {user_id}: {e}")
+
+    # ========== ЧТЕНИЕ ==========
+
+    def load(self, user_id):
+        """
+        Загрузить сохраненный диалог пользователя
+
+        Если у пользователя есть еще не записанные операции, сначала
+        дожидаемся их записи.
+
+        Args:
+            user_id (int): ID пользователя
+
+        Returns:
+            dict: {'provider': ..., 'history': [...]} или None
+        """
+        with self._pending_cond:
+            self._pending_cond.wait_for(lambda: user_id not in self._pending)
+
+        with self._read_lock:
+            row = self._read_conn.execute(
+                'SELECT provider FROM users WHERE user_id = ?', (user_id,)
+            ).fetchone()
+            rows = self._read_conn.execute(
+                'SELECT role, text FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+                (user_id, self.load_limit)
+            ).fetchall()
+
+        if row is None and not rows:
+            return None
+
+        history = [{'role': role, 'text': text} for role, text in reversed(rows)]
+        state = {'history': history}
+        if row is not None:
+            state['provider'] = row[0]
+        return state
+
+    def save(self, user_id, state):
+        """
+        Сохранение при вытеснении из реестра не нужно: все уже записано
+
+        Метод есть для совместимости с интерфейсом spill store.
+        """
+
+    # ========== ЗАВЕРШЕНИЕ ==========
+
+    def flush(self):
+        """Дождаться записи всех операций из очереди"""
+        self._queue.join()
+
+    def close(self):
+        """Записать оставшиеся операции и остановить фоновый поток"""
+        self._queue.put(_STOP)
+        self._writer.join()
+        with self._read_lock:
+            self._read_conn.close()
+        logger.info("💾 Хранилище диалогов закрыто")
@@ -0,0 +1,155 @@
+"""
+Общий кэш OAuth-токена GigaChat
+
+Токен доступа GigaChat живет около 30 минут и одинаков для всех
+пользователей бота, поэтому он запрашивается один раз на процесс:
+- токен хранится до момента незадолго до expires_at;
+- фоновый поток обновляет его заранее, не дожидаясь истечения;
+- одновременные запросы на обновление схлопываются в один OAuth-запрос.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import threading
+import logging
+
+from http_pool import get_session
+
+logger = logging.getLogger(__name__)
+
+OAUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+
+
+class GigaChatTokenManager:
+    """Кэш и single-flight обновление токена доступа GigaChat"""
+
+    def __init__(self, auth_data, scope='GIGACHAT_API_PERS', refresh_margin=None):
+        """
+        Args:
+            auth_data (str): Ключ авторизации (Basic) из личного кабинета
+            scope (str): Область доступа API
+            refresh_margin (float): За сколько секунд до истечения обновлять токен
+                                    (по умолчанию GIGACHAT_TOKEN_REFRESH_MARGIN или 60)
+        """
+        self.auth_data = auth_data
+        self.scope = scope
+        if refresh_margin is None:
+            refresh_margin = float(os.getenv('GIGACHAT_TOKEN_REFRESH_MARGIN', '60'))
+        self.refresh_margin = refresh_margin
+
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._refresher = None
+        self.refresh_count = 0
+
+    def _is_fresh(self):
+        return self._token is not None and time.time() < self._expires_at - self.refresh_margin
+
+    def _fetch(self):
+        """Запросить новый токен у OAuth-сервера Сбера"""
+        headers = {
+            "Authorization": f"Basic {self.auth_data}",
+            "RqUID": str(uuid.uuid4()),
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+
+        response = get_session('gigachat').post(
+            os.getenv('GIGACHAT_OAUTH_URL', OAUTH_URL),
+            headers=headers,
+            data={"scope": self.scope},
+            verify=False,  # Отключение проверки SSL (для Сбера)
+            timeout=10
+        )
+        if response.status_code != 200:
+            raise Exception(f"Ошибка получения токена: {response.status_code}")
+
+        token_data = response.json()
+        self._token = token_data['access_token']
+        # expires_at приходит в миллисекундах
+        self._expires_at = token_data.get('expires_at', (time.time() + 1800) * 1000) / 1000
+        self.refresh_count += 1
+        logger.info(f"✅ GigaChat токен получен (действует {int(self._expires_at - time.time())} с)")
+
+    def get_token(self, stale_token=None):
+        """
+        Получить действующий токен
+
+        Args:
+            stale_token (str): Токен, который сервер отверг (401). Если в кэше
+                               все еще он - токен будет обновлен принудительно.
+
+        Returns:
+            str: Токен доступа
+        """
+        token = self._token
+        if self._is_fresh() and (stale_token is None or token != stale_token):
+            return token
+
+        with self._lock:
+            # Пока ждали блокировку, токен мог обновить другой поток
+            if self._is_fresh() and (stale_token is None or self._token != stale_token):
+                return self._token
+            self._fetch()
+            self._start_refresher()
+            return self._token
+
+    async def aget_token(self, stale_token=None):
+        """
+        Асинхронный вариант get_token
+
+        Действующий токен отдается сразу; обновление выполняется в потоке,
+        чтобы не блокировать event loop.
+        """
+        token = self._token
+        if self._is_fresh() and (stale_token is None or token != stale_token):
+            return token
+        return await asyncio.to_thread(self.get_token, stale_token)
+
+    def _start_refresher(self):
+        """Запустить фоновое упреждающее обновление токена (один раз)"""
+        if self._refresher is not None:
+            return
+        self._refresher = threading.Thread(
+            target=self._refresh_loop,
+            name='gigachat-token-refresher',
+            daemon=True
+        )
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            delay = self._expires_at - self.refresh_margin - time.time()
+            time.sleep(max(delay, 1))
+            try:
+                with self._lock:
+                    if not self._is_fresh():
+                        self._fetch()
+            except Exception as e:
+                logger.error(f"❌ Ошибка фонового обновления токена GigaChat: {e}")
+                time.sleep(10)
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(auth_data, scope=None):
+    """
+    Получить общий для процесса менеджер токенов
+
+    Args:
+        auth_data (str): Ключ авторизации GigaChat
+        scope (str): Область доступа (по умолчанию SBER_SCOPE или GIGACHAT_API_PERS)
+
+    Returns:
+        GigaChatTokenManager: Менеджер токенов
+    """
+    scope = scope or os.getenv('SBER_SCOPE', 'GIGACHAT_API_PERS')
+    with _managers_lock:
+        key = (auth_data, scope)
+        if key not in _managers:
+            _managers[key] = GigaChatTokenManager(auth_data, scope)
+        return _managers[key]
@@ -0,0 +1,211 @@
+"""
+Hedged-запросы: дубль медленного запроса для борьбы с хвостом задержек
+
+Если провайдер не ответил за время, которое укладывается в заданный
+перцентиль недавних ответов, тот же ход отправляется второй раз
+(резервному провайдеру или повторно тому же) и берется первый ответ.
+Проигравший запрос отменяется. Число дублей ограничено бюджетом в
+минуту, чтобы при общей деградации не удвоить нагрузку на провайдеров.
+
+Настройки (переменные окружения):
+    HEDGE_ENABLED         - включить дублирование (0)
+    HEDGE_PERCENTILE      - перцентиль задержки, после которого шлем дубль (95)
+    HEDGE_LATENCY_WINDOW  - сколько последних замеров учитывать (200)
+    HEDGE_MIN_SAMPLES     - меньше замеров - используется HEDGE_DEFAULT_DELAY (20)
+    HEDGE_DEFAULT_DELAY   - задержка дубля без статистики, сек (3)
+    HEDGE_MIN_DELAY       - не дублировать раньше, сек (0.3)
+    HEDGE_MAX_PER_MINUTE  - дублей в минуту на процесс (30)
+    HEDGE_THREADS         - потоков для синхронного RussianAI (32)
+"""
+
+import os
+import math
+import time
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """Скользящее окно задержек ответов одного провайдера"""
+
+    def __init__(self, window=None):
+        """
+        Args:
+            window (int): Сколько последних замеров хранить
+        """
+        self._samples = deque(maxlen=window or int(os.getenv('HEDGE_LATENCY_WINDOW', '200')))
+        self._lock = threading.Lock()
+
+    def add(self, latency):
+        """
+        Добавить замер
+
+        Args:
+            latency (float): Время ответа, сек
+        """
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, p):
+        """
+        Перцентиль задержки
+
+        Args:
+            p (float): Перцентиль, 0-100
+
+        Returns:
+            float: Задержка, сек (None, если замеров нет)
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))
+        return samples[index]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class HedgeBudget:
+    """Ограничение числа дублей в минуту (скользящее окно)"""
+
+    def __init__(self, per_minute=None):
+        """
+        Args:
+            per_minute (int): Дублей в минуту
+        """
+        self.per_minute = per_minute or int(os.getenv('HEDGE_MAX_PER_MINUTE', '30'))
+        self._issued = deque()
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.denied = 0
+        self.wins = 0
+
+    def try_acquire(self):
+        """
+        Взять разрешение на дубль
+
+        Returns:
+            bool: True, если бюджет еще не исчерпан
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._issued and now - self._issued[0] >= 60:
+                self._issued.popleft()
+            if len(self._issued) >= self.per_minute:
+                self.denied += 1
+                return False
+            self._issued.append(now)
+            self.hedges += 1
+            return True
+
+    def stats(self):
+        """
+        Счетчики дублей
+
+        Returns:
+            dict: Отправлено дублей, отказано по бюджету, дубль ответил первым
+        """
+        return {
+            'hedges': self.hedges,
+            'denied': self.denied,
+            'wins': self.wins
+        }
+
+
+def hedging_enabled():
+    """
+    Returns:
+        bool: Включено ли дублирование запросов (HEDGE_ENABLED=1)
+    """
+    return os.getenv('HEDGE_ENABLED', '0') == '1'
+
+
+_trackers = {}
+_budget = None
+_executor = None
+_lock = threading.Lock()
+
+
+def get_latency_tracker(provider):
+    """
+    Общее для процесса окно задержек провайдера
+
+    Args:
+        provider (str): 'yandex' или 'sber'
+
+    Returns:
+        LatencyTracker: Окно задержек
+    """
+    with _lock:
+        if provider not in _trackers:
+            _trackers[provider] = LatencyTracker()
+        return _trackers[provider]
+
+
+def get_hedge_budget():
+    """
+    Общий для процесса бюджет дублей
+
+    Returns:
+        HedgeBudget: Бюджет
+    """
+    global _budget
+    with _lock:
+        if _budget is None:
+            _budget = HedgeBudget()
+        return _budget
+
+
+def get_hedge_executor():
+    """
+    Пул потоков, в котором синхронный RussianAI выполняет основной запрос и дубль
+
+    Returns:
+        ThreadPoolExecutor: Пул
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv('HEDGE_THREADS', '32')),
+                thread_name_prefix='hedge'
+            )
+        return _executor
+
+
+def hedge_delay(provider):
+    """
+    Через сколько секунд без ответа отправлять дубль
+
+    Args:
+        provider (str): Провайдер основного запроса
+
+    Returns:
+        float: Задержка, сек
+    """
+    tracker = get_latency_tracker(provider)
+    if len(tracker) < int(os.getenv('HEDGE_MIN_SAMPLES', '20')):
+        delay = float(os.getenv('HEDGE_DEFAULT_DELAY', '3'))
+    else:
+        delay = tracker.percentile(float(os.getenv('HEDGE_PERCENTILE', '95')))
+    return max(delay, float(os.getenv('HEDGE_MIN_DELAY', '0.3')))
+
+
+def get_hedge_stats():
+    """
+    Статистика дублирования
+
+    Returns:
+        dict: Счетчики бюджета и текущая задержка дубля по провайдерам
+    """
+    with _lock:
+        providers = list(_trackers)
+    stats = get_hedge_budget().stats()
+    stats['delay'] = {provider: round(hedge_delay(provider), 3) for provider in providers}
+    return stats
@@ -0,0 +1,312 @@
+"""
+Общие пулы HTTP-соединений для российских AI провайдеров
+
+Каждый провайдер (YandexGPT, GigaChat) получает один процессный
+requests.Session с keep-alive пулом соединений. Все экземпляры RussianAI
+используют одну и ту же сессию, поэтому DNS-запрос, TCP-соединение и
+TLS-рукопожатие выполняются один раз, а не на каждое сообщение.
+
+Для асинхронного бота аналогично создается один httpx.AsyncClient на
+провайдера (get_async_client).
+
+Настройки (переменные окружения):
+    HTTP_POOL_SIZE          - максимум соединений на хост (по умолчанию - лимит
+                              одновременных запросов провайдера, {PROVIDER}_MAX_CONCURRENT)
+    HTTP_POOL_IDLE_TIMEOUT  - через сколько секунд простоя пул сбрасывается (60)
+    HTTP_KEEPALIVE          - включить TCP keep-alive на сокетах (1)
+
+Если задан HTTP_CASSETTE, запросы всех сессий и клиентов проходят через
+кассету (см. cassette.py): запись реального трафика или его воспроизведение.
+"""
+
+import os
+import socket
+import threading
+import time
+import logging
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from tracing import record_event
+from rate_limiter import max_concurrent
+from cassette import get_cassette, CassetteAdapter, CassetteTransport
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """Счетчики использования пула соединений одного провайдера"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.evictions = 0
+
+    def increment(self, name):
+        """
+        Увеличить счетчик на единицу
+
+        Args:
+            name (str): Имя счетчика ('requests', 'new_connections', 'evictions')
+        """
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        """
+        Снимок счетчиков
+
+        Returns:
+            dict: Запросы, новые и переиспользованные соединения
+        """
+        with self._lock:
+            reused = max(self.requests - self.new_connections, 0)
+            return {
+                'requests': self.requests,
+                'new_connections': self.new_connections,
+                'reused_connections': reused,
+                'reuse_ratio': reused / self.requests if self.requests else 0.0,
+                'evictions': self.evictions
+            }
+
+
+def _counting_pool_class(base, stats):
+    """
+    Создать класс пула urllib3, считающий запросы и новые соединения
+
+    Args:
+        base (type): HTTPConnectionPool или HTTPSConnectionPool
+        stats (PoolStats): Куда писать счетчики
+
+    Returns:
+        type: Подкласс base
+    """
+    class CountingPool(base):
+        def _new_conn(self):
+            stats.increment('new_connections')
+            return super()._new_conn()
+
+        def urlopen(self, method, url, *args, **kwargs):
+            stats.increment('requests')
+            return super().urlopen(method, url, *args, **kwargs)
+
+    return CountingPool
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter с TCP keep-alive и подсчетом переиспользования соединений"""
+
+    def __init__(self, stats, keepalive=True, **kwargs):
+        self.stats = stats
+        self.keepalive = keepalive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self.keepalive:
+            pool_kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        # Словарь классов в urllib3 общий для модуля - подменяем копией
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool_class(HTTPConnectionPool, self.stats),
+            'https': _counting_pool_class(HTTPSConnectionPool, self.stats)
+        }
+
+
+class _PoolEntry:
+    """Сессия провайдера и время ее последнего использования"""
+
+    def __init__(self, session, adapter, stats):
+        self.session = session
+        self.adapter = adapter
+        self.stats = stats
+        self.last_used = time.monotonic()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+_async_clients = {}
+_async_stats = {}
+
+
+def _env_flag(name, default):
+    return os.getenv(name, default).lower() not in ('0', 'false', 'no', 'off')
+
+
+def _pool_size(provider):
+    """Размер пула: HTTP_POOL_SIZE или лимит одновременных запросов провайдера"""
+    return int(os.getenv('HTTP_POOL_SIZE') or max_concurrent(provider))
+
+
+def _create_entry(provider):
+    """
+    Создать сессию с пулом соединений для провайдера
+
+    Args:
+        provider (str): Имя провайдера ('yandex', 'gigachat')
+
+    Returns:
+        _PoolEntry: Новая запись пула
+    """
+    pool_size = _pool_size(provider)
+    keepalive = _env_flag('HTTP_KEEPALIVE', '1')
+
+    stats = PoolStats()
+    adapter = PooledAdapter(
+        stats,
+        keepalive=keepalive,
+        pool_connections=4,
+        pool_maxsize=pool_size
+    )
+    session = requests.Session()
+    cassette = get_cassette()
+    mounted = CassetteAdapter(adapter, cassette) if cassette is not None else adapter
+    session.mount('https://', mounted)
+    session.mount('http://', mounted)
+    session.headers['Connection'] = 'keep-alive'
+
+    logger.info(f"🔌 Создан пул соединений для {provider}: размер={pool_size}, keep-alive={keepalive}")
+    return _PoolEntry(session, adapter, stats)
+
+
+def get_session(provider):
+    """
+    Получить общую сессию провайдера
+
+    Если пул простаивал дольше HTTP_POOL_IDLE_TIMEOUT, его соединения
+    закрываются (сервер, скорее всего, уже оборвал их), и следующий запрос
+    откроет свежее соединение.
+
+    Args:
+        provider (str): Имя провайдера ('yandex', 'gigachat')
+
+    Returns:
+        requests.Session: Сессия с keep-alive пулом
+    """
+    idle_timeout = float(os.getenv('HTTP_POOL_IDLE_TIMEOUT', '60'))
+
+    with _pools_lock:
+        entry = _pools.get(provider)
+        if entry is None:
+            entry = _pools[provider] = _create_entry(provider)
+        elif idle_timeout > 0 and time.monotonic() - entry.last_used > idle_timeout:
+            entry.adapter.poolmanager.clear()
+            entry.stats.increment('evictions')
+            logger.debug(f"♻️ Пул {provider} сброшен после простоя")
+        entry.last_used = time.monotonic()
+        return entry.session
+
+
+def evict_idle(idle_timeout=None):
+    """
+    Закрыть соединения всех пулов, простаивающих дольше idle_timeout
+
+    Args:
+        idle_timeout (float): Порог простоя в секундах (по умолчанию из .env)
+
+    Returns:
+        int: Количество сброшенных пулов
+    """
+    if idle_timeout is None:
+        idle_timeout = float(os.getenv('HTTP_POOL_IDLE_TIMEOUT', '60'))
+
+    evicted = 0
+    now = time.monotonic()
+    with _pools_lock:
+        for entry in _pools.values():
+            if now - entry.last_used > idle_timeout:
+                entry.adapter.poolmanager.clear()
+                entry.stats.increment('evictions')
+                evicted += 1
+    return evicted
+
+
+def get_pool_stats():
+    """
+    Счетчики переиспользования соединений по провайдерам
+
+    Returns:
+        dict: {provider: {'requests': ..., 'reused_connections': ..., ...}}
+    """
+    with _pools_lock:
+        stats = {provider: entry.stats.as_dict() for provider, entry in _pools.items()}
+    for provider, async_stats in _async_stats.items():
+        stats[f'{provider}_async'] = async_stats.as_dict()
+    return stats
+
+
+def close_all():
+    """Закрыть все сессии (при остановке бота)"""
+    with _pools_lock:
+        for entry in _pools.values():
+            entry.session.close()
+        _pools.clear()
+
+
+# ========== АСИНХРОННЫЕ КЛИЕНТЫ ==========
+
+def get_async_client(provider, verify=True):
+    """
+    Получить общий асинхронный клиент провайдера
+
+    Клиент создается при первом обращении внутри работающего event loop.
+    Простаивающие соединения закрываются самим httpx через keepalive_expiry.
+
+    Args:
+        provider (str): Имя провайдера ('yandex', 'gigachat')
+        verify (bool): Проверять ли SSL-сертификат (для Сбера - False)
+
+    Returns:
+        httpx.AsyncClient: Клиент с keep-alive пулом
+    """
+    client = _async_clients.get(provider)
+    if client is not None and not client.is_closed:
+        return client
+
+    pool_size = _pool_size(provider)
+    idle_timeout = float(os.getenv('HTTP_POOL_IDLE_TIMEOUT', '60'))
+    stats = _async_stats.setdefault(provider, PoolStats())
+
+    async def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            stats.increment('new_connections')
+        record_event(event_name)
+
+    async def on_request(request):
+        stats.increment('requests')
+        request.extensions['trace'] = trace
+
+    transport = httpx.AsyncHTTPTransport(
+        verify=verify,
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=idle_timeout
+        )
+    )
+    cassette = get_cassette()
+    if cassette is not None:
+        transport = CassetteTransport(transport, cassette)
+
+    client = httpx.AsyncClient(
+        verify=verify,
+        transport=transport,
+        event_hooks={'request': [on_request]}
+    )
+    _async_clients[provider] = client
+    logger.info(f"🔌 Создан асинхронный пул для {provider}: размер={pool_size}")
+    return client
+
+
+async def aclose_all():
+    """Закрыть все асинхронные клиенты (при остановке бота)"""
+    for client in _async_clients.values():
+        await client.aclose()
+    _async_clients.clear()
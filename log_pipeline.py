@@ -0,0 +1,175 @@
+"""
+Неблокирующее логирование для бота и ассистентов
+
+Записи логов не пишутся в консоль из потока, который обрабатывает
+сообщение: обработчик только кладет запись в очередь, а форматирует и
+выводит ее фоновый поток. Сообщения с аргументами в %-стиле
+(logger.info("... %s", value)) собираются в строку тоже в фоновом потоке,
+а если уровень выключен - не собираются вовсе.
+
+Записи горячего пути помечаются категорией (extra={'category': 'provider'});
+для категорий можно задать долю сохраняемых записей. Предупреждения и
+ошибки сохраняются всегда. Без категории записью управляет имя логгера.
+
+Если очередь переполнена, запись отбрасывается (и учитывается в get_log_stats()):
+логирование не должно задерживать ответ пользователю.
+
+Настройки (переменные окружения):
+    LOG_LEVEL       - уровень логирования (INFO)
+    LOG_FORMAT      - text (как раньше) или json - одна JSON-строка на запись (text)
+    LOG_FILE        - файл для логов вместо консоли
+    LOG_SAMPLE      - доли сохраняемых записей по категориям,
+                      например "message=0.1,provider=0.25,history=0"
+    LOG_QUEUE_SIZE  - размер очереди записей (10000)
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import threading
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+from tracing import current_trace
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Атрибуты, которые есть у любой записи; остальное - поля из extra
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def parse_sample_rates(value):
+    """
+    Разобрать LOG_SAMPLE
+
+    Args:
+        value (str): "категория=доля,категория=доля"
+
+    Returns:
+        dict: {категория: доля 0..1}
+    """
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        name, rate = item.split('=', 1)
+        rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной JSON-строкой"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_FIELDS:
+                entry[name] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _SamplingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Обработчик потока, который пишет в лог: выборка, trace_id и очередь
+
+    Стандартный QueueHandler форматирует запись до постановки в очередь,
+    этот передает ее как есть - сообщение соберет фоновый поток.
+    """
+
+    def __init__(self, log_queue, sample_rates):
+        super().__init__(log_queue)
+        self.sample_rates = sample_rates
+        self.enqueued = 0
+        self.dropped = 0
+        self.sampled_out = {}
+
+    def handle(self, record):
+        if record.levelno < logging.WARNING and self.sample_rates:
+            category = getattr(record, 'category', record.name)
+            rate = self.sample_rates.get(category)
+            if rate is not None and random.random() >= rate:
+                self.sampled_out[category] = self.sampled_out.get(category, 0) + 1
+                return False
+        trace = current_trace()
+        if trace is not None:
+            record.trace_id = trace.trace_id
+        return super().handle(record)
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level=None):
+    """
+    Направить логи процесса через очередь и фоновый поток записи
+
+    Повторный вызов ничего не меняет, поэтому модули, которые можно
+    запускать и отдельно, вызывают функцию сами.
+
+    Args:
+        level (str|int): Уровень логирования (по умолчанию LOG_LEVEL из .env)
+    """
+    global _handler, _listener
+    with _setup_lock:
+        root = logging.getLogger()
+        # Как и logging.basicConfig: если приложение уже настроило логи, не вмешиваемся
+        if _handler is not None or root.handlers:
+            return
+
+        if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter(TEXT_FORMAT)
+        path = os.getenv('LOG_FILE')
+        output = logging.FileHandler(path, encoding='utf-8') if path else logging.StreamHandler(sys.stderr)
+        output.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+        _handler = _SamplingQueueHandler(log_queue, parse_sample_rates(os.getenv('LOG_SAMPLE')))
+        _listener = logging.handlers.QueueListener(log_queue, output)
+        _listener.start()
+        # При выходе фоновый поток дописывает все, что осталось в очереди
+        atexit.register(_listener.stop)
+
+        root.addHandler(_handler)
+        root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO').upper())
+
+
+def get_log_stats():
+    """
+    Returns:
+        dict: Записей в очереди, поставлено, отброшено при переполнении и выборкой
+    """
+    if _handler is None:
+        return {}
+    return {
+        'queued': _handler.queue.qsize(),
+        'enqueued': _handler.enqueued,
+        'dropped': _handler.dropped,
+        'sampled_out': dict(_handler.sampled_out)
+    }
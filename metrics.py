@@ -0,0 +1,316 @@
+"""
+Метрики бота и клиентов провайдеров в формате Prometheus
+
+Счетчики и гистограммы обновляются в коде запросов, а значения, которые
+уже считают другие модули (размер реестра, очереди, лимитеры), снимаются
+в момент опроса через зарегистрированные коллекторы. Зависимостей нет:
+текстовый формат Prometheus отдается встроенным http.server.
+
+Настройки (переменные окружения):
+    METRICS_PORT    - порт HTTP-сервера метрик, 0 - выключен (0)
+    METRICS_LISTEN  - адрес сервера метрик (127.0.0.1)
+"""
+
+import os
+import time
+import asyncio
+import bisect
+import functools
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм задержки, сек
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+
+_metrics = []
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    """Общая часть метрик с метками"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Args:
+            name (str): Имя метрики
+            documentation (str): Описание (HELP)
+            labelnames (tuple): Имена меток
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+
+    def labels(self, **labels):
+        """
+        Значение метрики для набора меток
+
+        Returns:
+            Дочерний объект с методами inc() / observe()
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            yield dict(zip(self.labelnames, key)), child
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._render_samples())
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Монотонный счетчик"""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        """Увеличить счетчик без меток"""
+        self.labels().inc(amount)
+
+    def _render_samples(self):
+        for labels, child in self._samples():
+            yield f'{self.name}{_format_labels(labels)} {child.value}'
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        """Добавить наблюдение без меток"""
+        self.labels().observe(value)
+
+    def _render_samples(self):
+        for labels, child in self._samples():
+            with child._lock:
+                counts = list(child.counts)
+                total_sum = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield f'{self.name}_bucket{_format_labels(dict(labels, le=le))} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(labels)} {total_sum}'
+            yield f'{self.name}_count{_format_labels(labels)} {cumulative}'
+
+
+def register_collector(collector):
+    """
+    Зарегистрировать функцию, которая снимает значения в момент опроса
+
+    Args:
+        collector (callable): Возвращает список кортежей
+            (имя, тип 'gauge'/'counter', описание, [(метки dict, значение), ...])
+
+    Returns:
+        callable: Тот же collector (можно использовать как декоратор)
+    """
+    with _registry_lock:
+        _collectors.append(collector)
+    return collector
+
+
+def render():
+    """
+    Все метрики в текстовом формате Prometheus
+
+    Returns:
+        str: Тело ответа для /metrics
+    """
+    with _registry_lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collector in collectors:
+        try:
+            families = collector()
+        except Exception as e:
+            logger.warning(f"⚠️ Коллектор метрик {collector.__name__} завершился ошибкой: {e}")
+            continue
+        for name, kind, documentation, samples in families:
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {float(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# ========== МЕТРИКИ ПРОВАЙДЕРОВ И БОТА ==========
+
+PROVIDER_LATENCY = Histogram(
+    'ai_provider_request_seconds', 'Время запроса к провайдеру (потоковый - до первого фрагмента)',
+    ('provider', 'mode')
+)
+PROVIDER_RESPONSES = Counter(
+    'ai_provider_responses_total', 'Ответы провайдеров по HTTP-статусу', ('provider', 'status')
+)
+PROVIDER_ERRORS = Counter(
+    'ai_provider_errors_total', 'Запросы, завершившиеся ошибкой транспорта', ('provider', 'kind')
+)
+PROVIDER_TOKENS = Counter(
+    'ai_provider_tokens_total', 'Токены по данным usage провайдера', ('provider', 'direction')
+)
+GENERATE_RESPONSES = Counter(
+    'ai_generate_responses_total', 'Ответы generate_response по источнику', ('provider', 'outcome')
+)
+HISTORY_LENGTH = Histogram(
+    'ai_history_messages', 'Сообщений в истории при генерации ответа',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+REQUEST_TOKENS = Histogram(
+    'ai_request_tokens', 'Оценка токенов истории в запросе к провайдеру', ('provider',),
+    buckets=(250, 500, 1000, 2000, 4000, 6000, 8000, 16000, 32000)
+)
+HANDLER_LATENCY = Histogram(
+    'bot_handler_seconds', 'Время работы обработчика обновления', ('handler',)
+)
+HANDLER_ERRORS = Counter(
+    'bot_handler_errors_total', 'Исключения в обработчиках обновлений', ('handler',)
+)
+
+
+def track_handler(name, handler):
+    """
+    Обернуть обработчик бота замером времени и счетчиком ошибок
+
+    Args:
+        name (str): Имя обработчика для метки
+        handler (callable): Корутина handler(update, context)
+
+    Returns:
+        callable: Обернутый обработчик
+    """
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        started = time.monotonic()
+        deferred = False
+        try:
+            result = await handler(update, context)
+            if isinstance(result, asyncio.Future):
+                # Ответ поставлен в очередь пользователя: время считаем до его отправки
+                deferred = True
+                result.add_done_callback(lambda future: _observe_deferred(name, started, future))
+            return result
+        except Exception:
+            HANDLER_ERRORS.labels(handler=name).inc()
+            raise
+        finally:
+            if not deferred:
+                HANDLER_LATENCY.labels(handler=name).observe(time.monotonic() - started)
+
+    return wrapper
+
+
+def _observe_deferred(name, started, future):
+    """Записать время и ошибку обработки, завершившейся в очереди пользователя"""
+    if not future.cancelled() and future.exception() is not None:
+        HANDLER_ERRORS.labels(handler=name).inc()
+    HANDLER_LATENCY.labels(handler=name).observe(time.monotonic() - started)
+
+
+# ========== HTTP-СЕРВЕР ==========
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=None, listen=None):
+    """
+    Запустить HTTP-сервер метрик в фоновом потоке
+
+    Args:
+        port (int): Порт (по умолчанию METRICS_PORT; 0 - не запускать)
+        listen (str): Адрес (по умолчанию METRICS_LISTEN)
+
+    Returns:
+        ThreadingHTTPServer: Сервер или None, если метрики выключены
+    """
+    port = int(port if port is not None else os.getenv('METRICS_PORT', '0'))
+    if not port:
+        return None
+    listen = listen or os.getenv('METRICS_LISTEN', '127.0.0.1')
+    server = ThreadingHTTPServer((listen, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"📊 Метрики доступны на http://{listen}:{port}/metrics")
+    return server
@@ -0,0 +1,337 @@
+"""
+Локальные заглушки API YandexGPT и GigaChat для нагрузочных тестов
+
+Сервер отвечает в формате настоящих API, не расходуя квоту и деньги:
+- POST /foundationModels/v1/completion  - YandexGPT (обычный и потоковый ответ)
+- POST /foundationModels/v1/completionAsync, GET /operations/<id>
+                                        - отложенная генерация YandexGPT
+- POST /api/v2/oauth                    - выдача токена GigaChat
+- POST /api/v1/chat/completions         - GigaChat (обычный ответ и SSE)
+
+Задержка ответа берется из логнормального распределения (медиана и
+разброс задаются), часть запросов завершается ошибкой 500 или 429.
+
+Запуск отдельно:
+    python mock_providers.py --port 8090 --latency-ms 800 --error-rate 0.01
+
+Бот и RussianAI направляются на заглушку переменными окружения
+YANDEX_API_URL, GIGACHAT_API_URL и GIGACHAT_OAUTH_URL (см. env_for()).
+"""
+
+import json
+import time
+import math
+import uuid
+import random
+import argparse
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+YANDEX_PATH = '/foundationModels/v1/completion'
+YANDEX_ASYNC_PATH = '/foundationModels/v1/completionAsync'
+OPERATIONS_PATH = '/operations'
+OAUTH_PATH = '/api/v2/oauth'
+GIGACHAT_PATH = '/api/v1/chat/completions'
+
+ANSWER_WORDS = (
+    'Конечно', 'вот', 'подробный', 'ответ', 'на', 'ваш', 'вопрос', 'с', 'примерами',
+    'и', 'пояснениями', 'для', 'нагрузочного', 'теста', 'бота'
+)
+
+
+class MockBehavior:
+    """Параметры поведения заглушки"""
+
+    def __init__(self, latency_ms=500, latency_sigma=0.5, error_rate=0.0, throttle_rate=0.0,
+                 answer_words=60, stream_chunks=10):
+        """
+        Args:
+            latency_ms (float): Медиана задержки ответа, мс
+            latency_sigma (float): Разброс логнормального распределения (0 - без разброса)
+            error_rate (float): Доля ответов 500
+            throttle_rate (float): Доля ответов 429 (с Retry-After: 1)
+            answer_words (int): Слов в ответе
+            stream_chunks (int): Фрагментов в потоковом ответе
+        """
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.answer_words = answer_words
+        self.stream_chunks = stream_chunks
+
+    def latency(self):
+        """Случайная задержка ответа, сек"""
+        if self.latency_ms <= 0:
+            return 0.0
+        if self.latency_sigma <= 0:
+            return self.latency_ms / 1000
+        return random.lognormvariate(math.log(self.latency_ms / 1000), self.latency_sigma)
+
+    def failure(self):
+        """
+        Returns:
+            int: Код ошибки, которым нужно ответить, или None
+        """
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+    def answer(self):
+        return ' '.join(random.choice(ANSWER_WORDS) for _ in range(self.answer_words))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        server.count('requests')
+        body = self.rfile.read(int(self.headers.get('Content-Length', '0')))
+
+        if self.path == OAUTH_PATH:
+            self._send_json(200, {
+                'access_token': 'mock-token',
+                'expires_at': int((time.time() + 1800) * 1000)
+            })
+            return
+        if self.path == YANDEX_ASYNC_PATH:
+            self._start_operation(json.loads(body or b'{}'))
+            return
+        if self.path not in (YANDEX_PATH, GIGACHAT_PATH):
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        behavior = server.behavior
+        time.sleep(behavior.latency())
+        status = behavior.failure()
+        if status is not None:
+            server.count(str(status))
+            headers = {'Retry-After': '1'} if status == 429 else {}
+            self._send_json(status, {'error': 'mock failure'}, headers)
+            return
+
+        payload = json.loads(body or b'{}')
+        if self.path == YANDEX_PATH:
+            if payload.get('completionOptions', {}).get('stream'):
+                self._stream_yandex(payload)
+            else:
+                self._send_json(200, self._yandex_result(payload, behavior.answer()))
+        else:
+            if payload.get('stream'):
+                self._stream_gigachat(payload)
+            else:
+                self._send_json(200, self._gigachat_result(payload, behavior.answer()))
+
+    def do_GET(self):
+        server = self.server
+        server.count('requests')
+        if not self.path.startswith(OPERATIONS_PATH + '/'):
+            self._send_json(404, {'error': 'not found'})
+            return
+        operation_id = self.path[len(OPERATIONS_PATH) + 1:]
+        operation = server.operations.get(operation_id)
+        if operation is None:
+            self._send_json(404, {'error': 'operation not found'})
+            return
+
+        ready_at, status, result = operation
+        if time.monotonic() < ready_at:
+            self._send_json(200, {'id': operation_id, 'done': False})
+        elif status is not None:
+            self._send_json(200, {'id': operation_id, 'done': True,
+                                  'error': {'code': 13, 'message': f'mock failure {status}'}})
+        else:
+            server.operations.pop(operation_id, None)
+            self._send_json(200, {'id': operation_id, 'done': True, 'response': result})
+
+    def _start_operation(self, payload):
+        """Отложенная генерация: результат готов через обычную задержку заглушки"""
+        behavior = self.server.behavior
+        status = behavior.failure()
+        if status == 429:
+            self.server.count('429')
+            self._send_json(429, {'error': 'mock failure'}, {'Retry-After': '1'})
+            return
+        operation_id = uuid.uuid4().hex
+        result = self._yandex_result(payload, behavior.answer())['result']
+        self.server.operations[operation_id] = (time.monotonic() + behavior.latency(), status, result)
+        self.server.count('operations')
+        self._send_json(200, {'id': operation_id, 'done': False, 'description': 'Async GPT Completion'})
+
+    @staticmethod
+    def _prompt_tokens(payload):
+        return sum(len(msg.get('text', msg.get('content', ''))) // 3 for msg in payload.get('messages', []))
+
+    def _yandex_result(self, payload, text):
+        return {
+            'result': {
+                'alternatives': [{'message': {'role': 'assistant', 'text': text}, 'status': 'ALTERNATIVE_STATUS_FINAL'}],
+                'usage': {
+                    'inputTextTokens': str(self._prompt_tokens(payload)),
+                    'completionTokens': str(len(text) // 3),
+                    'totalTokens': str(self._prompt_tokens(payload) + len(text) // 3)
+                },
+                'modelVersion': 'mock'
+            }
+        }
+
+    def _gigachat_result(self, payload, text):
+        return {
+            'choices': [{'message': {'role': 'assistant', 'content': text}, 'index': 0, 'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': self._prompt_tokens(payload),
+                'completion_tokens': len(text) // 3,
+                'total_tokens': self._prompt_tokens(payload) + len(text) // 3
+            },
+            'model': 'GigaChat:mock',
+            'object': 'chat.completion'
+        }
+
+    def _stream_parts(self):
+        words = self.server.behavior.answer().split(' ')
+        step = max(1, len(words) // max(1, self.server.behavior.stream_chunks))
+        for i in range(0, len(words), step):
+            yield ' '.join(words[i:i + step]) + (' ' if i + step < len(words) else '')
+
+    def _stream_yandex(self, payload):
+        self._start_stream('application/json')
+        text = ''
+        for part in self._stream_parts():
+            text += part
+            self._write_chunk(json.dumps(self._yandex_result(payload, text), ensure_ascii=False) + '\n')
+        self._end_stream()
+
+    def _stream_gigachat(self, payload):
+        self._start_stream('text/event-stream')
+        for part in self._stream_parts():
+            chunk = {'choices': [{'delta': {'content': part}, 'index': 0}]}
+            self._write_chunk(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n')
+        self._write_chunk('data: [DONE]\n\n')
+        self._end_stream()
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f'{len(data):X}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+        # Небольшая пауза между фрагментами, как у настоящей генерации
+        time.sleep(0.01)
+
+    def _end_stream(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    """HTTP-сервер заглушек в фоновом потоке"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, behavior=None, host='127.0.0.1', port=0):
+        """
+        Args:
+            behavior (MockBehavior): Поведение заглушки
+            host (str): Адрес
+            port (int): Порт (0 - любой свободный)
+        """
+        super().__init__((host, port), _Handler)
+        self.behavior = behavior or MockBehavior()
+        self.counters = {}
+        self.operations = {}
+        self._counters_lock = threading.Lock()
+        self._thread = None
+
+    def count(self, name):
+        with self._counters_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def env_for(self):
+        """
+        Переменные окружения, направляющие клиентов на заглушку
+
+        Returns:
+            dict: Адреса API YandexGPT и GigaChat и тестовые ключи
+        """
+        return {
+            'YANDEX_API_URL': self.base_url + YANDEX_PATH,
+            'YANDEX_ASYNC_API_URL': self.base_url + YANDEX_ASYNC_PATH,
+            'YANDEX_OPERATIONS_URL': self.base_url + OPERATIONS_PATH,
+            'GIGACHAT_API_URL': self.base_url + GIGACHAT_PATH,
+            'GIGACHAT_OAUTH_URL': self.base_url + OAUTH_PATH,
+            'YANDEX_FOLDER_ID': 'mock-folder',
+            'YANDEX_API_KEY': 'mock-key',
+            'SBER_AUTH_DATA': 'bW9jazptb2Nr'
+        }
+
+    def start(self):
+        """Запустить сервер в фоновом потоке"""
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-providers', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Остановить сервер"""
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушки API YandexGPT и GigaChat')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency-ms', type=float, default=500)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    server = MockProviderServer(
+        MockBehavior(args.latency_ms, args.latency_sigma, args.error_rate, args.throttle_rate),
+        host=args.host,
+        port=args.port
+    )
+    logger.info(f"🧪 Заглушки провайдеров: {server.base_url}")
+    for name, value in server.env_for().items():
+        print(f"{name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,769 @@
+"""
+Реестр AI провайдеров: один клиент на провайдера для всего процесса
+
+Запрос к провайдеру (пул соединений, лимитер с повторами, обновление
+токена при 401, метрики, трассировка, разбор ответа и потока) реализован
+один раз в ProviderBackend. Конкретный провайдер описывает только свой
+протокол: тело запроса, заголовки, извлечение текста и usage, строку потока.
+
+Параметры провайдеров читаются из окружения один раз (load_backends) и
+хранятся в неизменяемых конфигурациях, которые разделяют все ассистенты
+(russian_ai.py, main.py, yandex_gpt.py).
+
+Новый провайдер подключается через register_backend() - без правок бота:
+клавиатура и переключение провайдера берут список из реестра.
+"""
+
+import os
+import json
+import threading
+import logging
+from collections import namedtuple
+
+import requests
+import httpx
+
+from http_pool import get_session, get_async_client
+from gigachat_auth import get_token_manager
+from rate_limiter import get_limiter, call_with_retry, acall_with_retry
+from metrics import PROVIDER_RESPONSES, PROVIDER_ERRORS, PROVIDER_TOKENS
+from tracing import span
+
+logger = logging.getLogger(__name__)
+# Категория записей о каждом запросе (выборка - LOG_SAMPLE в log_pipeline.py)
+_LOG_PROVIDER = {'category': 'provider'}
+
+# С этих символов начинаются сообщения об ошибках вместо ответа модели
+ERROR_PREFIXES = ('❌', '⏱', '🌐')
+
+# Ошибки установки соединения, после которых запрос повторяется с backoff.
+# Таймаут чтения не повторяется: провайдер мог уже начать генерацию, а
+# повторы задержали бы ответ на несколько таймаутов - ошибка сразу уходит
+# в circuit breaker
+SYNC_RETRY_ERRORS = (requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError)
+ASYNC_RETRY_ERRORS = (httpx.ConnectTimeout, httpx.ConnectError)
+
+
+def is_error_response(text):
+    """
+    Проверить, является ли ответ сообщением об ошибке
+
+    Args:
+        text (str): Ответ провайдера
+
+    Returns:
+        bool: True для сообщения об ошибке
+    """
+    return not text or text.startswith(ERROR_PREFIXES)
+
+
+def error_kind(error):
+    """
+    Тип ошибки транспорта для метрик
+
+    Args:
+        error (Exception): Исключение requests или httpx
+
+    Returns:
+        str: 'timeout', 'connection' или 'other'
+    """
+    if isinstance(error, (requests.exceptions.Timeout, httpx.TimeoutException)):
+        return 'timeout'
+    if isinstance(error, (requests.exceptions.ConnectionError, httpx.TransportError)):
+        return 'connection'
+    return 'other'
+
+
+class ProviderBackend:
+    """
+    Клиент провайдера: синхронные, асинхронные и потоковые запросы
+
+    Подклассы задают name, title, pool и методы протокола (build_payload,
+    extract_text, extract_usage, stream_text, при необходимости headers,
+    auth_token и status_error). Экземпляр не хранит состояния диалога и
+    используется всеми ассистентами одновременно.
+    """
+
+    name = None     # Имя в реестре, метриках и выключателях
+    title = None    # Название для сообщений пользователю
+    pool = None     # Имя пула соединений и лимитера
+    env_hint = ''   # Какие переменные окружения нужны провайдеру
+    label = None    # Надпись на кнопке выбора провайдера в боте
+
+    def __init__(self, config):
+        """
+        Args:
+            config: Неизменяемые параметры провайдера (namedtuple с полями
+                    url, timeout, verify, max_tokens, context_tokens и
+                    параметрами протокола)
+        """
+        self.config = config
+        if self.label is None:
+            self.label = f'🤖 {self.title}'
+
+    @classmethod
+    def from_env(cls):
+        """Создать клиент с параметрами из переменных окружения"""
+        raise NotImplementedError
+
+    @property
+    def configured(self):
+        """Заданы ли ключи доступа"""
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.name}>'
+
+    def limiter(self):
+        """Общий лимитер квоты провайдера"""
+        return get_limiter(self.pool)
+
+    # ========== ПРОТОКОЛ ПРОВАЙДЕРА ==========
+
+    def auth_token(self, stale_token=None):
+        """
+        Токен доступа для запроса (None - авторизация не обновляется)
+
+        Args:
+            stale_token (str): Токен, отклоненный сервером (401)
+        """
+        return None
+
+    async def aauth_token(self, stale_token=None):
+        """Асинхронный вариант auth_token"""
+        return self.auth_token(stale_token)
+
+    def headers(self, token):
+        """Заголовки запроса"""
+        return {'Content-Type': 'application/json'}
+
+    def build_payload(self, messages, stream=False, temperature=None, max_tokens=None):
+        """
+        Тело запроса
+
+        Args:
+            messages (list): История [{'role': ..., 'text': ...}, ...]
+            stream (bool): Запросить потоковый ответ
+            temperature (float): Температура (по умолчанию из конфигурации)
+            max_tokens (int): Лимит длины ответа (по умолчанию из конфигурации)
+
+        Returns:
+            dict: JSON запроса
+        """
+        raise NotImplementedError
+
+    def extract_text(self, data):
+        """Текст ответа из JSON"""
+        raise NotImplementedError
+
+    def extract_usage(self, data):
+        """
+        Returns:
+            tuple: (токены запроса, токены ответа)
+        """
+        return 0, 0
+
+    def stream_text(self, line, text):
+        """
+        Разобрать строку потокового ответа
+
+        Args:
+            line (str | bytes): Строка ответа
+            text (str): Накопленный до нее текст
+
+        Returns:
+            str: Новый накопленный текст или None (служебная строка)
+        """
+        raise NotImplementedError
+
+    def status_error(self, response):
+        """Сообщение об ошибке для ответа с кодом не 200"""
+        if response.status_code == 429:
+            return f"❌ Превышен лимит запросов {self.title}. Попробуйте позже."
+        return f"❌ Ошибка {self.title}: {response.status_code}\n{response.text[:200]}"
+
+    # ========== ОБЩАЯ ЧАСТЬ ==========
+
+    def missing_message(self):
+        return f"❌ Не указаны ключи доступа {self.title} в .env файле ({self.env_hint})"
+
+    def parse_response(self, response):
+        """
+        Разобрать ответ провайдера (requests.Response или httpx.Response)
+
+        Args:
+            response: HTTP-ответ с полями status_code, text и методом json()
+
+        Returns:
+            str: Текст ответа или сообщение об ошибке
+        """
+        logger.info("📥 Ответ %s: status=%s", self.title, response.status_code, extra=_LOG_PROVIDER)
+
+        if response.status_code == 200:
+            data = response.json()
+            result_text = self.extract_text(data)
+            tokens_in, tokens_out = self.extract_usage(data)
+            PROVIDER_TOKENS.labels(provider=self.name, direction='in').inc(tokens_in)
+            PROVIDER_TOKENS.labels(provider=self.name, direction='out').inc(tokens_out)
+            logger.info("✅ Успешный ответ от %s (%d символов)", self.title, len(result_text), extra=_LOG_PROVIDER)
+            return result_text
+
+        error_msg = self.status_error(response)
+        logger.error(error_msg)
+        return error_msg
+
+    def transport_error(self, error):
+        """
+        Сообщение об ошибке транспорта (с учетом в метриках)
+
+        Args:
+            error (Exception): Исключение запроса
+
+        Returns:
+            str: Сообщение для пользователя
+        """
+        kind = error_kind(error)
+        PROVIDER_ERRORS.labels(provider=self.name, kind=kind).inc()
+        if kind == 'timeout':
+            error_msg = f"⏱ Превышено время ожидания ответа от {self.title}"
+        elif kind == 'connection':
+            error_msg = f"🌐 Ошибка соединения с {self.title}"
+        else:
+            error_msg = f"❌ Ошибка запроса к {self.title}: {str(error)}"
+        logger.error(error_msg)
+        return error_msg
+
+    def _record_status(self, stage, response):
+        PROVIDER_RESPONSES.labels(provider=self.name, status=response.status_code).inc()
+        stage.set(status=response.status_code)
+
+    # ========== СИНХРОННЫЕ ЗАПРОСЫ ==========
+
+    def send(self, payload, stream=False):
+        """
+        Отправить запрос через общий пул и лимитер с повторами
+
+        Если сервер отклонил токен (401), он обновляется один раз и запрос
+        повторяется.
+
+        Args:
+            payload (dict): Тело запроса
+            stream (bool): Не читать тело ответа сразу (потоковый режим)
+
+        Returns:
+            requests.Response: Ответ последней попытки
+        """
+        config = self.config
+        with span('provider_http', provider=self.name) as stage:
+            token = self.auth_token()
+            for attempt in range(2):
+                response = call_with_retry(
+                    self.limiter(),
+                    lambda: get_session(self.pool).post(
+                        config.url,
+                        headers=self.headers(token),
+                        json=payload,
+                        timeout=config.timeout,
+                        verify=config.verify,
+                        stream=stream
+                    ),
+                    SYNC_RETRY_ERRORS,
+                    # Потоковый ответ занимает слот, пока его читают
+                    hold=stream
+                )
+                if response.status_code != 401 or token is None or attempt:
+                    break
+                response.close()
+                logger.warning(f"⚠️ Токен {self.title} отклонен, обновляю...")
+                token = self.auth_token(stale_token=token)
+            self._record_status(stage, response)
+            # requests измеряет время до получения заголовков ответа
+            stage.set(ttfb_ms=round(response.elapsed.total_seconds() * 1000, 2))
+            return response
+
+    def request(self, messages, **options):
+        """
+        Обычный запрос
+
+        Args:
+            messages (list): История [{'role': ..., 'text': ...}, ...]
+            **options: temperature, max_tokens
+
+        Returns:
+            str: Ответ или сообщение об ошибке
+        """
+        if not self.configured:
+            return self.missing_message()
+
+        payload = self.build_payload(messages, **options)
+        logger.info("📤 Отправка запроса к %s (%d сообщений)", self.title, len(messages), extra=_LOG_PROVIDER)
+
+        try:
+            return self.parse_response(self.send(payload))
+        except Exception as e:
+            return self.transport_error(e)
+
+    def stream(self, messages, **options):
+        """
+        Потоковый запрос
+
+        Yields:
+            str: Накопленный текст ответа или сообщение об ошибке
+        """
+        if not self.configured:
+            yield self.missing_message()
+            return
+
+        payload = self.build_payload(messages, stream=True, **options)
+        logger.info("📤 Потоковый запрос к %s (%d сообщений)", self.title, len(messages), extra=_LOG_PROVIDER)
+
+        try:
+            with self.send(payload, stream=True) as response:
+                if response.status_code != 200:
+                    yield self.parse_response(response)
+                    return
+
+                text = ''
+                for line in response.iter_lines():
+                    chunk = self.stream_text(line, text)
+                    if chunk:
+                        text = chunk
+                        yield text
+                logger.info("✅ Потоковый ответ от %s (%d символов)", self.title, len(text), extra=_LOG_PROVIDER)
+
+        except Exception as e:
+            yield self.transport_error(e)
+
+    # ========== АСИНХРОННЫЕ ЗАПРОСЫ ==========
+
+    async def asend(self, payload, stream=False, url=None, method='POST', limiter=None):
+        """
+        Асинхронный вариант send
+
+        Args:
+            payload (dict): Тело запроса (None - без тела)
+            stream (bool): Не читать тело ответа сразу
+            url (str): Адрес (по умолчанию config.url)
+            method (str): HTTP-метод
+            limiter (ProviderLimiter): Лимитер (по умолчанию limiter())
+
+        Returns:
+            httpx.Response: Ответ последней попытки (при stream=True закрывает вызывающий)
+        """
+        config = self.config
+        with span('provider_http', provider=self.name) as stage:
+            client = get_async_client(self.pool, verify=config.verify)
+            token = await self.aauth_token()
+            for attempt in range(2):
+                response = await acall_with_retry(
+                    limiter or self.limiter(),
+                    lambda: client.send(
+                        client.build_request(
+                            method,
+                            url or config.url,
+                            headers=self.headers(token),
+                            json=payload,
+                            timeout=config.timeout
+                        ),
+                        stream=stream
+                    ),
+                    ASYNC_RETRY_ERRORS,
+                    hold=stream
+                )
+                if response.status_code != 401 or token is None or attempt:
+                    break
+                await response.aclose()
+                logger.warning(f"⚠️ Токен {self.title} отклонен, обновляю...")
+                token = await self.aauth_token(stale_token=token)
+            self._record_status(stage, response)
+            return response
+
+    async def arequest(self, messages, **options):
+        """Асинхронный вариант request"""
+        if not self.configured:
+            return self.missing_message()
+
+        payload = self.build_payload(messages, **options)
+        logger.info("📤 Отправка запроса к %s (%d сообщений)", self.title, len(messages), extra=_LOG_PROVIDER)
+
+        try:
+            return self.parse_response(await self.asend(payload))
+        except Exception as e:
+            return self.transport_error(e)
+
+    async def astream(self, messages, **options):
+        """
+        Асинхронный вариант stream
+
+        Yields:
+            str: Накопленный текст ответа или сообщение об ошибке
+        """
+        if not self.configured:
+            yield self.missing_message()
+            return
+
+        payload = self.build_payload(messages, stream=True, **options)
+        logger.info("📤 Потоковый запрос к %s (%d сообщений)", self.title, len(messages), extra=_LOG_PROVIDER)
+
+        try:
+            response = await self.asend(payload, stream=True)
+            try:
+                if response.status_code != 200:
+                    await response.aread()
+                    yield self.parse_response(response)
+                    return
+
+                text = ''
+                async for line in response.aiter_lines():
+                    chunk = self.stream_text(line, text)
+                    if chunk:
+                        text = chunk
+                        yield text
+                logger.info("✅ Потоковый ответ от %s (%d символов)", self.title, len(text), extra=_LOG_PROVIDER)
+            finally:
+                await response.aclose()
+
+        except Exception as e:
+            yield self.transport_error(e)
+
+
+# ========== YANDEXGPT ==========
+
+class YandexConfig(namedtuple('YandexConfig', (
+        'url async_url operations_url folder_id api_key model temperature max_tokens context_tokens '
+        'timeout verify'))):
+    """Параметры YandexGPT"""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            url=os.getenv('YANDEX_API_URL', 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion'),
+            async_url=os.getenv(
+                'YANDEX_ASYNC_API_URL', 'https://llm.api.cloud.yandex.net/foundationModels/v1/completionAsync'
+            ),
+            operations_url=os.getenv('YANDEX_OPERATIONS_URL', 'https://operation.api.cloud.yandex.net/operations'),
+            folder_id=os.getenv('YANDEX_FOLDER_ID'),
+            api_key=os.getenv('YANDEX_API_KEY'),
+            model=os.getenv('YANDEX_MODEL', 'yandexgpt-lite'),
+            temperature=float(os.getenv('YANDEX_TEMPERATURE', '0.6')),
+            max_tokens=int(os.getenv('YANDEX_MAX_TOKENS', '2000')),
+            # Контекст модели: запрос и ответ вместе
+            context_tokens=int(os.getenv('YANDEX_CONTEXT_TOKENS', '8000')),
+            timeout=float(os.getenv('YANDEX_TIMEOUT', '30')),
+            verify=True
+        )
+
+
+class YandexBackend(ProviderBackend):
+    """YandexGPT (Yandex Cloud Foundation Models)"""
+
+    name = 'yandex'
+    title = 'YandexGPT'
+    pool = 'yandex'
+    env_hint = 'YANDEX_FOLDER_ID, YANDEX_API_KEY'
+    label = '🟢 Yandex'
+
+    @classmethod
+    def from_env(cls):
+        return cls(YandexConfig.from_env())
+
+    @property
+    def configured(self):
+        return bool(self.config.folder_id and self.config.api_key)
+
+    def limiter(self):
+        # Квота YandexGPT выдается на каталог
+        return get_limiter(self.pool, self.config.folder_id)
+
+    def headers(self, token):
+        return {
+            'Authorization': f'Api-Key {self.config.api_key}',
+            'Content-Type': 'application/json'
+        }
+
+    def build_payload(self, messages, stream=False, temperature=None, max_tokens=None):
+        config = self.config
+        return {
+            'modelUri': f'gpt://{config.folder_id}/{config.model}',
+            'completionOptions': {
+                'stream': stream,
+                'temperature': config.temperature if temperature is None else temperature,
+                'maxTokens': config.max_tokens if max_tokens is None else max_tokens
+            },
+            'messages': [{'role': msg['role'], 'text': msg['text']} for msg in messages]
+        }
+
+    def extract_text(self, data):
+        return data['result']['alternatives'][0]['message']['text']
+
+    def extract_usage(self, data):
+        usage = data['result'].get('usage', {})
+        return int(usage.get('inputTextTokens', 0)), int(usage.get('completionTokens', 0))
+
+    def stream_text(self, line, text):
+        # В каждой строке потока YandexGPT - весь сгенерированный к этому моменту текст
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            return None
+        return json.loads(line)['result']['alternatives'][0]['message']['text']
+
+    def status_error(self, response):
+        if response.status_code == 401:
+            return "❌ Ошибка 401: Неверный API ключ"
+        if response.status_code == 403:
+            return (
+                "❌ Ошибка 403: Доступ запрещен\n"
+                "Проверьте:\n"
+                "• Активен ли биллинг\n"
+                "• Назначена ли роль ai.languageModels.user\n"
+                "• Правильность FOLDER_ID"
+            )
+        if response.status_code == 429:
+            return "❌ Ошибка 429: Превышен лимит запросов YandexGPT. Попробуйте позже."
+        return super().status_error(response)
+
+    # Отложенная генерация (completionAsync): ответ забирается опросом операции.
+    # Нужна для пакетной обработки (batch.py) - такие запросы дешевле и не
+    # держат соединение на время генерации.
+
+    async def asubmit_operation(self, messages, **options):
+        """
+        Запустить отложенную генерацию
+
+        Args:
+            messages (list): История [{'role': ..., 'text': ...}, ...]
+            **options: temperature, max_tokens
+
+        Returns:
+            str: ID операции
+
+        Raises:
+            RuntimeError: Запрос не принят (текст - сообщение об ошибке)
+        """
+        if not self.configured:
+            raise RuntimeError(self.missing_message())
+        response = await self.asend(self.build_payload(messages, **options), url=self.config.async_url)
+        if response.status_code != 200:
+            raise RuntimeError(self.status_error(response))
+        return response.json()['id']
+
+    async def apoll_operation(self, operation_id):
+        """
+        Проверить операцию отложенной генерации
+
+        Args:
+            operation_id (str): ID из asubmit_operation()
+
+        Returns:
+            str: Ответ или сообщение об ошибке; None - операция еще выполняется
+        """
+        response = await self.asend(
+            None,
+            url=f'{self.config.operations_url}/{operation_id}',
+            method='GET',
+            # У API операций своя квота, опрос не должен съедать квоту генерации
+            limiter=get_limiter(self.pool, 'operations')
+        )
+        if response.status_code != 200:
+            return self.status_error(response)
+
+        data = response.json()
+        if not data.get('done'):
+            return None
+        if 'error' in data:
+            error_msg = f"❌ Ошибка операции YandexGPT: {data['error'].get('message', data['error'])}"
+            logger.error(error_msg)
+            return error_msg
+        result = {'result': data['response']}
+        tokens_in, tokens_out = self.extract_usage(result)
+        PROVIDER_TOKENS.labels(provider=self.name, direction='in').inc(tokens_in)
+        PROVIDER_TOKENS.labels(provider=self.name, direction='out').inc(tokens_out)
+        return self.extract_text(result)
+
+
+# ========== GIGACHAT ==========
+
+class GigaChatConfig(namedtuple('GigaChatConfig', (
+        'url auth_data scope model temperature max_tokens context_tokens timeout verify'))):
+    """Параметры GigaChat"""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            url=os.getenv('GIGACHAT_API_URL', 'https://gigachat.devices.sberbank.ru/api/v1/chat/completions'),
+            # SBER_AUTH - старое имя переменной из main.py
+            auth_data=os.getenv('SBER_AUTH_DATA') or os.getenv('SBER_AUTH'),
+            scope=os.getenv('SBER_SCOPE', 'GIGACHAT_API_PERS'),
+            model=os.getenv('GIGACHAT_MODEL', 'GigaChat'),
+            temperature=float(os.getenv('GIGACHAT_TEMPERATURE', '0.7')),
+            max_tokens=int(os.getenv('GIGACHAT_MAX_TOKENS', '2000')),
+            context_tokens=int(os.getenv('GIGACHAT_CONTEXT_TOKENS', '32768')),
+            timeout=float(os.getenv('GIGACHAT_TIMEOUT', '30')),
+            # Для GigaChat может потребоваться отключить проверку SSL
+            verify=os.getenv('GIGACHAT_VERIFY_SSL', '0').lower() in ('1', 'true', 'yes', 'on')
+        )
+
+
+class GigaChatBackend(ProviderBackend):
+    """GigaChat (SberAI)"""
+
+    name = 'sber'
+    title = 'GigaChat'
+    pool = 'gigachat'
+    env_hint = 'SBER_AUTH_DATA'
+    label = '🔵 Sber'
+
+    def __init__(self, config):
+        super().__init__(config)
+        # Токен доступа общий для всех пользователей процесса
+        self.token_manager = get_token_manager(config.auth_data, config.scope) if config.auth_data else None
+
+    @classmethod
+    def from_env(cls):
+        return cls(GigaChatConfig.from_env())
+
+    @property
+    def configured(self):
+        return bool(self.config.auth_data)
+
+    def auth_token(self, stale_token=None):
+        return self.token_manager.get_token(stale_token=stale_token)
+
+    async def aauth_token(self, stale_token=None):
+        return await self.token_manager.aget_token(stale_token=stale_token)
+
+    def headers(self, token):
+        return {
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json'
+        }
+
+    def build_payload(self, messages, stream=False, temperature=None, max_tokens=None):
+        config = self.config
+        return {
+            'model': config.model,
+            'messages': [{'role': msg['role'], 'content': msg['text']} for msg in messages],
+            'temperature': config.temperature if temperature is None else temperature,
+            'max_tokens': config.max_tokens if max_tokens is None else max_tokens,
+            'stream': stream
+        }
+
+    def extract_text(self, data):
+        return data['choices'][0]['message']['content']
+
+    def extract_usage(self, data):
+        usage = data.get('usage', {})
+        return int(usage.get('prompt_tokens', 0)), int(usage.get('completion_tokens', 0))
+
+    def stream_text(self, line, text):
+        # SSE: "data: {...}" с новым фрагментом, в конце "data: [DONE]"
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.startswith('data:'):
+            return None
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return None
+        delta = json.loads(data)['choices'][0]['delta'].get('content')
+        return text + delta if delta else None
+
+
+# ========== РЕЕСТР ==========
+
+_factories = {}
+_aliases = {}
+_backends = None
+_backends_lock = threading.Lock()
+
+
+def register_backend(backend_class, aliases=()):
+    """
+    Зарегистрировать провайдера
+
+    Регистрировать нужно до первого get_backend(): конфигурации всех
+    провайдеров создаются один раз.
+
+    Args:
+        backend_class (type): Подкласс ProviderBackend с from_env()
+        aliases (tuple): Другие имена провайдера (например, 'gigachat')
+    """
+    _factories[backend_class.name] = backend_class
+    for alias in aliases:
+        _aliases[alias] = backend_class.name
+
+
+register_backend(YandexBackend)
+register_backend(GigaChatBackend, aliases=('gigachat',))
+
+
+def load_backends():
+    """
+    Создать клиенты всех зарегистрированных провайдеров (один раз на процесс)
+
+    Returns:
+        dict: {имя: ProviderBackend} в порядке регистрации
+    """
+    global _backends
+    with _backends_lock:
+        if _backends is None:
+            _backends = {name: factory.from_env() for name, factory in _factories.items()}
+            configured = [name for name, backend in _backends.items() if backend.configured]
+            logger.info(f"🧩 Провайдеры: {', '.join(_backends)}; настроены: {', '.join(configured) or 'нет'}")
+        return _backends
+
+
+def resolve_name(name):
+    """
+    Каноническое имя провайдера
+
+    Args:
+        name (str): Имя или псевдоним ('gigachat' → 'sber')
+
+    Returns:
+        str: Имя в реестре
+
+    Raises:
+        ValueError: Неизвестный провайдер
+    """
+    name = _aliases.get(name.lower(), name.lower())
+    if name not in _factories:
+        raise ValueError(f"❌ Неподдерживаемый провайдер: {name}")
+    return name
+
+
+def get_backend(name):
+    """
+    Общий клиент провайдера
+
+    Args:
+        name (str): Имя или псевдоним провайдера
+
+    Returns:
+        ProviderBackend: Клиент
+
+    Raises:
+        ValueError: Неизвестный провайдер
+    """
+    return load_backends()[resolve_name(name)]
+
+
+def available_backends(configured_only=True):
+    """
+    Клиенты провайдеров в порядке регистрации
+
+    Args:
+        configured_only (bool): Только провайдеры с заданными ключами
+
+    Returns:
+        list: [ProviderBackend, ...]
+    """
+    return [
+        backend for backend in load_backends().values()
+        if backend.configured or not configured_only
+    ]
@@ -0,0 +1,402 @@
+"""
+Ограничение частоты запросов к провайдерам и повторы с backoff
+
+Все ассистенты процесса делят один лимитер на провайдера (и каталог
+Yandex Cloud): token bucket выравнивает поток запросов под квоту RPS,
+а семафор ограничивает число одновременных запросов. Ответы 429/5xx и
+ошибки соединения повторяются с экспоненциальной задержкой и jitter;
+заголовок Retry-After соблюдается и приостанавливает весь лимитер.
+Потоковый ответ занимает слот семафора, пока его не закроют: генерация
+идет все время чтения потока, а не только до заголовков ответа.
+
+Настройки (переменные окружения), PROVIDER = YANDEX или GIGACHAT:
+    {PROVIDER}_RPS             - запросов в секунду (10)
+    {PROVIDER}_MAX_CONCURRENT  - одновременных запросов (LLM_MAX_INFLIGHT, 100);
+                                 пул соединений провайдера по умолчанию того же размера
+    HTTP_MAX_RETRIES           - повторов после первой попытки (3)
+    HTTP_RETRY_BASE_DELAY      - базовая задержка backoff, сек (0.5)
+    HTTP_RETRY_MAX_DELAY       - максимальная задержка, сек (20)
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+import logging
+from contextlib import contextmanager, asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# Коды ответа, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Token bucket: не больше rate запросов в секунду, всплеск до burst"""
+
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate (float): Запросов в секунду
+            burst (float): Емкость корзины (по умолчанию = rate)
+
+        Raises:
+            ValueError: rate не больше нуля
+        """
+        if rate <= 0:
+            raise ValueError(f"❌ Лимит запросов в секунду должен быть больше нуля: {rate}")
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Зарезервировать токен
+
+        Returns:
+            float: Сколько секунд подождать перед отправкой запроса
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def pause(self, seconds):
+        """
+        Приостановить выдачу токенов (провайдер прислал Retry-After)
+
+        Args:
+            seconds (float): Длительность паузы
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class ProviderLimiter:
+    """Лимит RPS и одновременных запросов одного провайдера"""
+
+    def __init__(self, name, rps, max_concurrent):
+        """
+        Args:
+            name (str): Имя для логов и метрик
+            rps (float): Запросов в секунду
+            max_concurrent (int): Одновременных запросов
+        """
+        self.name = name
+        self.bucket = TokenBucket(rps)
+        self.max_concurrent = max_concurrent
+        self._sync_slots = threading.BoundedSemaphore(max_concurrent)
+        self._async_slots = None
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+
+    def acquire(self):
+        """Дождаться токена и занять слот (синхронный код); освобождает release()"""
+        delay = self.bucket.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        self._sync_slots.acquire()
+        self.requests += 1
+
+    def release(self):
+        self._sync_slots.release()
+
+    async def aacquire(self):
+        """Дождаться токена и занять слот (асинхронный код); освобождает arelease()"""
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrent)
+        delay = self.bucket.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._async_slots.acquire()
+        self.requests += 1
+
+    def arelease(self):
+        # asyncio.Semaphore.release не корутина, вызывается и из обычной функции
+        self._async_slots.release()
+
+    @contextmanager
+    def limit(self):
+        """Дождаться разрешения на запрос (синхронный код)"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def alimit(self):
+        """Дождаться разрешения на запрос (асинхронный код)"""
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.arelease()
+
+    def stats(self):
+        """
+        Счетчики лимитера
+
+        Returns:
+            dict: Запросы, повторы и ответы 429
+        """
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'throttled': self.throttled
+        }
+
+
+class RetryPolicy:
+    """Параметры повторов: экспоненциальный backoff с полным jitter"""
+
+    def __init__(self, max_retries=None, base_delay=None, max_delay=None):
+        self.max_retries = int(max_retries if max_retries is not None
+                               else os.getenv('HTTP_MAX_RETRIES', '3'))
+        self.base_delay = float(base_delay if base_delay is not None
+                                else os.getenv('HTTP_RETRY_BASE_DELAY', '0.5'))
+        self.max_delay = float(max_delay if max_delay is not None
+                               else os.getenv('HTTP_RETRY_MAX_DELAY', '20'))
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Задержка перед повтором
+
+        Args:
+            attempt (int): Номер неудачной попытки (с нуля)
+            retry_after (float): Значение Retry-After от сервера, сек
+
+        Returns:
+            float: Задержка в секундах
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def parse_retry_after(value):
+    """
+    Разобрать заголовок Retry-After (секунды или HTTP-дата)
+
+    Args:
+        value (str): Значение заголовка или None
+
+    Returns:
+        float: Секунды ожидания или None
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _release_on_close(response, release, asynchronous=False):
+    """
+    Освободить слот лимитера, когда ответ закроют (один раз)
+
+    Args:
+        response: Ответ requests или httpx
+        release (callable): Освобождает слот
+        asynchronous (bool): Ответ httpx (закрывается aclose)
+
+    Returns:
+        Тот же ответ
+    """
+    released = False
+
+    def release_once():
+        nonlocal released
+        if not released:
+            released = True
+            release()
+
+    if asynchronous:
+        aclose = response.aclose
+
+        async def aclose_and_release():
+            try:
+                await aclose()
+            finally:
+                release_once()
+        response.aclose = aclose_and_release
+    else:
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                release_once()
+        response.close = close_and_release
+    return response
+
+
+def call_with_retry(limiter, send, retry_exceptions, policy=None, hold=False):
+    """
+    Отправить запрос через лимитер с повторами (синхронно)
+
+    Args:
+        limiter (ProviderLimiter): Лимитер провайдера
+        send (callable): Отправляет запрос и возвращает ответ
+        retry_exceptions (tuple): Исключения транспорта, после которых повторяем
+        policy (RetryPolicy): Параметры повторов
+        hold (bool): Держать слот, пока ответ не закроют (потоковый ответ)
+
+    Returns:
+        Ответ последней попытки (исключение последней попытки пробрасывается)
+    """
+    policy = policy or RetryPolicy()
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            response = send()
+        except retry_exceptions as e:
+            limiter.release()
+            if attempt >= policy.max_retries:
+                raise
+            delay = policy.delay(attempt)
+            logger.warning(f"🔁 {limiter.name}: {type(e).__name__}, повтор через {delay:.1f} с")
+        except BaseException:
+            limiter.release()
+            raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt >= policy.max_retries:
+                if hold:
+                    return _release_on_close(response, limiter.release)
+                limiter.release()
+                return response
+            limiter.release()
+            delay = _retry_delay(limiter, policy, response, attempt)
+            response.close()
+
+        limiter.retries += 1
+        attempt += 1
+        time.sleep(delay)
+
+
+async def acall_with_retry(limiter, send, retry_exceptions, policy=None, hold=False):
+    """
+    Асинхронный вариант call_with_retry
+
+    Args:
+        limiter (ProviderLimiter): Лимитер провайдера
+        send (callable): Функция без аргументов, возвращающая корутину с ответом
+        retry_exceptions (tuple): Исключения транспорта, после которых повторяем
+        policy (RetryPolicy): Параметры повторов
+        hold (bool): Держать слот, пока ответ не закроют (aclose)
+
+    Returns:
+        Ответ последней попытки
+    """
+    policy = policy or RetryPolicy()
+    attempt = 0
+    while True:
+        await limiter.aacquire()
+        try:
+            response = await send()
+        except retry_exceptions as e:
+            limiter.arelease()
+            if attempt >= policy.max_retries:
+                raise
+            delay = policy.delay(attempt)
+            logger.warning(f"🔁 {limiter.name}: {type(e).__name__}, повтор через {delay:.1f} с")
+        except BaseException:
+            limiter.arelease()
+            raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt >= policy.max_retries:
+                if hold:
+                    return _release_on_close(response, limiter.arelease, asynchronous=True)
+                limiter.arelease()
+                return response
+            limiter.arelease()
+            delay = _retry_delay(limiter, policy, response, attempt)
+            await response.aclose()
+
+        limiter.retries += 1
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def _retry_delay(limiter, policy, response, attempt):
+    """Задержка перед повтором после ответа 429/5xx"""
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    if response.status_code == 429:
+        limiter.throttled += 1
+        if retry_after is not None:
+            # Квота общая - притормаживаем все запросы к провайдеру
+            limiter.bucket.pause(retry_after)
+    delay = policy.delay(attempt, retry_after)
+    logger.warning(f"🔁 {limiter.name}: ответ {response.status_code}, повтор через {delay:.1f} с")
+    return delay
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def max_concurrent(provider):
+    """
+    Сколько запросов к провайдеру выполняется одновременно
+
+    По этому же числу http_pool.py выбирает размер пула соединений: запрос,
+    прошедший лимитер, не ждет свободного соединения (и время ожидания не
+    съедает таймаут запроса).
+
+    Args:
+        provider (str): 'yandex' или 'gigachat'
+
+    Returns:
+        int: {PROVIDER}_MAX_CONCURRENT, по умолчанию LLM_MAX_INFLIGHT (100)
+    """
+    return int(os.getenv(f'{provider.upper()}_MAX_CONCURRENT') or os.getenv('LLM_MAX_INFLIGHT', '100'))
+
+
+def get_limiter(provider, key=''):
+    """
+    Общий для процесса лимитер провайдера
+
+    Args:
+        provider (str): 'yandex' или 'gigachat'
+        key (str): Дополнительный ключ квоты (например, каталог Yandex Cloud)
+
+    Returns:
+        ProviderLimiter: Лимитер
+    """
+    with _limiters_lock:
+        limiter = _limiters.get((provider, key))
+        if limiter is None:
+            prefix = provider.upper()
+            limiter = _limiters[(provider, key)] = ProviderLimiter(
+                f"{provider}:{key}" if key else provider,
+                rps=float(os.getenv(f'{prefix}_RPS', '10')),
+                max_concurrent=max_concurrent(provider)
+            )
+        return limiter
+
+
+def get_limiter_stats():
+    """
+    Счетчики всех лимитеров
+
+    Returns:
+        dict: {имя лимитера: {'requests': ..., 'retries': ..., 'throttled': ...}}
+    """
+    with _limiters_lock:
+        return {limiter.name: limiter.stats() for limiter in _limiters.values()}
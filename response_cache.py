@@ -0,0 +1,190 @@
+"""
+Кэш ответов на одинаковые запросы без контекста
+
+Многие пользователи начинают диалог (после /start или /clear) с одних и тех
+же вопросов. Если история пуста, ответ зависит только от текста вопроса и
+параметров модели, поэтому его можно взять из кэша вместо запроса к API.
+
+Настройки (переменные окружения):
+    RESPONSE_CACHE_SIZE  - максимум записей, 0 - кэш выключен (1000)
+    RESPONSE_CACHE_TTL   - время жизни записи в секундах (3600)
+    RESPONSE_CACHE_PATH  - файл для сохранения кэша между запусками (нет)
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(text):
+    """
+    Нормализация текста для ключа кэша: регистр и лишние пробелы не важны
+
+    Args:
+        text (str): Текст сообщения
+
+    Returns:
+        str: Нормализованный текст
+    """
+    return ' '.join(text.casefold().split())
+
+
+def make_key(provider, payload):
+    """
+    Ключ кэша по провайдеру и телу запроса
+
+    Учитываются модель, temperature, максимум токенов и нормализованные
+    сообщения; флаг stream не влияет на ответ и в ключ не входит.
+
+    Args:
+        provider (str): Провайдер
+        payload (dict): Тело запроса к API
+
+    Returns:
+        str: SHA-256 ключ
+    """
+    params = {k: v for k, v in payload.items() if k not in ('messages', 'stream')}
+    if 'completionOptions' in params:
+        params['completionOptions'] = {
+            k: v for k, v in params['completionOptions'].items() if k != 'stream'
+        }
+    messages = [
+        (msg['role'], normalize_prompt(msg.get('text', msg.get('content', ''))))
+        for msg in payload['messages']
+    ]
+    raw = json.dumps([provider, params, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """LRU-кэш ответов с TTL и необязательным сохранением на диск"""
+
+    def __init__(self, max_size=1000, ttl=3600, path=None):
+        """
+        Args:
+            max_size (int): Максимум записей
+            ttl (float): Время жизни записи, сек
+            path (str): JSON-файл для сохранения кэша или None
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if path:
+            self.load()
+
+    def get(self, key):
+        """
+        Получить ответ из кэша
+
+        Args:
+            key (str): Ключ из make_key()
+
+        Returns:
+            str: Ответ или None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, answer):
+        """
+        Сохранить ответ
+
+        Args:
+            key (str): Ключ из make_key()
+            answer (str): Ответ провайдера
+        """
+        with self._lock:
+            self._entries[key] = (answer, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Статистика кэша
+
+        Returns:
+            dict: Размер, попадания, промахи и доля попаданий
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0
+            }
+
+    def load(self):
+        """Загрузить кэш из файла (просроченные записи пропускаются)"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Не удалось прочитать кэш ответов {self.path}: {e}")
+            return
+
+        now = time.time()
+        with self._lock:
+            for key, answer, expires_at in entries[-self.max_size:]:
+                if expires_at > now:
+                    self._entries[key] = (answer, expires_at)
+        logger.info(f"📦 Загружено ответов из кэша: {len(self._entries)}")
+
+    def save(self):
+        """Сохранить кэш в файл"""
+        if not self.path:
+            return
+        with self._lock:
+            entries = [[key, answer, expires_at] for key, (answer, expires_at) in self._entries.items()]
+        # Воркеры супервизора сохраняют кэш в один файл: у каждого свой временный
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Общий для процесса кэш ответов
+
+    Returns:
+        ResponseCache: Кэш или None, если он выключен (RESPONSE_CACHE_SIZE=0)
+    """
+    global _cache
+    max_size = int(os.getenv('RESPONSE_CACHE_SIZE', '1000'))
+    if max_size <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                max_size=max_size,
+                ttl=float(os.getenv('RESPONSE_CACHE_TTL', '3600')),
+                path=os.getenv('RESPONSE_CACHE_PATH')
+            )
+        return _cache
@@ -2,81 +2,105 @@
 Класс для работы с российскими AI провайдерами:
 - YandexGPT
 - GigaChat (SberAI)
+
+Запросы к провайдерам выполняют общие клиенты из реестра providers.py;
+здесь - история диалога, кэш, выключатели, переключение и дубли запросов.
 """
 
 import os
-import requests
+import time
+import asyncio
 import logging
+import concurrent.futures
 from dotenv import load_dotenv
+from providers import is_error_response, get_backend, available_backends
+from context_window import (
+    ContextWindow, estimate_tokens, count_message_tokens, MESSAGE_OVERHEAD_TOKENS
+)
+from response_cache import get_response_cache, make_key
+from circuit_breaker import get_breaker
+from metrics import PROVIDER_LATENCY, GENERATE_RESPONSES, HISTORY_LENGTH, REQUEST_TOKENS
+from tracing import span
+from log_pipeline import setup_logging
+from hedging import (
+    hedging_enabled, hedge_delay, get_hedge_budget, get_latency_tracker, get_hedge_executor
+)
 
 # Загрузка переменных окружения
 load_dotenv()
 
 # Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger(__name__)
+_LOG_HISTORY = {'category': 'history'}
+_LOG_CACHE = {'category': 'cache'}
+
+# Переключаться на другого провайдера, если текущий недоступен
+AI_FAILOVER = os.getenv('AI_FAILOVER', '1') == '1'
+ALL_PROVIDERS_DOWN = "❌ AI провайдеры временно недоступны. Попробуйте позже."
 
 
 class RussianAI:
     """Класс для работы с российскими AI провайдерами"""
 
-    def __init__(self, provider='yandex'):
+    def __init__(self, provider='yandex', user_id=None, store=None):
         """
         Инициализация AI-ассистента
 
         Args:
             provider (str): Провайдер AI ('yandex' или 'sber')
+            user_id (int): ID пользователя (нужен для сохранения истории)
+            store (ConversationStore): Хранилище истории или None (только память)
         """
+        self.user_id = user_id
+        self.store = store
         self.dialog_history = []
+        self.context_window = ContextWindow()
+        self.response_cache = get_response_cache()
         self.provider = provider
+        self.backend = None
         self._setup_provider()
         logger.info(f"🤖 RussianAI инициализирован с провайдером: {self.provider}")
 
     def _setup_provider(self):
-        """Настройка параметров выбранного провайдера"""
-        if self.provider == 'yandex':
-            self.folder_id = os.getenv('YANDEX_FOLDER_ID')
-            self.api_key = os.getenv('YANDEX_API_KEY')
-            self.model = os.getenv('YANDEX_MODEL', 'yandexgpt-lite')
-            self.url = 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion'
-
-            if not self.folder_id or not self.api_key:
-                logger.error("❌ Отсутствуют YANDEX_FOLDER_ID или YANDEX_API_KEY")
-                raise ValueError(
-                    "Необходимо указать YANDEX_FOLDER_ID и YANDEX_API_KEY в .env файле"
-                )
-
-            logger.info(f"✅ YandexGPT настроен: модель={self.model}")
-
-        elif self.provider == 'sber':
-            self.auth_data = os.getenv('SBER_AUTH_DATA')
-            self.url = 'https://gigachat.devices.sberbank.ru/api/v1/chat/completions'
-
-            if not self.auth_data:
-                logger.warning("⚠️ Отсутствует SBER_AUTH_DATA")
+        """
+        Взять общий клиент текущего провайдера из реестра
 
-            logger.info("✅ GigaChat настроен")
+        Параметры провайдеров прочитаны один раз на процесс (providers.load_backends),
+        поэтому новый ассистент ничего не читает из окружения.
 
-        else:
-            raise ValueError(f"❌ Неподдерживаемый провайдер: {self.provider}")
+        Raises:
+            ValueError: Провайдер неизвестен или для него не заданы ключи
+        """
+        backend = get_backend(self.provider)
+        if not backend.configured:
+            error_msg = backend.missing_message()
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+        self.provider = backend.name
+        self.backend = backend
 
     def set_provider(self, provider):
         """
         Сменить AI провайдера
 
         Args:
-            provider (str): Новый провайдер ('yandex' или 'sber')
+            provider (str): Имя провайдера из реестра ('yandex', 'sber', 'gigachat')
+
+        Raises:
+            ValueError: Провайдер неизвестен или не настроен
         """
-        if provider not in ['yandex', 'sber']:
-            raise ValueError(f"❌ Неподдерживаемый провайдер: {provider}")
+        previous, self.provider = self.provider, provider
+        try:
+            self._setup_provider()
+        except ValueError:
+            self.provider = previous
+            raise
 
-        logger.info(f"🔄 Смена провайдера: {self.provider} → {provider}")
-        self.provider = provider
-        self._setup_provider()
+        logger.info(f"🔄 Смена провайдера: {previous} → {self.provider}")
         self.clear_history()
+        if self.store is not None:
+            self.store.set_provider(self.user_id, self.provider)
 
     def add_message(self, role, text):
         """
@@ -86,190 +110,380 @@ class RussianAI:
             role (str): Роль отправителя ('user' или 'assistant')
             text (str): Текст сообщения
         """
-        self.dialog_history.append({
+        self._append({
             'role': role,
             'text': text
         })
-        logger.debug(f"💬 Добавлено сообщение [{role}]: {text[:50]}...")
+
+    def _append(self, message):
+        """Добавить готовое сообщение (оценка токенов в нем сохраняется)"""
+        self.dialog_history.append(message)
+        # Старые сообщения вытесняются, чтобы запрос не рос с каждым ходом
+        self.dialog_history = self.context_window.fit(self.dialog_history)
+        if self.store is not None:
+            self.store.append(self.user_id, message['role'], message['text'])
+        logger.debug("💬 Добавлено сообщение [%s]: %.50s...", message['role'], message['text'], extra=_LOG_HISTORY)
 
     def clear_history(self):
         """Очистить историю диалога"""
         messages_count = len(self.dialog_history)
         self.dialog_history = []
+        if self.store is not None:
+            self.store.clear(self.user_id)
         logger.info(f"🗑 История диалога очищена (было {messages_count} сообщений)")
 
-    def generate_response(self, user_message):
+    def generate_response(self, user_message, stream=False):
         """
         Сгенерировать ответ на сообщение пользователя
 
         Args:
             user_message (str): Сообщение от пользователя
+            stream (bool): Отдавать ответ по частям по мере генерации
 
         Returns:
             str: Ответ от AI
+            При stream=True - генератор, который отдает весь накопленный
+            к этому моменту текст ответа (каждое значение длиннее предыдущего)
         """
-        self.add_message('user', user_message)
+        cache_key, cached, rejected = self._start_turn(user_message)
+        if rejected is not None:
+            GENERATE_RESPONSES.labels(provider=self.provider, outcome='rejected').inc()
+            return self._cached_stream(rejected) if stream else rejected
+        if cached is not None:
+            self.add_message('assistant', cached)
+            GENERATE_RESPONSES.labels(provider=self.provider, outcome='cache').inc()
+            return self._cached_stream(cached) if stream else cached
+
+        if stream:
+            return self._stream_response(cache_key)
 
         try:
-            if self.provider == 'yandex':
-                response = self._yandex_request()
-            elif self.provider == 'sber':
-                response = self._sber_request()
-            else:
-                return "❌ Ошибка: неподдерживаемый провайдер"
+            response = None
+            for provider in self._route():
+                if not get_breaker(provider).allow_request():
+                    continue
+                response, answered_by = self._call_provider(provider)
+                if not is_error_response(response):
+                    return self._finish_response(response, self._answer_cache_key(answered_by, cache_key))
 
-            if response:
-                self.add_message('assistant', response)
-                return response
-            else:
-                return "❌ Не удалось получить ответ от AI"
+            return self._finish_response(response or ALL_PROVIDERS_DOWN)
 
         except Exception as e:
             logger.error(f"❌ Ошибка генерации ответа: {e}")
             return f"❌ Произошла ошибка: {str(e)}"
 
-    def _yandex_request(self):
+    def _start_turn(self, user_message):
         """
-        Отправить запрос к YandexGPT API
+        Принять сообщение пользователя: проверка размера, история, кэш
+
+        Args:
+            user_message (str): Сообщение от пользователя
 
         Returns:
-            str: Ответ от YandexGPT или None в случае ошибки
+            tuple: (ключ кэша или None, ответ из кэша или None,
+                    отказ предварительной проверки или None)
         """
-        headers = {
-            'Authorization': f'Api-Key {self.api_key}',
-            'Content-Type': 'application/json'
-        }
+        with span('history', provider=self.provider) as stage:
+            message = {'role': 'user', 'text': user_message}
+            rejected = self._preflight(message)
+            if rejected is not None:
+                stage.set(rejected=True)
+                return None, None, rejected
+
+            self._append(message)
+            self._fit_request()
+            tokens = self.context_tokens()
+            HISTORY_LENGTH.observe(len(self.dialog_history))
+            REQUEST_TOKENS.labels(provider=self.provider).observe(tokens)
+            cache_key, cached = self._cache_lookup()
+            stage.set(messages=len(self.dialog_history), tokens=tokens, cached=cached is not None)
+        return cache_key, cached, None
+
+    def _stream_response(self, cache_key=None):
+        """
+        Потоковая генерация ответа
 
-        # Формируем сообщения для Yandex API
-        messages = []
-        for msg in self.dialog_history:
-            messages.append({
-                'role': msg['role'],
-                'text': msg['text']
-            })
-
-        payload = {
-            'modelUri': f'gpt://{self.folder_id}/{self.model}',
-            'completionOptions': {
-                'stream': False,
-                'temperature': 0.6,
-                'maxTokens': 2000
-            },
-            'messages': messages
-        }
+        Переключиться на резервного провайдера можно, только пока
+        пользователю не отдан ни один фрагмент ответа.
 
-        logger.info(f"📤 Отправка запроса к YandexGPT ({len(messages)} сообщений)")
+        Args:
+            cache_key (str): Ключ кэша ответов или None
 
+        Yields:
+            str: Накопленный текст ответа
+        """
+        text = None
         try:
-            response = requests.post(
-                self.url,
-                headers=headers,
-                json=payload,
-                timeout=30
+            for provider in self._route():
+                breaker = get_breaker(provider)
+                if not breaker.allow_request():
+                    continue
+                started = time.monotonic()
+                first_chunk_at = None
+                text = None
+                chunks = self._provider_stream(provider)
+                for text in chunks:
+                    if first_chunk_at is None:
+                        if is_error_response(text):
+                            break
+                        first_chunk_at = time.monotonic()
+                    yield text
+                chunks.close()
+
+                latency = (first_chunk_at or time.monotonic()) - started
+                PROVIDER_LATENCY.labels(provider=provider, mode='stream').observe(latency)
+                if self._record_result(breaker, text, latency) or first_chunk_at is not None:
+                    cache_key = self._answer_cache_key(provider, cache_key)
+                    break
+            else:
+                text = text or ALL_PROVIDERS_DOWN
+                cache_key = None
+                yield text
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка потоковой генерации ответа: {e}")
+            yield f"❌ Произошла ошибка: {str(e)}"
+            return
+
+        response = self._finish_response(text, cache_key)
+        if response != text:
+            yield response
+
+    def _route(self):
+        """
+        Провайдеры, к которым можно обратиться в этом ходе, по порядку
+
+        Returns:
+            list: Текущий провайдер и остальные настроенные (резервные)
+        """
+        providers = [self.provider]
+        if AI_FAILOVER:
+            providers.extend(
+                backend.name for backend in available_backends() if backend.name != self.provider
             )
+        return providers
 
-            logger.info(f"📥 Ответ YandexGPT: status={response.status_code}")
-
-            if response.status_code == 200:
-                data = response.json()
-                result_text = data['result']['alternatives'][0]['message']['text']
-                logger.info(f"✅ Успешный ответ от YandexGPT ({len(result_text)} символов)")
-                return result_text
-
-            elif response.status_code == 401:
-                error_msg = "❌ Ошибка 401: Неверный API ключ"
-                logger.error(error_msg)
-                return error_msg
-
-            elif response.status_code == 403:
-                error_msg = (
-                    "❌ Ошибка 403: Доступ запрещен\n"
-                    "Проверьте:\n"
-                    "• Активен ли биллинг\n"
-                    "• Назначена ли роль ai.languageModels.user\n"
-                    "• Правильность FOLDER_ID"
-                )
-                logger.error(error_msg)
-                return error_msg
+    def _call_provider(self, provider):
+        """
+        Запрос к провайдеру с учетом выключателя
 
-            else:
-                error_text = response.text
-                error_msg = f"❌ Ошибка YandexGPT: {response.status_code}\n{error_text[:200]}"
-                logger.error(error_msg)
-                return error_msg
+        При HEDGE_ENABLED=1, если провайдер не ответил за hedge_delay(),
+        ход дублируется (см. _hedge_target) и берется первый успешный ответ.
+        Запрос в потоке нельзя прервать, поэтому ответ проигравшего просто
+        не используется.
 
-        except requests.exceptions.Timeout:
-            error_msg = "⏱ Превышено время ожидания ответа от YandexGPT"
-            logger.error(error_msg)
-            return error_msg
+        Args:
+            provider (str): Провайдер, уже допущенный выключателем
 
-        except requests.exceptions.ConnectionError:
-            error_msg = "🌐 Ошибка соединения с YandexGPT"
-            logger.error(error_msg)
-            return error_msg
+        Returns:
+            tuple: (ответ или сообщение об ошибке, провайдер, который ответил)
+        """
+        started = time.monotonic()
+        if not hedging_enabled():
+            response = self._provider_request(provider)
+            self._record_attempt(provider, response, started)
+            return response, provider
+
+        primary = get_hedge_executor().submit(self._provider_request, provider)
+        attempts = {primary: (provider, started)}
+        done, _ = concurrent.futures.wait(attempts, timeout=hedge_delay(provider))
+        if not done:
+            hedge_provider = self._hedge_target(provider)
+            if hedge_provider is not None:
+                future = get_hedge_executor().submit(self._provider_request, hedge_provider)
+                attempts[future] = (hedge_provider, time.monotonic())
+
+        while attempts:
+            done, _ = concurrent.futures.wait(attempts, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                answered_by, began = attempts.pop(future)
+                response = future.result()
+                if self._record_attempt(answered_by, response, began):
+                    if future is not primary:
+                        self._hedge_won(provider, started)
+                    return response, answered_by
+        return response, answered_by
+
+    def _hedge_target(self, provider):
+        """
+        Куда отправить дубль медленного запроса
 
-        except Exception as e:
-            error_msg = f"❌ Неожиданная ошибка: {str(e)}"
-            logger.error(error_msg)
-            return error_msg
+        Args:
+            provider (str): Провайдер основного запроса
 
-    def _sber_request(self):
+        Returns:
+            str: Резервный провайдер с замкнутым выключателем, иначе тот же
+                 провайдер; None - бюджет дублей исчерпан
         """
-        Отправить запрос к GigaChat (SberAI) API
+        if not get_hedge_budget().try_acquire():
+            logger.debug("⏳ Бюджет дублей запросов исчерпан")
+            return None
+        hedge_provider = provider
+        # Дубль может проиграть и быть отменен, не сообщив результат выключателю,
+        # поэтому пробный запрос полуоткрытого выключателя на него не тратим
+        for other in self._route():
+            if other != provider and get_breaker(other).is_closed():
+                hedge_provider = other
+                break
+        logger.info(f"🪞 {provider} отвечает дольше обычного, дублирую запрос в {hedge_provider}")
+        return hedge_provider
+
+    def _record_attempt(self, provider, response, started):
+        """Учесть результат обычного запроса в выключателе и окне задержек"""
+        latency = time.monotonic() - started
+        PROVIDER_LATENCY.labels(provider=provider, mode='plain').observe(latency)
+        if not self._record_result(get_breaker(provider), response, latency):
+            return False
+        get_latency_tracker(provider).add(latency)
+        return True
+
+    @staticmethod
+    def _hedge_won(provider, started):
+        """Дубль ответил первым: основной запрос шел не меньше этого времени"""
+        get_hedge_budget().wins += 1
+        get_latency_tracker(provider).add(time.monotonic() - started)
+
+    def _provider_request(self, provider):
+        """Обычный запрос к провайдеру"""
+        return get_backend(provider).request(self.dialog_history)
+
+    def _provider_stream(self, provider):
+        """Потоковый запрос к провайдеру"""
+        return get_backend(provider).stream(self.dialog_history)
+
+    def _record_result(self, breaker, response, latency):
+        """
+        Передать результат запроса выключателю провайдера
+
+        Args:
+            breaker (CircuitBreaker): Выключатель провайдера
+            response (str): Ответ или сообщение об ошибке
+            latency (float): Время ответа (до первого фрагмента), сек
 
         Returns:
-            str: Ответ от GigaChat или None в случае ошибки
+            bool: True, если провайдер ответил без ошибки
+        """
+        if is_error_response(response):
+            breaker.record_failure()
+            return False
+        breaker.record_success(latency)
+        if breaker.name != self.provider:
+            logger.info(f"🔀 Ответ получен от резервного провайдера {breaker.name}")
+        return True
+
+    def _answer_cache_key(self, provider, cache_key):
+        """Кэшируем только ответы текущего провайдера: ключ построен по его запросу"""
+        return cache_key if provider == self.provider else None
+
+    @staticmethod
+    def _cached_stream(text):
+        """Потоковая выдача ответа из кэша - одним фрагментом"""
+        yield text
+
+    def _finish_response(self, response, cache_key=None):
         """
-        if not self.auth_data:
-            return "❌ Не указан SBER_AUTH_DATA в .env файле"
+        Сохранить ответ провайдера в историю (и в кэш ответов)
 
-        headers = {
-            'Authorization': f'Bearer {self.auth_data}',
-            'Content-Type': 'application/json'
-        }
+        Args:
+            response (str): Ответ провайдера или None
+            cache_key (str): Ключ кэша ответов или None
 
-        # Формируем сообщения для GigaChat API
-        messages = []
-        for msg in self.dialog_history:
-            messages.append({
-                'role': msg['role'],
-                'content': msg['text']
-            })
-
-        payload = {
-            'model': 'GigaChat',
-            'messages': messages,
-            'temperature': 0.7,
-            'max_tokens': 2000
-        }
+        Returns:
+            str: Ответ для пользователя
+        """
+        outcome = 'error' if is_error_response(response) else 'ok'
+        GENERATE_RESPONSES.labels(provider=self.provider, outcome=outcome).inc()
+        if response:
+            self.add_message('assistant', response)
+            if cache_key is not None and not is_error_response(response):
+                self.response_cache.put(cache_key, response)
+            return response
+        else:
+            return "❌ Не удалось получить ответ от AI"
 
-        logger.info(f"📤 Отправка запроса к GigaChat ({len(messages)} сообщений)")
+    def _cache_lookup(self):
+        """
+        Поиск ответа в кэше для запроса без контекста
 
-        try:
-            response = requests.post(
-                self.url,
-                headers=headers,
-                json=payload,
-                timeout=30,
-                verify=False  # Для GigaChat может потребоваться отключить проверку SSL
-            )
+        Кэш применяется, только если кроме нового сообщения пользователя
+        в истории нет реплик (системный промпт допускается).
 
-            logger.info(f"📥 Ответ GigaChat: status={response.status_code}")
+        Returns:
+            tuple: (ключ кэша или None, ответ из кэша или None)
+        """
+        if self.response_cache is None:
+            return None, None
+        if any(msg['role'] != 'system' for msg in self.dialog_history[:-1]):
+            return None, None
 
-            if response.status_code == 200:
-                data = response.json()
-                result_text = data['choices'][0]['message']['content']
-                logger.info(f"✅ Успешный ответ от GigaChat ({len(result_text)} символов)")
-                return result_text
-            else:
-                error_msg = f"❌ Ошибка GigaChat: {response.status_code}"
-                logger.error(error_msg)
-                return error_msg
+        payload = self.backend.build_payload(self.dialog_history)
+        key = make_key(self.provider, payload)
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            logger.info("📦 Ответ взят из кэша (%d символов)", len(cached), extra=_LOG_CACHE)
+        return key, cached
 
-        except Exception as e:
-            error_msg = f"❌ Ошибка запроса к GigaChat: {str(e)}"
-            logger.error(error_msg)
-            return error_msg
+    # ========== РАЗМЕР ЗАПРОСА ==========
+
+    def context_tokens(self):
+        """
+        Оценка числа токенов текущей истории диалога
+
+        Returns:
+            int: Токены всех сообщений истории
+        """
+        return self.context_window.count_tokens(self.dialog_history)
+
+    def projected_request_tokens(self, user_message=None):
+        """
+        Оценка размера следующего запроса к текущему провайдеру
+
+        Args:
+            user_message (str): Сообщение, которое будет отправлено (или None)
+
+        Returns:
+            int: История, новое сообщение и резерв на ответ (max_tokens)
+        """
+        tokens = self.context_tokens() + self.backend.config.max_tokens
+        if user_message is not None:
+            tokens += estimate_tokens(user_message) + MESSAGE_OVERHEAD_TOKENS
+        return tokens
+
+    def _request_budget(self):
+        """Токенов на историю: контекст модели минус резерв на ответ"""
+        config = self.backend.config
+        return config.context_tokens - config.max_tokens
+
+    def _preflight(self, message):
+        """
+        Проверить до запроса, поместится ли сообщение в контекст модели
+
+        Старые реплики можно отбросить, а системный промпт и само сообщение -
+        нет. Если не помещаются даже они, ход отклоняется сразу: провайдер
+        все равно отверг бы такой запрос.
+
+        Args:
+            message (dict): Новое сообщение пользователя
+
+        Returns:
+            str: Сообщение об отказе или None
+        """
+        system = [msg for msg in self.dialog_history if msg['role'] == 'system']
+        tokens = self.context_window.count_tokens(system) + count_message_tokens(message)
+        budget = self._request_budget()
+        if tokens <= budget:
+            return None
+        logger.warning(f"📏 Сообщение не помещается в контекст {self.provider}: ~{tokens} > {budget} токенов")
+        return (
+            f"❌ Сообщение слишком длинное: около {tokens} токенов, а модель принимает "
+            f"не больше {budget}. Сократите текст или отправьте его частями."
+        )
+
+    def _fit_request(self):
+        """Отбросить старые реплики, если история с резервом на ответ не помещается в контекст модели"""
+        budget = self._request_budget()
+        if self.context_tokens() > budget:
+            self.dialog_history = ContextWindow(budget).fit(self.dialog_history)
 
     def get_history_length(self):
         """
@@ -279,3 +493,188 @@ class RussianAI:
             int: Количество сообщений
         """
         return len(self.dialog_history)
+
+    def get_state(self):
+        """
+        Состояние ассистента для сохранения вне памяти
+
+        Returns:
+            dict: Провайдер и история диалога
+        """
+        return {
+            'provider': self.provider,
+            'history': self.dialog_history
+        }
+
+    def load_state(self, state):
+        """
+        Восстановить состояние, сохраненное get_state()
+
+        Состояние уже сохранено, поэтому в хранилище ничего не пишется.
+
+        Args:
+            state (dict): Провайдер и история диалога
+        """
+        provider = state.get('provider', self.provider)
+        if provider != self.provider:
+            previous, self.provider = self.provider, provider
+            try:
+                self._setup_provider()
+            except ValueError as e:
+                # Ключи провайдера убрали из .env после сохранения диалога
+                self.provider = previous
+                logger.warning(f"⚠️ Провайдер {provider} недоступен, остается {previous}: {e}")
+        self.dialog_history = self.context_window.fit(list(state['history']))
+
+
+class AsyncRussianAI(RussianAI):
+    """
+    Асинхронный вариант RussianAI для бота на asyncio
+
+    Интерфейс тот же, что у RussianAI, но generate_response - корутина:
+    ожидание ответа провайдера не блокирует поток, и один процесс может
+    держать сотни одновременных диалогов.
+    """
+
+    async def generate_response(self, user_message, stream=False):
+        """
+        Сгенерировать ответ на сообщение пользователя
+
+        Args:
+            user_message (str): Сообщение от пользователя
+            stream (bool): Отдавать ответ по частям по мере генерации
+
+        Returns:
+            str: Ответ от AI
+            При stream=True - асинхронный итератор накопленного текста ответа
+        """
+        cache_key, cached, rejected = self._start_turn(user_message)
+        if rejected is not None:
+            GENERATE_RESPONSES.labels(provider=self.provider, outcome='rejected').inc()
+            return self._cached_stream(rejected) if stream else rejected
+        if cached is not None:
+            self.add_message('assistant', cached)
+            GENERATE_RESPONSES.labels(provider=self.provider, outcome='cache').inc()
+            return self._cached_stream(cached) if stream else cached
+
+        if stream:
+            return self._stream_response(cache_key)
+
+        try:
+            response = None
+            for provider in self._route():
+                if not get_breaker(provider).allow_request():
+                    continue
+                response, answered_by = await self._call_provider(provider)
+                if not is_error_response(response):
+                    return self._finish_response(response, self._answer_cache_key(answered_by, cache_key))
+
+            return self._finish_response(response or ALL_PROVIDERS_DOWN)
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка генерации ответа: {e}")
+            return f"❌ Произошла ошибка: {str(e)}"
+
+    async def _call_provider(self, provider):
+        """
+        Запрос к провайдеру с учетом выключателя
+
+        При HEDGE_ENABLED=1, если провайдер не ответил за hedge_delay(),
+        ход дублируется (см. _hedge_target), берется первый успешный ответ,
+        а проигравший запрос отменяется.
+
+        Args:
+            provider (str): Провайдер, уже допущенный выключателем
+
+        Returns:
+            tuple: (ответ или сообщение об ошибке, провайдер, который ответил)
+        """
+        started = time.monotonic()
+        if not hedging_enabled():
+            response = await self._provider_request(provider)
+            self._record_attempt(provider, response, started)
+            return response, provider
+
+        primary = asyncio.ensure_future(self._provider_request(provider))
+        attempts = {primary: (provider, started)}
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=hedge_delay(provider))
+            if not done:
+                hedge_provider = self._hedge_target(provider)
+                if hedge_provider is not None:
+                    task = asyncio.ensure_future(self._provider_request(hedge_provider))
+                    attempts[task] = (hedge_provider, time.monotonic())
+
+            while attempts:
+                done, _ = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    answered_by, began = attempts.pop(task)
+                    response = task.result()
+                    if self._record_attempt(answered_by, response, began):
+                        if task is not primary:
+                            self._hedge_won(provider, started)
+                        return response, answered_by
+            return response, answered_by
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    async def _provider_request(self, provider):
+        """Обычный запрос к провайдеру без блокировки event loop"""
+        return await get_backend(provider).arequest(self.dialog_history)
+
+    def _provider_stream(self, provider):
+        """Потоковый запрос к провайдеру (асинхронный итератор)"""
+        return get_backend(provider).astream(self.dialog_history)
+
+    async def _stream_response(self, cache_key=None):
+        """
+        Потоковая генерация ответа
+
+        Args:
+            cache_key (str): Ключ кэша ответов или None
+
+        Yields:
+            str: Накопленный текст ответа
+        """
+        text = None
+        try:
+            for provider in self._route():
+                breaker = get_breaker(provider)
+                if not breaker.allow_request():
+                    continue
+                started = time.monotonic()
+                first_chunk_at = None
+                text = None
+                chunks = self._provider_stream(provider)
+                async for text in chunks:
+                    if first_chunk_at is None:
+                        if is_error_response(text):
+                            break
+                        first_chunk_at = time.monotonic()
+                    yield text
+                await chunks.aclose()
+
+                latency = (first_chunk_at or time.monotonic()) - started
+                PROVIDER_LATENCY.labels(provider=provider, mode='stream').observe(latency)
+                if self._record_result(breaker, text, latency) or first_chunk_at is not None:
+                    cache_key = self._answer_cache_key(provider, cache_key)
+                    break
+            else:
+                text = text or ALL_PROVIDERS_DOWN
+                cache_key = None
+                yield text
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка потоковой генерации ответа: {e}")
+            yield f"❌ Произошла ошибка: {str(e)}"
+            return
+
+        response = self._finish_response(text, cache_key)
+        if response != text:
+            yield response
+
+    @staticmethod
+    async def _cached_stream(text):
+        """Потоковая выдача ответа из кэша - одним фрагментом"""
+        yield text
@@ -0,0 +1,126 @@
+"""
+Планировщик обработки сообщений с очередью на каждого пользователя
+
+Сообщения одного пользователя обрабатываются строго по порядку (почтовый
+ящик пользователя), поэтому два быстрых сообщения не генерируют ответ
+одновременно на одной истории диалога. Сообщения разных пользователей
+обрабатываются параллельно, но не больше чем workers одновременно.
+"""
+
+import os
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class UserScheduler:
+    """Упорядоченные очереди задач по user_id поверх общего пула воркеров"""
+
+    def __init__(self, workers=None):
+        """
+        Args:
+            workers (int): Сколько задач выполняется одновременно
+                           (по умолчанию BOT_WORKERS или 100)
+        """
+        self.workers = workers or int(os.getenv('BOT_WORKERS', '100'))
+        self._slots = asyncio.Semaphore(self.workers)
+        self._mailboxes = {}
+        # Ссылки на задачи разбора очередей: event loop держит задачи слабо
+        self._drains = set()
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def submit(self, user_id, job):
+        """
+        Поставить задачу в очередь пользователя
+
+        Args:
+            user_id (int): ID пользователя
+            job (callable): Функция без аргументов, возвращающая корутину
+
+        Returns:
+            asyncio.Future: Результат задачи
+        """
+        future = asyncio.get_running_loop().create_future()
+        mailbox = self._mailboxes.get(user_id)
+        if mailbox is None:
+            mailbox = self._mailboxes[user_id] = deque()
+            task = asyncio.create_task(self._drain(user_id, mailbox))
+            self._drains.add(task)
+            task.add_done_callback(self._drains.discard)
+
+        mailbox.append((job, future))
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, len(mailbox))
+        if len(mailbox) > 1:
+            logger.info(f"📬 Сообщение пользователя {user_id} в очереди (глубина {len(mailbox)})")
+        return future
+
+    async def _drain(self, user_id, mailbox):
+        """Выполнить задачи пользователя по одной, пока очередь не опустеет"""
+        try:
+            while mailbox:
+                job, future = mailbox[0]
+                # Слот воркера берется на одну задачу, чтобы пользователи чередовались
+                async with self._slots:
+                    self.running += 1
+                    try:
+                        result = await job()
+                    except Exception as e:
+                        self.failed += 1
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        self.completed += 1
+                        if not future.done():
+                            future.set_result(result)
+                    finally:
+                        self.running -= 1
+                mailbox.popleft()
+        finally:
+            del self._mailboxes[user_id]
+
+    def queue_depth(self, user_id):
+        """
+        Сколько задач пользователя ждет или выполняется
+
+        Args:
+            user_id (int): ID пользователя
+
+        Returns:
+            int: Глубина очереди
+        """
+        mailbox = self._mailboxes.get(user_id)
+        return len(mailbox) if mailbox else 0
+
+    def stats(self, top=10):
+        """
+        Метрики очередей
+
+        Args:
+            top (int): Сколько самых длинных очередей показать
+
+        Returns:
+            dict: Общие счетчики и глубины самых длинных очередей
+        """
+        depths = sorted(
+            ((user_id, len(mailbox)) for user_id, mailbox in self._mailboxes.items()),
+            key=lambda item: item[1],
+            reverse=True
+        )
+        return {
+            'workers': self.workers,
+            'running': self.running,
+            'active_users': len(self._mailboxes),
+            'queued': sum(depth for _, depth in depths),
+            'max_depth': self.max_depth,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'top_depths': dict(depths[:top])
+        }
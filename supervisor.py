@@ -0,0 +1,396 @@
+"""
+Режим супервизора: бот в нескольких процессах-воркерах
+
+Один процесс Python упирается в GIL, а реестр ассистентов живет в его
+памяти. В режиме супервизора (BOT_PROCESSES > 1) главный процесс только
+получает обновления Telegram (polling или webhook) и раскладывает их по
+воркерам, а каждый воркер - обычный бот со своим реестром ассистентов,
+очередями и пулами соединений, который сам отвечает пользователям.
+
+Обновление попадает к воркеру по консистентному хешу user_id, поэтому
+история диалога пользователя всегда в памяти одного процесса. Воркеры
+связаны с супервизором очередями multiprocessing - внешний брокер не нужен.
+
+Упавший воркер перезапускается под тем же именем (и с той же очередью),
+поэтому его пользователи остаются за ним. При изменении числа воркеров
+сигналами SIGTTIN (+1) и SIGTTOU (-1) к другим воркерам переезжает только
+часть пользователей (~1/N): прием обновлений приостанавливается, воркеры
+дорабатывают начатое, вытесняют переехавшие диалоги в хранилище и
+подтверждают готовность. Чтобы история переезжала к другому воркеру,
+задайте общее хранилище (CONVERSATION_DB или ASSISTANT_SPILL_DIR). Падение
+воркера переживает только CONVERSATION_DB: каждая реплика пишется в SQLite
+сразу, а в ASSISTANT_SPILL_DIR попадают лишь вытесненные диалоги.
+
+Настройки (переменные окружения):
+    BOT_PROCESSES          - число процессов-воркеров; 0 или 1 - без супервизора (0)
+    BOT_RING_REPLICAS      - точек кольца хешей на воркер (160)
+    BOT_RESTART_BACKOFF    - максимальная пауза перед перезапуском воркера, сек (30)
+    BOT_REBALANCE_TIMEOUT  - сколько ждать воркеры при перераспределении, сек (60)
+"""
+
+import os
+import time
+import queue
+import bisect
+import signal
+import asyncio
+import hashlib
+import multiprocessing
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Воркер, упавший раньше, считается упавшим при запуске: пауза перед
+# следующим перезапуском растет
+_MIN_UPTIME = 10.0
+
+
+class HashRing:
+    """Консистентное хеширование ключей по узлам с виртуальными точками"""
+
+    def __init__(self, nodes=(), replicas=None):
+        """
+        Args:
+            nodes (list): Имена узлов
+            replicas (int): Точек на узел (BOT_RING_REPLICAS, 160)
+        """
+        self.replicas = replicas or int(os.getenv('BOT_RING_REPLICAS', '160'))
+        self.nodes = list(nodes)
+        points = sorted(
+            (self._hash(f'{node}#{replica}'), node)
+            for node in self.nodes for replica in range(self.replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+    def node_for(self, key):
+        """
+        Узел, которому принадлежит ключ
+
+        Args:
+            key: Ключ (user_id)
+
+        Returns:
+            str: Имя узла
+
+        Raises:
+            LookupError: В кольце нет узлов
+        """
+        if not self._points:
+            raise LookupError("В кольце нет узлов")
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+def worker_names(count):
+    """
+    Имена воркеров
+
+    Имена не зависят от истории изменений: после уменьшения и увеличения
+    числа воркеров вернувшийся воркер получает прежние точки кольца.
+
+    Args:
+        count (int): Число воркеров
+
+    Returns:
+        list: ['worker-0', 'worker-1', ...]
+    """
+    return [f'worker-{index}' for index in range(count)]
+
+
+def update_key(update):
+    """
+    Ключ маршрутизации обновления
+
+    Args:
+        update (Update): Обновление Telegram
+
+    Returns:
+        int: ID пользователя, чата или (если нет ни того, ни другого) обновления
+    """
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return update.update_id
+
+
+def receive(inbox):
+    """
+    Следующее сообщение супервизора (вызывается в процессе воркера)
+
+    Если супервизор завершился аварийно и не прислал 'stop', воркер
+    останавливается сам, а не ждет очередь вечно.
+
+    Args:
+        inbox: Очередь воркера
+
+    Returns:
+        tuple: (вид сообщения, данные)
+    """
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            return inbox.get(timeout=1.0)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                return 'stop', None
+
+
+class _Worker:
+    """Процесс-воркер и его очередь обновлений"""
+
+    def __init__(self, name, index, inbox):
+        self.name = name
+        self.index = index
+        self.inbox = inbox
+        self.process = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = None
+        self.stopping = False
+
+
+class Supervisor:
+    """Прием обновлений и распределение их по процессам-воркерам"""
+
+    def __init__(self, target, processes, token, mode='polling'):
+        """
+        Args:
+            target (callable): Точка входа воркера target(name, index, inbox, outbox),
+                               функция уровня модуля
+            processes (int): Начальное число воркеров
+            token (str): Токен Telegram-бота
+            mode (str): Прием обновлений: 'polling' или 'webhook'
+        """
+        self.target = target
+        self.processes = processes
+        self.token = token
+        self.mode = mode
+        self.backoff_max = float(os.getenv('BOT_RESTART_BACKOFF', '30'))
+        self.rebalance_timeout = float(os.getenv('BOT_REBALANCE_TIMEOUT', '60'))
+
+        # Воркеры запускаются заново (spawn), а не копией супервизора: в нем
+        # уже работают потоки (логи, HTTP), которые fork не переносит
+        self.context = multiprocessing.get_context('spawn')
+        self.outbox = self.context.Queue()
+        self.workers = {}
+        self.ring = HashRing()
+        self._routing = None
+        self._resize_lock = None
+        self._acks = set()
+        self._monitor = None
+
+        self.routed = 0
+        self.restarts = 0
+        self.rebalances = 0
+        self.migrated = 0
+
+    # ========== ЖИЗНЕННЫЙ ЦИКЛ ==========
+
+    def run(self):
+        """Запустить супервизор (до SIGINT/SIGTERM)"""
+        from telegram import Update
+        from telegram.ext import Application, TypeHandler
+        from webhook_server import run_webhook, webhook_queue_size
+
+        if not os.getenv('CONVERSATION_DB'):
+            if os.getenv('ASSISTANT_SPILL_DIR'):
+                logger.warning(
+                    "⚠️ Без CONVERSATION_DB история пользователей упавшего воркера теряется "
+                    "(ASSISTANT_SPILL_DIR сохраняет только вытесненные диалоги)"
+                )
+            else:
+                logger.warning(
+                    "⚠️ Не задано общее хранилище диалогов (CONVERSATION_DB / ASSISTANT_SPILL_DIR): "
+                    "при перезапуске воркера и перераспределении история пользователей теряется"
+                )
+
+        # Обновления раскладываются по одному, поэтому порядок сообщений
+        # пользователя в очереди воркера совпадает с порядком от Telegram
+        builder = Application.builder().token(self.token)
+        if self.mode == 'webhook':
+            builder = builder.update_queue(asyncio.Queue(maxsize=webhook_queue_size()))
+        else:
+            builder = builder.post_init(self.start).post_shutdown(self.stop)
+        application = builder.build()
+        application.add_handler(TypeHandler(Update, self.route))
+
+        logger.info(f"🧭 Супервизор: {self.processes} воркеров, прием обновлений: {self.mode}")
+        if self.mode == 'webhook':
+            asyncio.run(run_webhook(application, on_startup=self.start, on_shutdown=self.stop))
+        else:
+            application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+    async def start(self, application=None):
+        """Запустить воркеры и наблюдение за ними"""
+        self._routing = asyncio.Event()
+        self._resize_lock = asyncio.Lock()
+        names = worker_names(self.processes)
+        for index, name in enumerate(names):
+            self._spawn(name, index)
+        self.ring = HashRing(names)
+        self._routing.set()
+
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTTIN, lambda: asyncio.ensure_future(self.resize(len(self.ring.nodes) + 1)))
+        loop.add_signal_handler(signal.SIGTTOU, lambda: asyncio.ensure_future(self.resize(len(self.ring.nodes) - 1)))
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def stop(self, application=None):
+        """Остановить воркеры: каждый дорабатывает свою очередь и сохраняет диалоги"""
+        if self._monitor is not None:
+            self._monitor.cancel()
+        for worker in self.workers.values():
+            worker.stopping = True
+            worker.inbox.put(('stop', None))
+        loop = asyncio.get_running_loop()
+        for worker in self.workers.values():
+            await loop.run_in_executor(None, self._join, worker)
+        logger.info(f"🧭 Супервизор: {self.stats()}")
+
+    def _join(self, worker):
+        worker.process.join(self.rebalance_timeout)
+        if worker.process.is_alive():
+            logger.warning(f"⚠️ Воркер {worker.name} не остановился за {self.rebalance_timeout:.0f} с, завершаю")
+            worker.process.terminate()
+            worker.process.join()
+
+    def _spawn(self, name, index, inbox=None):
+        """Запустить процесс воркера (при перезапуске - с прежней очередью)"""
+        worker = self.workers.get(name)
+        if worker is None:
+            worker = self.workers[name] = _Worker(name, index, inbox or self.context.Queue())
+        worker.process = self.context.Process(
+            target=self.target,
+            args=(worker.name, worker.index, worker.inbox, self.outbox),
+            name=f'bot-{name}'
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        logger.info(f"👷 Запущен воркер {name} (pid {worker.process.pid})")
+        return worker
+
+    # ========== МАРШРУТИЗАЦИЯ ==========
+
+    async def route(self, update, context):
+        """
+        Передать обновление воркеру, которому принадлежит пользователь
+
+        Args:
+            update (Update): Обновление Telegram
+            context: Контекст обработчика
+        """
+        # Во время перераспределения ждем, пока воркеры отдадут переехавшие диалоги
+        await self._routing.wait()
+        worker = self.workers[self.ring.node_for(update_key(update))]
+        worker.inbox.put(('update', update.to_dict()))
+        self.routed += 1
+
+    # ========== НАБЛЮДЕНИЕ ==========
+
+    async def _watch(self):
+        """Читать ответы воркеров и перезапускать упавших"""
+        while True:
+            self._read_outbox()
+            now = time.monotonic()
+            for worker in list(self.workers.values()):
+                if worker.stopping or worker.process.is_alive():
+                    continue
+                if worker.restart_at is None:
+                    self._schedule_restart(worker, now)
+                elif now >= worker.restart_at:
+                    self._spawn(worker.name, worker.index)
+                    self.restarts += 1
+            await asyncio.sleep(0.2)
+
+    def _schedule_restart(self, worker, now):
+        """Назначить перезапуск упавшего воркера с растущей паузой при частых падениях"""
+        if now - worker.started_at < _MIN_UPTIME:
+            worker.failures += 1
+        else:
+            worker.failures = 0
+        delay = min(self.backoff_max, 0.5 * 2 ** worker.failures) if worker.failures else 0.0
+        worker.restart_at = now + delay
+        logger.error(
+            f"💥 Воркер {worker.name} завершился с кодом {worker.process.exitcode}, "
+            f"перезапуск через {delay:.1f} с"
+        )
+
+    def _read_outbox(self):
+        """Разобрать сообщения воркеров, не блокируя event loop"""
+        while True:
+            try:
+                message = self.outbox.get_nowait()
+            except Exception:
+                # queue.Empty (или очередь закрыта)
+                return
+            kind, name = message[0], message[1]
+            if kind == 'rebalanced':
+                self.migrated += message[2]
+            self._acks.discard(name)
+
+    # ========== ПЕРЕРАСПРЕДЕЛЕНИЕ ==========
+
+    async def resize(self, count):
+        """
+        Изменить число воркеров с переносом минимальной части пользователей
+
+        Args:
+            count (int): Новое число воркеров (не меньше 1)
+        """
+        async with self._resize_lock:
+            count = max(1, count)
+            names = worker_names(count)
+            if names == self.ring.nodes:
+                return
+            removed = [name for name in self.ring.nodes if name not in names]
+            kept = [name for name in self.ring.nodes if name in names]
+            logger.info(f"⚖️ Перераспределение: {len(self.ring.nodes)} → {count} воркеров")
+
+            self._routing.clear()
+            try:
+                self._acks = set(kept) | set(removed)
+                for name in kept:
+                    self.workers[name].inbox.put(('ring', names))
+                for name in removed:
+                    self.workers[name].stopping = True
+                    self.workers[name].inbox.put(('stop', None))
+                deadline = time.monotonic() + self.rebalance_timeout
+                while self._acks and time.monotonic() < deadline:
+                    self._read_outbox()
+                    await asyncio.sleep(0.05)
+                if self._acks:
+                    logger.warning(f"⚠️ Не дождались воркеров при перераспределении: {sorted(self._acks)}")
+
+                loop = asyncio.get_running_loop()
+                for name in removed:
+                    await loop.run_in_executor(None, self._join, self.workers.pop(name))
+                for index, name in enumerate(names):
+                    if name not in self.workers:
+                        self._spawn(name, index)
+                self.ring = HashRing(names)
+                self.rebalances += 1
+            finally:
+                self._routing.set()
+            logger.info(f"⚖️ Перераспределение завершено: переехало диалогов {self.migrated}")
+
+    def stats(self):
+        """
+        Статистика супервизора
+
+        Returns:
+            dict: Воркеры, передано обновлений, перезапуски и перераспределения
+        """
+        return {
+            'workers': len(self.workers),
+            'routed': self.routed,
+            'restarts': self.restarts,
+            'rebalances': self.rebalances,
+            'migrated_dialogs': self.migrated
+        }
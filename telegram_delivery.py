@@ -0,0 +1,324 @@
+"""
+Доставка ответов AI в Telegram
+
+Telegram принимает не больше 4096 символов в сообщении, поэтому длинный
+ответ делится на части по границам абзацев и блоков кода (блок, который
+приходится резать, закрывается в одной части и открывается заново в
+следующей). Части уходят строго по порядку, клавиатура - только у последней.
+"""
+
+import os
+import time
+import asyncio
+import logging
+
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины текста сообщения в Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+_FENCE = '```'
+_CLOSE_FENCE = '\n' + _FENCE
+
+# Где резать часть, по убыванию предпочтения: (разделитель, можно ли внутри
+# блока кода, сколько символов разделителя остается в части)
+_CUTS = (
+    ('\n\n', False, 0),
+    ('\n', False, 0),
+    ('\n', True, 0),
+    ('. ', True, 1),
+    (' ', True, 0)
+)
+
+
+def _retry_delay(error):
+    """
+    Пауза, которую просит Telegram при флуд-контроле
+
+    Args:
+        error (RetryAfter): Ошибка Telegram
+
+    Returns:
+        float: Пауза в секундах
+    """
+    delay = error.retry_after
+    if hasattr(delay, 'total_seconds'):
+        delay = delay.total_seconds()
+    return float(delay)
+
+
+# ========== РАЗБИЕНИЕ ДЛИННЫХ ОТВЕТОВ ==========
+
+def _code_blocks(text):
+    """
+    Блоки кода в тексте
+
+    Returns:
+        list: (начало, конец открывающей строки, конец закрывающей строки);
+              незакрытый блок тянется до конца текста
+    """
+    blocks = []
+    opening = None
+    position = 0
+    for line in text.split('\n'):
+        if line.lstrip().startswith(_FENCE):
+            if opening is None:
+                opening = (position, position + len(line))
+            else:
+                blocks.append((opening[0], opening[1], position + len(line)))
+                opening = None
+        position += len(line) + 1
+    if opening is not None:
+        blocks.append((opening[0], opening[1], len(text)))
+    return blocks
+
+
+def take_chunk(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """
+    Отрезать от текста первую часть не длиннее limit
+
+    Args:
+        text (str): Текст длиннее limit
+        limit (int): Максимальная длина части
+
+    Returns:
+        tuple: (часть, остаток, префикс для остатка) - если разрез пришелся
+               на блок кода, часть закрывается, а префикс открывает блок заново
+    """
+    blocks = _code_blocks(text)
+
+    def block_at(position):
+        for start, body, end in blocks:
+            if start < position < end:
+                return start, body, end
+        return None
+
+    for separator, in_code, keep in _CUTS:
+        position = text.rfind(separator, 0, limit)
+        while position > 0:
+            block = block_at(position)
+            if block is None:
+                chunk = text[:position + keep].rstrip()
+                if chunk:
+                    return chunk, text[position + len(separator):].lstrip('\n'), ''
+            elif in_code and block[1] < position and position + keep + len(_CLOSE_FENCE) <= limit:
+                chunk = text[:position + keep].rstrip('\n') + _CLOSE_FENCE
+                return chunk, text[position + len(separator):], text[block[0]:block[1]] + '\n'
+            position = text.rfind(separator, 0, position)
+
+    # Ни одной подходящей границы (одно огромное слово) - режем по лимиту
+    block = block_at(limit)
+    if block is not None and block[1] < limit - len(_CLOSE_FENCE):
+        cut = limit - len(_CLOSE_FENCE)
+        return text[:cut] + _CLOSE_FENCE, text[cut:], text[block[0]:block[1]] + '\n'
+    return text[:limit], text[limit:], ''
+
+
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """
+    Разбить текст на части, которые Telegram примет одним сообщением
+
+    Args:
+        text (str): Текст ответа
+        limit (int): Максимальная длина части
+
+    Returns:
+        list: Части текста по порядку
+    """
+    chunks = []
+    prefix = ''
+    while len(prefix) + len(text) > limit:
+        chunk, text, prefix = take_chunk(prefix + text, limit)
+        chunks.append(chunk)
+    chunks.append(prefix + text)
+    return chunks
+
+
+async def _with_flood_wait(method, *args, **kwargs):
+    """
+    Вызвать метод Telegram, выжидая паузы флуд-контроля
+
+    Args:
+        method: Корутина-метод Telegram (reply_text, edit_text)
+
+    Returns:
+        Результат метода
+    """
+    while True:
+        try:
+            return await method(*args, **kwargs)
+        except RetryAfter as e:
+            logger.warning(f"⏳ Telegram просит паузу {_retry_delay(e)} с перед отправкой части ответа")
+            await asyncio.sleep(_retry_delay(e))
+
+
+async def send_long_reply(message, text, reply_markup=None, **kwargs):
+    """
+    Ответить текстом любой длины
+
+    Части отправляются по очереди: каждая следующая уходит после того, как
+    Telegram принял предыдущую, иначе в чате они могут перемешаться.
+
+    Args:
+        message (telegram.Message): Сообщение пользователя, на которое отвечаем
+        text (str): Текст ответа
+        reply_markup: Клавиатура (прикрепляется к последней части)
+        **kwargs: Дополнительные параметры reply_text (parse_mode и т.п.)
+
+    Returns:
+        list: Отправленные сообщения
+    """
+    chunks = split_message(text)
+    if len(chunks) > 1:
+        logger.info(f"✂️ Ответ {len(text)} символов отправляется частями: {len(chunks)}")
+    sent = []
+    for index, chunk in enumerate(chunks):
+        markup = reply_markup if index == len(chunks) - 1 else None
+        sent.append(await _with_flood_wait(message.reply_text, chunk, reply_markup=markup, **kwargs))
+    return sent
+
+
+# ========== ПОТОКОВАЯ ОТПРАВКА ==========
+
+class StreamingReply:
+    """
+    Потоковая отправка ответа в Telegram
+
+    Первое сообщение отправляется, как только пришел первый фрагмент ответа,
+    дальше оно редактируется не чаще одного раза в edit_interval секунд
+    (Telegram ограничивает частоту правок сообщений в одном чате).
+    Клавиатура прикрепляется только финальной правкой.
+
+    Когда ответ перерастает лимит Telegram, заполненная часть дописывается
+    в текущее сообщение окончательно, а продолжение идет новым сообщением -
+    пользователь читает начало, пока модель еще пишет конец.
+    """
+
+    def __init__(self, message, reply_markup=None, edit_interval=None):
+        """
+        Args:
+            message (telegram.Message): Сообщение пользователя, на которое отвечаем
+            reply_markup: Клавиатура для финального сообщения
+            edit_interval (float): Минимальный интервал между правками, сек
+                                   (по умолчанию STREAM_EDIT_INTERVAL из .env)
+        """
+        self.message = message
+        self.reply_markup = reply_markup
+        if edit_interval is None:
+            edit_interval = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+        self.edit_interval = edit_interval
+
+        self.sent = None
+        self.shown_text = ''
+        self.next_edit_at = 0.0
+        # Сколько символов ответа уже ушло в завершенные части и чем
+        # начинается следующая (открытие разрезанного блока кода)
+        self.offset = 0
+        self.prefix = ''
+
+    async def update(self, text):
+        """
+        Показать пользователю новый накопленный текст (с троттлингом)
+
+        Args:
+            text (str): Весь текст ответа на данный момент
+        """
+        text = await self._flush_full(text)
+        if not text or text == self.shown_text:
+            return
+
+        if self.sent is None:
+            self.sent = await _with_flood_wait(self.message.reply_text, text)
+            self.shown_text = text
+            self.next_edit_at = time.monotonic() + self.edit_interval
+            return
+
+        # Промежуточные правки просто пропускаем - следующая покажет больше текста
+        if time.monotonic() < self.next_edit_at:
+            return
+
+        try:
+            await self._edit(text)
+        except RetryAfter as e:
+            self.next_edit_at = time.monotonic() + _retry_delay(e)
+            logger.warning(f"⏳ Telegram просит паузу {_retry_delay(e)} с при потоковой отправке")
+
+    async def finish(self, text):
+        """
+        Отправить финальный текст ответа вместе с клавиатурой
+
+        Args:
+            text (str): Полный текст ответа
+        """
+        text = await self._flush_full(text)
+        if self.sent is None:
+            self.sent = await _with_flood_wait(self.message.reply_text, text, reply_markup=self.reply_markup)
+            self.shown_text = text
+            return
+
+        # Финальную правку нельзя пропустить - дожидаемся разрешенного момента
+        while True:
+            wait = self.next_edit_at - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                await self._edit(text, reply_markup=self.reply_markup)
+                return
+            except RetryAfter as e:
+                self.next_edit_at = time.monotonic() + _retry_delay(e)
+
+    async def _flush_full(self, text):
+        """
+        Завершить части, которые уже не поместятся в одно сообщение
+
+        Args:
+            text (str): Весь текст ответа на данный момент
+
+        Returns:
+            str: Текст текущей (незавершенной) части
+        """
+        tail = self.prefix + text[self.offset:]
+        while len(tail) > TELEGRAM_MESSAGE_LIMIT:
+            chunk, rest, prefix = take_chunk(tail)
+            await self._complete(chunk)
+            self.offset += len(tail) - len(rest) - len(self.prefix)
+            self.prefix = prefix
+            tail = prefix + rest
+        return tail
+
+    async def _complete(self, chunk):
+        """Отправить заполненную часть окончательно и начать следующую"""
+        if self.sent is None:
+            await _with_flood_wait(self.message.reply_text, chunk)
+        elif chunk != self.shown_text:
+            while True:
+                wait = self.next_edit_at - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    await self._edit(chunk)
+                    break
+                except RetryAfter as e:
+                    self.next_edit_at = time.monotonic() + _retry_delay(e)
+        self.sent = None
+        self.shown_text = ''
+        self.next_edit_at = 0.0
+
+    async def _edit(self, text, reply_markup=None):
+        """
+        Отредактировать отправленное сообщение
+
+        Args:
+            text (str): Новый текст
+            reply_markup: Клавиатура (только для финальной правки)
+        """
+        try:
+            await self.sent.edit_text(text, reply_markup=reply_markup)
+        except BadRequest as e:
+            # Текст не изменился - для Telegram это ошибка, для нас нет
+            if 'not modified' not in str(e).lower():
+                raise
+        self.shown_text = text
+        self.next_edit_at = time.monotonic() + self.edit_interval
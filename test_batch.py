@@ -0,0 +1,87 @@
+"""
+Проверка пакетной обработки: продолжение после неудачной отложенной операции
+
+Запуск: python -m unittest test_batch
+"""
+
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+
+from batch import BatchRunner, load_completed, load_operations
+
+
+class FakeYandexBackend:
+    """Провайдер с отложенной генерацией: операции из failed завершаются ошибкой"""
+
+    name = 'yandex'
+
+    def __init__(self, failed=()):
+        self.failed = set(failed)
+        self.submitted = []
+        self.polled = []
+
+    async def asubmit_operation(self, messages, **options):
+        operation_id = f'op-{len(self.submitted) + 1}'
+        self.submitted.append(operation_id)
+        return operation_id
+
+    async def apoll_operation(self, operation_id):
+        self.polled.append(operation_id)
+        if operation_id in self.failed:
+            return "❌ Ошибка API YandexGPT: 500 - mock failure"
+        return f"Ответ {operation_id}"
+
+
+class ResumeOperationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'out.jsonl')
+        self.checkpoint = self.output + '.checkpoint'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_batch(self, backend, operations=None):
+        runner = BatchRunner(
+            backend, self.output, self.checkpoint,
+            yandex_async=True, poll_interval=0, operation_timeout=1
+        )
+        runner.operations = operations or {}
+        requests_iter = iter([('q1', {'id': 'q1', 'prompt': 'Привет'})])
+        return asyncio.run(runner.run(requests_iter, load_completed(self.output)))
+
+    def test_failed_operation_is_submitted_again(self):
+        # Первый запуск: операция завершилась ошибкой
+        first = FakeYandexBackend(failed={'op-1'})
+        counters = self.run_batch(first)
+        self.assertEqual(counters['errors'], 1)
+        self.assertEqual(load_operations(self.checkpoint), {})
+
+        # Второй запуск не опрашивает старую операцию, а запускает новую
+        second = FakeYandexBackend()
+        second.submitted = ['op-1']
+        counters = self.run_batch(second, load_operations(self.checkpoint))
+        self.assertEqual(counters['ok'], 1)
+        self.assertEqual(second.submitted, ['op-1', 'op-2'])
+        self.assertNotIn('op-1', second.polled)
+
+    def test_resumed_operation_that_failed_is_replaced(self):
+        # Операция записана в контрольную точку, но запуск прервался до результата
+        with open(self.checkpoint, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'id': 'q1', 'operation': 'op-old'}) + '\n')
+
+        backend = FakeYandexBackend(failed={'op-old'})
+        counters = self.run_batch(backend, load_operations(self.checkpoint))
+        self.assertEqual(counters['resumed_operations'], 1)
+        self.assertEqual(counters['resubmitted_operations'], 1)
+        self.assertEqual(counters['ok'], 1)
+        self.assertEqual(backend.submitted, ['op-1'])
+        self.assertEqual(load_operations(self.checkpoint), {'q1': 'op-1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,341 @@
+"""
+Трассировка обработки обновлений: из чего складывается время ответа
+
+Каждое обновление Telegram получает трассу (trace) со спанами этапов:
+receive (доставка от Telegram) → queue_wait (очередь пользователя) →
+history (сборка истории) → provider_http (запрос к провайдеру: соединение,
+время до первого байта, тело) → telegram_send (отправка ответа).
+
+Трасса передается через contextvars, поэтому модули просто открывают
+спаны (with span(...)), а без активной трассы это ничего не стоит.
+Завершенные трассы пишет в JSON Lines фоновый поток: одна строка - одна
+трасса, поля спанов названы как в модели OTLP (trace_id, span_id,
+parent_span_id, start_time_unix_nano, end_time_unix_nano, attributes).
+
+Настройки (переменные окружения):
+    TRACE_FILE         - файл для трасс; не задан - трассировка выключена
+    TRACE_SAMPLE_RATE  - доля сохраняемых трасс, 0..1 (0.1)
+    TRACE_SLOW_MS      - трассы дольше сохраняются всегда (5000)
+"""
+
+import os
+import json
+import time
+import asyncio
+import queue
+import random
+import functools
+import threading
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+_current_trace = ContextVar('trace', default=None)
+_current_span = ContextVar('span', default=None)
+
+
+def _ns(timestamp):
+    return int(timestamp * 1_000_000_000)
+
+
+class Span:
+    """Этап обработки обновления"""
+
+    __slots__ = ('span_id', 'parent_id', 'name', 'start', 'end', 'attributes', 'events')
+
+    def __init__(self, name, parent_id=None, start=None, attributes=None):
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = start or time.time()
+        self.end = None
+        self.attributes = attributes or {}
+        self.events = []
+
+    def set(self, **attributes):
+        """Добавить атрибуты спана"""
+        self.attributes.update(attributes)
+
+    def event(self, name):
+        """Отметить момент внутри спана (например, событие HTTP-клиента)"""
+        self.events.append((name, time.time()))
+
+    def to_dict(self):
+        self._derive_http_timings()
+        if self.end is None:
+            # Этап еще идет (например, отмененный дубль запроса не успел закрыться)
+            self.end = time.time()
+            self.attributes['unfinished'] = True
+        return {
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_id,
+            'name': self.name,
+            'start_time_unix_nano': _ns(self.start),
+            'end_time_unix_nano': _ns(self.end),
+            'duration_ms': round((self.end - self.start) * 1000, 2),
+            'attributes': self.attributes,
+            'events': [{'name': name, 'time_unix_nano': _ns(at)} for name, at in self.events]
+        }
+
+    def _derive_http_timings(self):
+        """Соединение / время до первого байта / тело по событиям httpcore"""
+        if not self.events:
+            return
+        last = {}
+        for name, at in self.events:
+            last[name] = at
+        pairs = {
+            'connect_ms': ('connection.connect_tcp.started', 'connection.start_tls.complete'),
+            'ttfb_ms': ('http11.send_request_headers.started', 'http11.receive_response_headers.complete'),
+            'body_ms': ('http11.receive_response_headers.complete', 'http11.receive_response_body.complete')
+        }
+        for attribute, (begin, end) in pairs.items():
+            if attribute == 'connect_ms' and end not in last:
+                end = 'connection.connect_tcp.complete'
+            if begin in last and end in last:
+                self.attributes.setdefault(attribute, round((last[end] - last[begin]) * 1000, 2))
+
+
+class _NoopSpan:
+    """Спан вне трассы: атрибуты и события отбрасываются"""
+
+    def set(self, **attributes):
+        pass
+
+    def event(self, name):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """Все спаны одного обновления"""
+
+    def __init__(self, name, attributes=None):
+        self.trace_id = os.urandom(16).hex()
+        self.root = Span(name, attributes=attributes)
+        self.spans = [self.root]
+
+    def add_span(self, name, start, end, **attributes):
+        """
+        Добавить уже завершившийся этап (например, ожидание в очереди)
+
+        Args:
+            name (str): Имя спана
+            start (float): Начало, time.time()
+            end (float): Конец, time.time()
+        """
+        span = Span(name, parent_id=self.root.span_id, start=start, attributes=attributes)
+        span.end = end
+        self.spans.append(span)
+        return span
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.root.name,
+            'duration_ms': round((self.root.end - self.root.start) * 1000, 2),
+            'spans': [span.to_dict() for span in self.spans]
+        }
+
+
+class _Exporter:
+    """Фоновая запись трасс в файл JSON Lines"""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self.exported = 0
+        threading.Thread(target=self._run, name='trace-exporter', daemon=True).start()
+
+    def export(self, trace):
+        self._queue.put(trace)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    for trace in batch:
+                        f.write(json.dumps(trace.to_dict(), ensure_ascii=False, default=str) + '\n')
+                self.exported += len(batch)
+            except OSError as e:
+                logger.warning(f"⚠️ Не удалось записать трассы в {self.path}: {e}")
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def _get_exporter():
+    global _exporter
+    path = os.getenv('TRACE_FILE')
+    if not path:
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = _Exporter(path)
+            logger.info(f"🧵 Трассы обновлений пишутся в {path}")
+        return _exporter
+
+
+def start_trace(name, **attributes):
+    """
+    Начать трассу в текущем контексте
+
+    Args:
+        name (str): Имя трассы (обработчик)
+
+    Returns:
+        Trace: Трасса или None, если трассировка выключена
+    """
+    if _get_exporter() is None:
+        return None
+    trace = Trace(name, attributes)
+    _current_trace.set(trace)
+    _current_span.set(trace.root)
+    return trace
+
+
+def end_trace(trace):
+    """
+    Завершить трассу и сохранить ее, если она попала в выборку
+
+    Args:
+        trace (Trace): Трасса из start_trace()
+    """
+    if trace is None:
+        return
+    _current_trace.set(None)
+    _current_span.set(None)
+    trace.root.end = time.time()
+    duration_ms = (trace.root.end - trace.root.start) * 1000
+    slow = duration_ms >= float(os.getenv('TRACE_SLOW_MS', '5000'))
+    if slow or random.random() < float(os.getenv('TRACE_SAMPLE_RATE', '0.1')):
+        _get_exporter().export(trace)
+
+
+def current_trace():
+    """
+    Returns:
+        Trace: Активная трасса или None
+    """
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Спан этапа внутри активной трассы (без трассы - ничего не делает)
+
+    Yields:
+        Span: Спан для добавления атрибутов
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+
+    parent = _current_span.get()
+    current = Span(name, parent_id=parent.span_id if parent else None, attributes=attributes)
+    trace.spans.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.end = time.time()
+        _current_span.reset(token)
+
+
+def record_event(name):
+    """
+    Отметить событие в текущем спане (хук трассировки httpx)
+
+    Args:
+        name (str): Имя события
+    """
+    current = _current_span.get()
+    if current is not None and _current_trace.get() is not None:
+        current.event(name)
+
+
+def bind(job):
+    """
+    Перенести активную трассу в задачу, которая выполнится позже
+
+    Задачи очереди пользователя выполняются в чужом контексте asyncio,
+    поэтому трасса передается явно; время до запуска записывается
+    спаном queue_wait.
+
+    Args:
+        job (callable): Функция без аргументов, возвращающая корутину
+
+    Returns:
+        callable: Такая же функция, выполняющая job внутри трассы
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return job
+    queued_at = time.time()
+
+    async def run():
+        trace.add_span('queue_wait', queued_at, time.time())
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(trace.root)
+        try:
+            return await job()
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+
+    return run
+
+
+def trace_handler(name, handler):
+    """
+    Обернуть обработчик бота трассой обновления
+
+    Args:
+        name (str): Имя обработчика
+        handler (callable): Корутина handler(update, context)
+
+    Returns:
+        callable: Обернутый обработчик
+    """
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        trace = start_trace(name, update_id=update.update_id)
+        if trace is not None:
+            message = update.message
+            if update.effective_user is not None:
+                trace.root.set(user_id=update.effective_user.id)
+            if message is not None and message.date is not None:
+                # Время сообщения у Telegram - с точностью до секунды
+                trace.add_span('receive', min(message.date.timestamp(), trace.root.start), trace.root.start)
+        deferred = False
+        try:
+            result = await handler(update, context)
+            if trace is not None and isinstance(result, asyncio.Future):
+                # Ответ готовится в очереди пользователя (bind): трасса завершится вместе с ним
+                deferred = True
+                result.add_done_callback(lambda _: end_trace(trace))
+            return result
+        finally:
+            if deferred:
+                _current_trace.set(None)
+                _current_span.set(None)
+            else:
+                end_trace(trace)
+
+    return wrapper
@@ -0,0 +1,171 @@
+"""
+Приоритетные полосы обработки обновлений Telegram
+
+Команды и нажатия кнопок не ходят в нейросети и отвечают сразу, но при
+общем лимите конкурентности они ждут, пока освободятся слоты, занятые
+сообщениями, которые генерируют ответ по несколько секунд. Процессор
+обновлений делит поток на две полосы со своими лимитами:
+- control  - команды (/start, /clear, ...) и callback-кнопки;
+- messages - текстовые сообщения и все остальное.
+
+Application забирает обновление из своей очереди сразу и создает для него
+задачу, поэтому длина очереди не говорит, сколько работы накопилось.
+Webhook принимает обновление через admit(): процессор считает принятые,
+но еще не обработанные обновления, и при превышении лимита webhook
+отвечает 503. Сообщение, ответ на которое ждет в очереди пользователя,
+остается в учете до отправки ответа (defer()).
+
+Настройки (переменные окружения):
+    BOT_CONCURRENT_UPDATES  - одновременных обновлений в полосе сообщений (256)
+    BOT_CONTROL_CONCURRENCY - одновременных обновлений в полосе команд (32)
+
+Требуется python-telegram-bot >= 20.4 (BaseUpdateProcessor).
+"""
+
+import os
+import time
+import asyncio
+import logging
+from telegram.ext import BaseUpdateProcessor, filters
+
+logger = logging.getLogger(__name__)
+
+
+def is_control_update(update):
+    """
+    Относится ли обновление к полосе команд
+
+    Args:
+        update: Обновление Telegram (или произвольный объект из очереди)
+
+    Returns:
+        bool: True для callback-кнопок и команд бота
+    """
+    if getattr(update, 'callback_query', None) is not None:
+        return True
+    return getattr(update, 'effective_message', None) is not None and bool(
+        filters.COMMAND.check_update(update)
+    )
+
+
+class _Lane:
+    """Семафор и счетчики одной полосы"""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.slots = asyncio.Semaphore(limit)
+        self.running = 0
+        self.processed = 0
+        self.max_wait = 0.0
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'running': self.running,
+            'processed': self.processed,
+            'max_wait_ms': round(self.max_wait * 1000, 1)
+        }
+
+
+class LaneUpdateProcessor(BaseUpdateProcessor):
+    """Процессор обновлений с отдельной полосой для команд и кнопок"""
+
+    def __init__(self, message_concurrency=None, control_concurrency=None):
+        """
+        Args:
+            message_concurrency (int): Лимит полосы сообщений
+            control_concurrency (int): Лимит полосы команд
+        """
+        message_concurrency = message_concurrency or int(os.getenv('BOT_CONCURRENT_UPDATES', '256'))
+        control_concurrency = control_concurrency or int(os.getenv('BOT_CONTROL_CONCURRENCY', '32'))
+        # Общий семафор базового класса не должен ограничивать полосы сильнее их лимитов
+        super().__init__(message_concurrency + control_concurrency)
+        self.messages = _Lane('messages', message_concurrency)
+        self.control = _Lane('control', control_concurrency)
+        # Обновление -> сколько обработок (сам обработчик и отложенные ответы) не закончено
+        self._admitted = {}
+
+    @property
+    def pending(self):
+        """Принятые через admit() обновления, обработка которых не закончена"""
+        return len(self._admitted)
+
+    def admit(self, update, limit):
+        """
+        Принять обновление, если необработанных меньше лимита
+
+        Args:
+            update (Update): Обновление Telegram
+            limit (int): Максимум принятых, но не обработанных обновлений
+
+        Returns:
+            bool: True, если обновление принято
+        """
+        if len(self._admitted) >= limit:
+            return False
+        self._admitted[update] = self._admitted.get(update, 0) + 1
+        return True
+
+    def defer(self, update, future):
+        """
+        Оставить принятое обновление в учете, пока не завершится отложенный ответ
+
+        Args:
+            update (Update): Обновление Telegram
+            future (asyncio.Future): Ответ, поставленный в очередь пользователя
+        """
+        if update in self._admitted:
+            self._admitted[update] += 1
+            future.add_done_callback(lambda _: self.forget(update))
+
+    def forget(self, update):
+        """Снять обработку обновления с учета (закончена или не попала в очередь)"""
+        refs = self._admitted.get(update)
+        if refs is None:
+            return
+        if refs > 1:
+            self._admitted[update] = refs - 1
+        else:
+            del self._admitted[update]
+
+    async def do_process_update(self, update, coroutine):
+        """
+        Выполнить обработку обновления в его полосе
+
+        Args:
+            update: Обновление Telegram
+            coroutine: Корутина обработки из Application
+        """
+        lane = self.control if is_control_update(update) else self.messages
+        queued_at = time.monotonic()
+        try:
+            async with lane.slots:
+                lane.max_wait = max(lane.max_wait, time.monotonic() - queued_at)
+                lane.running += 1
+                try:
+                    await coroutine
+                finally:
+                    lane.running -= 1
+                    lane.processed += 1
+        finally:
+            self.forget(update)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        """
+        Счетчики полос
+
+        Returns:
+            dict: {'control': {...}, 'messages': {...}, 'pending': ...}
+        """
+        return {
+            'control': self.control.stats(),
+            'messages': self.messages.stats(),
+            'pending': self.pending
+        }
@@ -0,0 +1,251 @@
+"""
+Прием обновлений Telegram через webhook
+
+Вместо long polling Telegram сам отправляет каждое обновление POST-запросом
+на наш адрес, поэтому обновление приходит без задержки опроса, а несколько
+экземпляров бота можно поставить за балансировщиком.
+
+Встроенный HTTP-сервер (asyncio, без сторонних зависимостей):
+- принимает только POST на WEBHOOK_PATH;
+- проверяет заголовок X-Telegram-Bot-Api-Secret-Token;
+- кладет обновление в очередь приложения и сразу отвечает 200; если
+  принятых, но еще не обработанных обновлений больше WEBHOOK_QUEUE_SIZE,
+  отвечает 503 - Telegram повторит доставку позже.
+HTTPS завершается на балансировщике или обратном прокси перед ботом.
+
+Настройки (переменные окружения):
+    WEBHOOK_URL         - внешний адрес бота, например https://bot.example.com
+    WEBHOOK_PATH        - путь, на который Telegram шлет обновления (/telegram)
+    WEBHOOK_LISTEN      - адрес локального сервера (0.0.0.0)
+    WEBHOOK_PORT        - порт локального сервера (8443)
+    WEBHOOK_SECRET      - секрет для проверки запросов (обязателен, если
+                          экземпляров несколько; иначе генерируется при запуске)
+    WEBHOOK_QUEUE_SIZE  - максимум необработанных обновлений (1000)
+"""
+
+import os
+import json
+import hmac
+import signal
+import asyncio
+import secrets
+import logging
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+MAX_BODY_SIZE = 1024 * 1024
+
+_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    503: 'Service Unavailable'
+}
+
+
+def webhook_queue_size():
+    """
+    Returns:
+        int: Максимум необработанных обновлений (и размер очереди для
+             Application.builder().update_queue())
+    """
+    return int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+
+
+class WebhookServer:
+    """HTTP-сервер, принимающий обновления Telegram в очередь приложения"""
+
+    def __init__(self, application, path=None, listen=None, port=None, secret_token=None):
+        """
+        Args:
+            application (Application): Приложение python-telegram-bot
+            path (str): Путь webhook
+            listen (str): Адрес, на котором слушать
+            port (int): Порт
+            secret_token (str): Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+        """
+        self.application = application
+        self.path = '/' + (path or os.getenv('WEBHOOK_PATH', '/telegram')).lstrip('/')
+        self.listen = listen or os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+        self.port = port or int(os.getenv('WEBHOOK_PORT', '8443'))
+        self.secret_token = secret_token or os.getenv('WEBHOOK_SECRET')
+        if not self.secret_token:
+            self.secret_token = secrets.token_urlsafe(32)
+            logger.warning("⚠️ WEBHOOK_SECRET не задан, сгенерирован секрет на время работы процесса")
+
+        self.max_pending = webhook_queue_size()
+        self._server = None
+        self.accepted = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    async def start(self):
+        """Начать прием запросов"""
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        logger.info(f"🌍 Webhook слушает http://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Остановить прием запросов"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        """Обработать запросы одного соединения (keep-alive)"""
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                status = self._dispatch(*request)
+                keep_alive = request[2].get('connection', '').lower() != 'close'
+                self._write_response(writer, status, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        """
+        Прочитать HTTP-запрос
+
+        Returns:
+            tuple: (метод, путь, заголовки, тело) или None, если соединение закрыто
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', '0'))
+        if length > MAX_BODY_SIZE:
+            raise ValueError('request body too large')
+        body = await reader.readexactly(length) if length else b''
+        return method, target.split('?', 1)[0], headers, body
+
+    def _dispatch(self, method, path, headers, body):
+        """
+        Проверить запрос и поставить обновление в очередь
+
+        Returns:
+            int: HTTP-статус ответа
+        """
+        if path != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, ''), self.secret_token):
+            self.rejected += 1
+            logger.warning("⚠️ Webhook: запрос с неверным секретом отклонен")
+            return 403
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400
+
+        # С конкурентной обработкой (LaneUpdateProcessor) очередь приложения
+        # почти всегда пуста: лимит считается по незавершенным обновлениям
+        processor = self.application.update_processor
+        admit = getattr(processor, 'admit', None)
+        if admit is not None and not admit(update, self.max_pending):
+            return self._overloaded()
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            if admit is not None:
+                processor.forget(update)
+            return self._overloaded()
+
+        self.accepted += 1
+        return 200
+
+    def _overloaded(self):
+        """Отказать в приеме: бот не успевает обрабатывать обновления"""
+        self.dropped += 1
+        logger.warning("⚠️ Webhook: слишком много необработанных обновлений, Telegram повторит доставку")
+        return 503
+
+    @staticmethod
+    def _write_response(writer, status, keep_alive):
+        """Отправить ответ без тела"""
+        headers = [
+            f'HTTP/1.1 {status} {_REASONS[status]}',
+            'Content-Length: 0',
+            'Connection: ' + ('keep-alive' if keep_alive else 'close')
+        ]
+        if status == 503:
+            headers.append('Retry-After: 1')
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1'))
+
+    def stats(self):
+        """
+        Счетчики webhook
+
+        Returns:
+            dict: Принято, отклонено по секрету, сброшено из-за переполнения,
+                  текущая длина очереди, принято и еще не обработано
+        """
+        return {
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+            'queued': self.application.update_queue.qsize(),
+            'pending': getattr(self.application.update_processor, 'pending', 0)
+        }
+
+
+async def run_webhook(application, on_shutdown=None, on_startup=None):
+    """
+    Запустить бота в режиме webhook (до SIGINT/SIGTERM)
+
+    Args:
+        application (Application): Приложение, собранное с ограниченной очередью
+        on_shutdown (callable): Корутина on_shutdown(application) после остановки
+        on_startup (callable): Корутина on_startup(application) перед приемом обновлений
+    """
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if not webhook_url:
+        raise ValueError("❌ Для режима webhook необходимо указать WEBHOOK_URL в .env файле")
+
+    server = WebhookServer(application)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        await application.bot.set_webhook(
+            url=webhook_url.rstrip('/') + server.path,
+            secret_token=server.secret_token,
+            allowed_updates=Update.ALL_TYPES
+        )
+        await application.start()
+        if on_startup is not None:
+            await on_startup(application)
+        await server.start()
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+            logger.info(f"🌍 Webhook: {server.stats()}")
+            await application.stop()
+            if on_shutdown is not None:
+                await on_shutdown(application)